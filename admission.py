@@ -0,0 +1,122 @@
+"""
+This module contains the admission controller, which decides how many TALYS
+processes may run at once. The number is adapted to the free memory, the
+load average and the free disk space in the run directory, and is never
+above the number given by --processes.
+"""
+
+from __future__ import division
+import os
+import time
+
+MB = 1024*1024
+
+
+def memory_available():
+    """ The available memory in bytes, or None if unknown
+
+    Algorithm:  Read MemAvailable from /proc/meminfo, which accounts for
+                caches that can be freed. Fall back to the free pages
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])*1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def disk_free(directory):
+    """ The free disk space in bytes available to us in the directory """
+    stat = os.statvfs(directory)
+    return stat.f_bavail*stat.f_frsize
+
+
+class AdmissionController(object):
+    """ Adapts the number of concurrent TALYS processes """
+
+    def __init__(self, maximum, directory, logger, min_memory=500*MB,
+                 min_disk=1000*MB, max_load=None, interval=5):
+        """ Parameters: maximum: the largest number of processes allowed
+                        directory: the run directory, whose disk is watched
+                        logger: the logger to report changes to
+                        min_memory: memory in bytes to always leave free
+                        min_disk: pause when less disk than this is free
+                        max_load: do not start more processes when the load
+                                  average is above this. Default is maximum
+                        interval: seconds between each measurement
+        """
+        self.maximum = maximum
+        self.directory = directory
+        self.logger = logger
+        self.min_memory = min_memory
+        self.min_disk = min_disk
+        self.max_load = max_load if max_load is not None else maximum
+        self.interval = interval
+        self.limit = maximum
+        self.last_update = 0
+        self.paused = False
+
+    def target(self, running, job_memory):
+        """ The number of processes the resources allow
+
+        Parameters: running: the number of running processes
+                    job_memory: the largest memory in bytes used by a
+                                TALYS process so far, or 0 if unknown
+        Returns:    The target number of processes, 0 if dispatch shall pause
+        Algorithm:  Pause if the disk is nearly full. If less memory than
+                    min_memory is available, drain one process. Otherwise,
+                    allow as many new processes as fit in the free memory.
+                    A high load average keeps the number from growing
+        """
+        free_disk = disk_free(self.directory)
+        if free_disk < self.min_disk:
+            if not self.paused:
+                self.logger.warning("Only %d MB free disk. Pausing",
+                                    free_disk // MB)
+            self.paused = True
+            return 0
+        if self.paused:
+            self.logger.info("%d MB free disk. Resuming", free_disk // MB)
+        self.paused = False
+
+        target = self.maximum
+        available = memory_available()
+        if available is not None:
+            spare = available - self.min_memory
+            if spare < 0:
+                target = running - 1
+            elif job_memory:
+                target = running + int(spare // job_memory)
+        if hasattr(os, "getloadavg") and os.getloadavg()[0] > self.max_load:
+            target = min(target, running)
+        return max(1, min(self.maximum, target))
+
+    def update(self, running, job_memory=0):
+        """ Measure the resources, at most once every interval
+
+        Parameters: running: the number of running processes
+                    job_memory: the largest memory in bytes used by a
+                                TALYS process so far, or 0 if unknown
+        Returns:    The number of processes allowed, 0 if paused
+        Algorithm:  Lower the limit at once, but raise it by one at a time
+                    so a burst of new processes does not overshoot
+        """
+        now = time.time()
+        if now - self.last_update < self.interval:
+            return 0 if self.paused else self.limit
+        self.last_update = now
+        target = self.target(running, job_memory)
+        if target == 0:
+            return 0
+        new_limit = min(target, self.limit + 1)
+        if new_limit != self.limit:
+            self.logger.info("Running at most %s TALYS at once, was %s",
+                             new_limit, self.limit)
+        self.limit = new_limit
+        return self.limit
@@ -0,0 +1,137 @@
+"""
+This module contains the functions for pinning the TALYS processes to
+dedicated cores. Only the cores in the set given to the launcher by
+sched_getaffinity (e.g. by a cgroup or the queue system) are used. If the
+platform does not support setting the affinity, pinning does nothing.
+"""
+
+import glob
+import os
+import multiprocessing
+
+
+def parse_cpulist(text):
+    """ Parse a Linux cpulist such as "0-3,8,10-11"
+
+    Parameters: text: the cpulist
+    Returns:    A list over the cpus
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end)+1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus():
+    """ The cpus this process is allowed to run on
+
+    Returns:    A sorted list over the cpus
+    Algorithm:  Use sched_getaffinity, which respects cgroups and the
+                binding done by the queue system. Fall back to all cpus
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def rank_processes(processes):
+    """ The number of TALYS processes run by an MPI rank
+
+    Parameters: processes: the value of -p. None if not given, 0 if given
+                           without a number
+    Returns:    1 without -p, every cpu available to the rank with -p alone,
+                and N with -p N
+    """
+    if processes is None:
+        return 1
+    if processes == 0:
+        return len(available_cpus())
+    return processes
+
+
+def numa_nodes():
+    """ The cpus of each NUMA node
+
+    Returns:    A list over the cpus of each node, or an empty list if the
+                information is not available
+    Algorithm:  Read /sys/devices/system/node/node*/cpulist
+    """
+    nodes = []
+    paths = glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")
+    for path in sorted(paths, key=lambda p: int(p.split("node")[-1].split("/")[0])):
+        try:
+            with open(path) as cpulist:
+                nodes.append(parse_cpulist(cpulist.read()))
+        except (IOError, OSError, ValueError):
+            return []
+    return nodes
+
+
+def placement_order(cpus, spread=False):
+    """ The order in which the cpus are given to the TALYS processes
+
+    Parameters: cpus: the available cpus
+                spread: spread the processes across the NUMA nodes
+    Returns:    A list over the cpus
+    Algorithm:  If spread, take one cpu from each NUMA node in turn, so
+                the processes share the memory bandwidth of every node.
+                Otherwise, fill the cpus in order
+    """
+    cpus = sorted(cpus)
+    if not spread:
+        return cpus
+    available = set(cpus)
+    nodes = [[cpu for cpu in node if cpu in available] for node in numa_nodes()]
+    nodes = [node for node in nodes if node]
+    if len(nodes) < 2:
+        return cpus
+    order = []
+    for i in range(max(len(node) for node in nodes)):
+        for node in nodes:
+            if i < len(node):
+                order.append(node[i])
+    # cpus not listed in any node are put last
+    placed = set(order)
+    order.extend(cpu for cpu in cpus if cpu not in placed)
+    return order
+
+
+def pin(pid, cpu):
+    """ Pin the process to the cpu. Does nothing if not supported """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, [cpu])
+
+
+def mpi_local_placement(comm, MPI, spread=False):
+    """ Find the cpu for this rank's TALYS process
+
+    Must be called by every rank, as it is collective.
+    Parameters: comm: the MPI communicator
+                MPI: the mpi4py.MPI module
+                spread: spread the processes across the NUMA nodes
+    Returns:    (cpu, number of ranks on the node, number of cpus on the node)
+    Algorithm:  Split the communicator by node and gather the cpus of every
+                rank on the node. If the rank is bound to a single cpu by
+                mpirun, use it. Otherwise, the local rank decides which of
+                the cpus to use, so no two ranks on the node share one
+    """
+    local = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    cpus = available_cpus()
+    node_cpus = set()
+    for rank_cpus in local.allgather(cpus):
+        node_cpus.update(rank_cpus)
+    local_rank = local.Get_rank()
+    local_size = local.Get_size()
+    local.Free()
+    if len(cpus) == 1:
+        cpu = cpus[0]
+    else:
+        order = placement_order(cpus, spread)
+        cpu = order[local_rank % len(order)]
+    return cpu, local_size, len(node_cpus)
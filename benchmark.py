@@ -0,0 +1,285 @@
+#! /usr/bin/python
+"""
+Measures the throughput of the launcher with the fake TALYS in faketalys.py.
+For each size of the plan and each mode, a sweep is run in a temporary
+directory and the wall time, the jobs per second and the overhead per job are
+recorded. The results are appended to a JSON file and compared with the
+previous results in it, so a change making the launcher slower is noticed.
+Syntax:
+python benchmark.py [--jobs 1000 10000 100000] [--modes serial processes
+                    multi dummy mpi] [-p N] [--time SECONDS]
+
+The modes are
+    serial      python talys.py
+    processes   python talys.py -p N
+    multi       python talys.py -p N --multi mass
+    dummy       python talys.py --dummy
+    mpi         mpirun -np N+1 python talys.py, if mpirun and mpi4py exist
+
+The overhead per job is the wall time of the sweep minus the time spent in
+the fake TALYS, divided by the number of jobs.
+"""
+
+from __future__ import print_function, division
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from tools import which
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ("serial", "processes", "multi", "dummy", "mpi")
+
+
+def make_input(jobs):
+    """ Make the input of a sweep with the given number of jobs
+
+    Parameters: jobs: the number of TALYS jobs
+    Returns:    The input as a dict, ready to be written as JSON
+    Algorithm:  Use ten masses of Dy if the number is divisible by ten, else
+                one. The rest of the jobs come from varying gnorm
+    """
+    masses = 10 if jobs % 10 == 0 else 1
+    values = jobs // masses
+    return {"keywords": {"projectile": "n",
+                         "element": ["Dy"],
+                         "mass": {"Dy": list(range(160, 160+masses))},
+                         "energy": "energies.txt",
+                         "astro": "y",
+                         "ejectiles": "n g",
+                         "gnorm": [round(0.5 + i*1e-5, 5) for i in range(values)]},
+            "script_keywords": {"energy_start": "0.0025E-03",
+                                "energy_stop": "5000E-03",
+                                "N": 10,
+                                "input_file": "input.txt",
+                                "output_file": "output.txt",
+                                "result_files": ["astrorate.g", "astrorate.tot"]}}
+
+
+def install_talys(directory):
+    """ Write an executable named talys running faketalys.py
+
+    Parameters: directory: the directory to put it in
+    Returns:    The path to the executable
+    Algorithm:  A shell script starting faketalys.py with this Python. The
+                comment lets tools.talys_version() recognize it
+    """
+    path = os.path.join(directory, "talys")
+    with open(path, "w") as outfile:
+        outfile.write("#!/bin/sh\n"
+                      "# massmodel pshiftadjust\n"
+                      'exec "{}" "{}"\n'.format(sys.executable,
+                                                os.path.join(HERE, "faketalys.py")))
+    os.chmod(path, 0o755)
+    return path
+
+
+def command(mode, processes, spawn=None):
+    """ The command running talys.py in the given mode, or None if the mode
+    can not be run here """
+    talys = [sys.executable, os.path.join(HERE, "talys.py"),
+             "--ifile", "benchmark.json"]
+    if spawn is not None:
+        talys += ["--spawn", spawn]
+    if mode == "serial":
+        return talys
+    elif mode == "processes":
+        return talys + ["-p", str(processes)]
+    elif mode == "multi":
+        return talys + ["-p", str(processes), "--multi", "mass"]
+    elif mode == "dummy":
+        return talys + ["--dummy"]
+    elif mode == "mpi":
+        try:
+            import mpi4py
+        except ImportError:
+            return None
+        if which("mpirun") is None:
+            return None
+        return ["mpirun", "-np", str(processes+1)] + talys
+    raise ValueError("Unknown mode {}".format(mode))
+
+
+def count_results(directory, mode):
+    """ Count the completed jobs of the sweep run in the directory """
+    if mode == "dummy":
+        return len(os.listdir(os.path.join(directory, "indices")))
+    count = 0
+    for root, dirs, files in os.walk(directory):
+        count += sum(1 for name in files if name.endswith("astrorate.g")
+                     and "results_data" in root)
+    return count
+
+
+def run(mode, jobs, processes, talys_time, talys_mode, keep=False,
+        spawn=None):
+    """ Run one sweep and measure it
+
+    Parameters: mode: one of MODES
+                jobs: the number of jobs
+                processes: the number of processes for the parallel modes
+                talys_time: the seconds the fake TALYS spends on each job
+                talys_mode: "sleep" or "burn"
+                keep: do not remove the directory of the sweep
+                spawn: the --spawn of talys.py, or None for its default
+    Returns:    A dict over the measurements, or None if the mode can not be
+                run here
+    """
+    cmd = command(mode, processes, spawn)
+    if cmd is None:
+        return None
+    directory = tempfile.mkdtemp(prefix="talys-benchmark-")
+    try:
+        with open(os.path.join(directory, "benchmark.json"), "w") as outfile:
+            json.dump(make_input(jobs), outfile)
+        bindir = os.path.join(directory, "bin")
+        os.mkdir(bindir)
+        install_talys(bindir)
+        # The MPI ranks copy talys from the current directory
+        install_talys(directory)
+        env = dict(os.environ)
+        env["PATH"] = bindir + os.pathsep + env.get("PATH", "")
+        env["FAKETALYS_TIME"] = str(talys_time)
+        env["FAKETALYS_MODE"] = talys_mode
+        with open(os.path.join(directory, "stdout.txt"), "w") as stdout:
+            start = time.time()
+            returncode = subprocess.call(cmd, cwd=directory, env=env,
+                                         stdout=stdout, stderr=subprocess.STDOUT)
+            wall = time.time() - start
+        completed = count_results(directory, mode)
+    finally:
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+        else:
+            print("Kept", directory)
+
+    slots = 1 if mode in ("serial", "dummy") else processes
+    talys_seconds = 0 if mode == "dummy" else jobs*talys_time/slots
+    return {"mode": mode,
+            "jobs": jobs,
+            "processes": slots,
+            "completed": completed,
+            "returncode": returncode,
+            "seconds": round(wall, 3),
+            "jobs_per_second": round(completed/wall, 3) if wall > 0 else 0,
+            "overhead_ms": round((wall - talys_seconds)/max(jobs, 1)*1000*slots, 3)}
+
+
+def git_commit():
+    """ The commit being benchmarked, or None outside git """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=HERE).decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, tolerance):
+    """ Find the results which got slower
+
+    Parameters: previous: the results of an earlier benchmark
+                current: the results of this benchmark
+                tolerance: the fraction the throughput may drop by
+    Returns:    A list over messages, one for each regression
+    """
+    old = dict(((r["mode"], r["jobs"], r["processes"]), r) for r in previous)
+    regressions = []
+    for result in current:
+        key = (result["mode"], result["jobs"], result["processes"])
+        if key not in old or not old[key]["jobs_per_second"]:
+            continue
+        ratio = result["jobs_per_second"]/old[key]["jobs_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append("{} with {} jobs: {} jobs/s, was {} ({:+.0%})".format(
+                result["mode"], result["jobs"], result["jobs_per_second"],
+                old[key]["jobs_per_second"], ratio - 1))
+    return regressions
+
+
+def print_table(results):
+    print("{:<10} {:>8} {:>5} {:>10} {:>10} {:>12} {:>13}".format(
+        "Mode", "Jobs", "N", "Completed", "Wall [s]", "Jobs/s", "Overhead [ms]"))
+    for r in results:
+        print("{mode:<10} {jobs:>8} {processes:>5} {completed:>10} "
+              "{seconds:>10.2f} {jobs_per_second:>12.2f} {overhead_ms:>13.3f}".format(**r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=("Measure the throughput of "
+                                                  "the launcher with a fake "
+                                                  "TALYS"))
+    parser.add_argument("--jobs", help="the sizes of the plans",
+                        type=int, nargs="+", default=[1000], metavar="N")
+    parser.add_argument("--modes", help="the modes to run",
+                        nargs="+", default=["serial", "processes", "dummy"],
+                        choices=MODES)
+    parser.add_argument("-p", "--processes",
+                        help="the number of processes for the parallel modes",
+                        type=int, default=max(2, multiprocessing.cpu_count()))
+    parser.add_argument("--time", help="the seconds the fake TALYS spends on a job",
+                        type=float, default=0.0, dest="talys_time")
+    parser.add_argument("--burn", help="keep a core busy instead of sleeping",
+                        action="store_true")
+    parser.add_argument("-o", "--output", help="the file to append the results to",
+                        default="benchmarks.json")
+    parser.add_argument("--compare",
+                        help=("the file with the results to compare with."
+                              " Default is the last run in --output"),
+                        default=None, metavar="FILE")
+    parser.add_argument("--tolerance",
+                        help="the fraction the throughput may drop by",
+                        type=float, default=0.2)
+    parser.add_argument("--spawn", help="how talys.py starts TALYS",
+                        choices=["session", "preexec"], default=None)
+    parser.add_argument("--keep", help="keep the directories of the sweeps",
+                        action="store_true")
+    args = parser.parse_args()
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as infile:
+            history = json.load(infile)
+    baseline = history[-1]["results"] if history else []
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)[-1]["results"]
+
+    results = []
+    for jobs in args.jobs:
+        for mode in args.modes:
+            print("Running {} jobs in {} mode".format(jobs, mode))
+            result = run(mode, jobs, args.processes, args.talys_time,
+                         "burn" if args.burn else "sleep", args.keep,
+                         args.spawn)
+            if result is None:
+                print("Skipping {}: not available here".format(mode))
+                continue
+            if result["returncode"] or result["completed"] != jobs:
+                print("Warning: {} of {} jobs completed, exit code {}".format(
+                    result["completed"], jobs, result["returncode"]))
+            results.append(result)
+    print_table(results)
+
+    history.append({"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "commit": git_commit(),
+                    "host": platform.node(),
+                    "python": platform.python_version(),
+                    "cpus": multiprocessing.cpu_count(),
+                    "talys_time": args.talys_time,
+                    "spawn": args.spawn,
+                    "results": results})
+    with open(args.output, "w") as outfile:
+        json.dump(history, outfile, indent=4)
+    print("Results appended to", args.output)
+
+    regressions = compare(baseline, results, args.tolerance)
+    if regressions:
+        print("Slower than before:")
+        print("\n".join(regressions))
+        sys.exit(1)
@@ -0,0 +1,310 @@
+"""
+This module keeps the catalog of a sweep: an SQLite database named
+catalog.sqlite in the run directory, with a row for every job. The catalog
+holds the isotope, the value of every keyword, the status, the timings, the
+worker and the paths of the results of each job, so questions about a sweep
+are queries instead of walks through the directories, e.g.
+
+    sqlite3 catalog.sqlite "SELECT name, seconds FROM jobs
+                            WHERE status = 'failed'"
+
+The tables are
+    jobs        one row for each job: element, mass, name, round (of the
+                refinement), status (planned, running, done, failed, timed
+                out or duplicate), runs (the TALYS runs of the job, more than
+                one with --energy-chunks), work_directory, result_directory,
+                host, planned, started and finished (as Unix times), seconds,
+                attempts, errors and duplicate_of
+    parameters  the TALYS keywords of each job: job_id, keyword, value, and
+                varying, which is 1 for the keywords of the sweep
+    results     the result files of each job: job_id, file and path
+    run         information about the sweep: key and value
+
+Any process reports to the catalog, but only the launcher writes it. The
+reports are collected in a list shared with the children and written in one
+transaction every few seconds. --resume reads the catalog of the previous
+sweep and skips the jobs done there.
+"""
+
+from __future__ import division
+import os
+import sqlite3
+import threading
+import time
+
+FILENAME = "catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    element TEXT NOT NULL,
+    mass INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    round INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 1,
+    completed_runs INTEGER NOT NULL DEFAULT 0,
+    work_directory TEXT,
+    result_directory TEXT,
+    host TEXT,
+    planned REAL,
+    started REAL,
+    finished REAL,
+    seconds REAL,
+    attempts INTEGER,
+    errors TEXT,
+    duplicate_of TEXT,
+    UNIQUE (element, mass, name)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS parameters (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    keyword TEXT NOT NULL,
+    value TEXT NOT NULL,
+    varying INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parameters_by_job ON parameters (job_id);
+CREATE INDEX IF NOT EXISTS parameters_by_value ON parameters (keyword, value);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    file TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_job ON results (job_id);
+CREATE TABLE IF NOT EXISTS run (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Later statuses are not overwritten by a run of the job finishing
+FINISH = """
+UPDATE jobs SET
+    completed_runs = completed_runs + 1,
+    seconds = COALESCE(seconds, 0) + :seconds,
+    started = MIN(COALESCE(started, :started), :started),
+    finished = MAX(COALESCE(finished, :finished), :finished),
+    host = :host,
+    attempts = MAX(COALESCE(attempts, 0), :attempts),
+    errors = CASE WHEN :errors = '' THEN errors
+                  ELSE COALESCE(errors || '\n', '') || :errors END,
+    status = CASE WHEN :timed_out THEN 'timed out'
+                  WHEN status = 'timed out' THEN status
+                  WHEN :failed THEN 'failed'
+                  WHEN status = 'failed' THEN status
+                  WHEN completed_runs + 1 >= runs THEN 'done'
+                  ELSE 'running' END
+WHERE element = :element AND mass = :mass AND name = :name
+"""
+
+INSERT_JOB = """
+INSERT INTO jobs (element, mass, name, round, status, runs, work_directory,
+                  result_directory, planned)
+VALUES (:element, :mass, :name, :round, :status, :runs, :work_directory,
+        :result_directory, :planned)
+"""
+
+# Starts the job afresh, as if planned for the first time
+REPLAN_JOB = """
+UPDATE jobs SET
+    round = :round, status = :status, runs = :runs, completed_runs = 0,
+    work_directory = :work_directory, result_directory = :result_directory,
+    host = NULL, planned = :planned, started = NULL, finished = NULL,
+    seconds = NULL, attempts = NULL, errors = NULL, duplicate_of = NULL
+WHERE id = :id
+"""
+
+
+def job_key(element, mass, name):
+    """ The columns identifying a job """
+    return {"element": str(element), "mass": int(float(mass)), "name": name or ""}
+
+
+def completed_jobs(path):
+    """ Read the jobs done in an earlier sweep, including the duplicates of
+    jobs done
+
+    Parameters: path: the path of the catalog
+    Returns:    {(element, mass, name): {file: path of the result}}
+    """
+    connection = sqlite3.connect(path)
+    try:
+        done = {}
+        rows = connection.execute(
+            "SELECT jobs.element, jobs.mass, jobs.name, results.file, results.path "
+            "FROM jobs LEFT JOIN results ON results.job_id = jobs.id "
+            "WHERE jobs.status = 'done' OR (jobs.status = 'duplicate' AND EXISTS "
+            "(SELECT 1 FROM jobs AS first WHERE first.element = jobs.element "
+            "AND first.mass = jobs.mass AND first.name = jobs.duplicate_of "
+            "AND first.status = 'done'))")
+        for element, mass, name, filename, result in rows:
+            results = done.setdefault((element, mass, name), {})
+            if filename is not None:
+                results[filename] = result
+        return done
+    finally:
+        connection.close()
+
+
+class Catalog(object):
+    """ Writes the catalog of a sweep from the reports of every process """
+
+    def __init__(self, directory, events=None, interval=2):
+        """ Parameters: directory: the run directory to write the catalog to
+                        events: a list shared with the children, such as
+                                multiprocessing.Manager().list(), or None if
+                                only this process reports
+                        interval: seconds between each write
+        """
+        self.path = os.path.join(directory, FILENAME)
+        self.events = events if events is not None else []
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.connection = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def planned(self, element, mass, name, work_directory, result_directory,
+                keywords, varying, result_files, round=0, runs=1):
+        """ Report a planned job. Any process may call it
+
+        Parameters: element, mass, name: the job
+                    work_directory, result_directory: its directories
+                    keywords: {keyword: value} of its TALYS input
+                    varying: the keywords varied by the sweep
+                    result_files: {file: path} of the results to collect
+                    round: the round of the refinement
+                    runs: the number of TALYS runs the job is split into
+        """
+        self.events.append(("plan", job_key(element, mass, name), {
+            "round": round, "runs": runs,
+            "work_directory": os.path.abspath(work_directory),
+            "result_directory": os.path.abspath(result_directory),
+            "planned": time.time(),
+            "parameters": sorted((str(key), str(value), key in varying)
+                                 for key, value in keywords.items()),
+            "results": sorted((filename, os.path.abspath(path))
+                              for filename, path in result_files.items())}))
+
+    def finished(self, element, mass, name, seconds, failed=False,
+                 timed_out=False, host="", attempts=1, errors=(), started=None):
+        """ Report that a TALYS run of the job finished. Any process may
+        call it """
+        finished = time.time()
+        self.events.append(("finish", job_key(element, mass, name), {
+            "seconds": seconds, "failed": bool(failed),
+            "timed_out": bool(timed_out), "host": host, "attempts": attempts,
+            "errors": "\n".join(errors), "finished": finished,
+            "started": started if started is not None else finished - seconds}))
+
+    def duplicate(self, element, mass, name, first):
+        """ Report that the job has the same input as the job named first """
+        self.events.append(("status", job_key(element, mass, name),
+                            {"status": "duplicate", "duplicate_of": first}))
+
+    def resumed(self, element, mass, name, keywords, varying, results, round=0):
+        """ Report a job done in the sweep resumed from
+
+        Parameters: element, mass, name: the job
+                    keywords, varying, round: as for planned()
+                    results: {file: path} of its results in that sweep
+        """
+        self.events.append(("resume", job_key(element, mass, name), {
+            "round": round,
+            "parameters": sorted((str(key), str(value), key in varying)
+                                 for key, value in keywords.items()),
+            "results": sorted(results.items())}))
+
+    def set_info(self, key, value):
+        """ Store information about the sweep, e.g. the input file """
+        self.events.append(("info", {"key": key}, {"value": str(value)}))
+
+    def open(self):
+        """ Create the database, if not there """
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(self.path,
+                                                  check_same_thread=False)
+                self.connection.executescript(SCHEMA)
+
+    def flush(self):
+        """ Write the reports received since the last time
+
+        Algorithm:  Only the reports present when starting are removed, as
+                    the children may append more meanwhile. They are written
+                    in one transaction, in the order they were reported
+        """
+        count = len(self.events)
+        if not count:
+            return
+        events = self.events[:count]
+        del self.events[:count]
+        self.open()
+        with self.lock:
+            with self.connection:
+                for kind, key, fields in events:
+                    self.apply(kind, key, fields)
+
+    def apply(self, kind, key, fields):
+        """ Write one report. Called by flush """
+        db = self.connection
+        if kind == "info":
+            db.execute("INSERT OR REPLACE INTO run (key, value) VALUES (?, ?)",
+                       (key["key"], fields["value"]))
+        elif kind in ("plan", "resume"):
+            values = dict(key)
+            values.update(fields)
+            if kind == "plan":
+                values["status"] = "planned"
+            else:
+                values.update({"status": "done", "runs": 1, "planned": None,
+                               "work_directory": None, "result_directory": None})
+            # A job planned again, e.g. by a round of the refinement, keeps
+            # its id, and its parameters and results are replaced
+            row = db.execute("SELECT id FROM jobs WHERE element = :element "
+                             "AND mass = :mass AND name = :name", values).fetchone()
+            if row is None:
+                job_id = db.execute(INSERT_JOB, values).lastrowid
+            else:
+                job_id = values["id"] = row[0]
+                db.execute(REPLAN_JOB, values)
+                db.execute("DELETE FROM parameters WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+            db.executemany("INSERT INTO parameters (job_id, keyword, value, varying) "
+                           "VALUES (?, ?, ?, ?)",
+                           [(job_id, k, v, int(varying))
+                            for k, v, varying in fields.get("parameters", [])])
+            db.executemany("INSERT INTO results (job_id, file, path) VALUES (?, ?, ?)",
+                           [(job_id, f, p) for f, p in fields["results"]])
+        elif kind == "finish":
+            values = dict(key)
+            values.update(fields)
+            db.execute(FINISH, values)
+        elif kind == "status":
+            values = dict(key)
+            values.update(fields)
+            db.execute("UPDATE jobs SET status = :status, duplicate_of = :duplicate_of "
+                       "WHERE element = :element AND mass = :mass AND name = :name",
+                       values)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        """ Write the reports every interval seconds in a thread """
+        self.open()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the thread and write the last reports """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,168 @@
+"""
+This module lets a running sweep be paused, resumed and resized without
+restarting it. Commands are given either by signals to the launcher
+
+    kill -USR1 PID      pause: finish the running jobs, but start no new ones
+    kill -USR2 PID      resume
+
+or by writing a line to the control FIFO in the run directory
+
+    echo pause > TALYS-calculations-.../control
+    echo freeze > ...       pause, and stop the running TALYS processes
+    echo resume > ...       continue, also the stopped TALYS processes
+    echo processes 4 > ...  run at most 4 TALYS processes at once
+    echo status > ...       log the current state
+
+Stopping and continuing the running TALYS processes is done by sending
+SIGSTOP and SIGCONT to their process groups, so it only works for the
+processes started on this node.
+"""
+
+import errno
+import multiprocessing
+import os
+import signal
+import stat
+import threading
+import time
+
+# Note that the Manager's logger filters out messages containing "process"
+
+
+class Control(object):
+    """ The shared pause and resize state of a sweep """
+
+    def __init__(self, processes, logger, talys_pids, max_processes=None):
+        """ Parameters: processes: the number of processes to start with
+                        logger: the logger to report to
+                        talys_pids: a shared list over the PIDs of the
+                                    running TALYS processes
+                        max_processes: the largest number allowed, or None
+        """
+        self.logger = logger
+        self.talys_pids = talys_pids
+        self.max_processes = max_processes
+        # Shared with the children, in case they dispatch jobs
+        self.paused = multiprocessing.Value('i', 0)
+        self.frozen = multiprocessing.Value('i', 0)
+        self.processes = multiprocessing.Value('i', processes)
+        self.fifo = None
+
+    def pause(self, freeze=False):
+        """ Stop starting new jobs, and stop the running ones if freeze """
+        self.paused.value = 1
+        if freeze:
+            self.frozen.value = 1
+            self.signal_talys(signal.SIGSTOP)
+            self.logger.info("Paused. The running TALYS are stopped")
+        else:
+            self.logger.info("Paused. The running jobs will finish")
+
+    def resume(self):
+        """ Continue the stopped TALYS processes and start new jobs """
+        if self.frozen.value:
+            self.frozen.value = 0
+            self.signal_talys(signal.SIGCONT)
+        self.paused.value = 0
+        self.logger.info("Resumed")
+
+    def resize(self, processes):
+        """ Change the number of TALYS processes running at once
+
+        Algorithm:  The running jobs are not stopped when shrinking; no new
+                    jobs are started until fewer are running than the new
+                    number
+        """
+        processes = max(1, processes)
+        if self.max_processes is not None and processes > self.max_processes:
+            self.logger.warning("Can not run more than %s TALYS at once",
+                                self.max_processes)
+            processes = self.max_processes
+        self.logger.info("Running at most %s TALYS at once, was %s",
+                         processes, self.processes.value)
+        self.processes.value = processes
+
+    def signal_talys(self, signum):
+        """ Send a signal to the process group of each running TALYS """
+        for pid in list(self.talys_pids):
+            try:
+                os.killpg(pid, signum)
+            except OSError:
+                # Already terminated
+                pass
+
+    def command(self, line):
+        """ Run a command given as text. Unknown commands are logged """
+        words = line.split()
+        if not words:
+            return
+        if words[0] == "pause":
+            self.pause()
+        elif words[0] == "freeze":
+            self.pause(freeze=True)
+        elif words[0] == "resume":
+            self.resume()
+        elif words[0] == "processes" and len(words) == 2 and words[1].isdigit():
+            self.resize(int(words[1]))
+        elif words[0] == "status":
+            self.logger.info("%s, at most %s TALYS at once, %s TALYS running",
+                             "paused" if self.paused.value else "running",
+                             self.processes.value, len(self.talys_pids))
+        else:
+            self.logger.warning("Unknown command: %s", line.strip())
+
+    def install_signals(self):
+        """ Pause on SIGUSR1 and resume on SIGUSR2
+
+        Algorithm:  The handlers only change the shared state and do not log,
+                    as the signal may arrive while the logger holds its lock
+        """
+        def pause(signum, frame):
+            self.paused.value = 1
+
+        def resume(signum, frame):
+            if self.frozen.value:
+                self.frozen.value = 0
+                self.signal_talys(signal.SIGCONT)
+            self.paused.value = 0
+
+        signal.signal(signal.SIGUSR1, pause)
+        signal.signal(signal.SIGUSR2, resume)
+
+    def listen(self, path):
+        """ Create the control FIFO and read commands from it in a thread
+
+        Parameters: path: the path of the FIFO
+        Returns:    None
+        Algorithm:  Opening a FIFO blocks until someone writes to it, and
+                    reading gives EOF when the writer closes it, so reopen it
+                    after each writer
+        """
+        try:
+            os.mkfifo(path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST or not stat.S_ISFIFO(os.stat(path).st_mode):
+                self.logger.warning("Could not create the control FIFO: %s", exc)
+                return
+        self.fifo = path
+
+        def read():
+            while True:
+                with open(path, "r") as fifo:
+                    for line in fifo:
+                        self.command(line)
+
+        thread = threading.Thread(target=read)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """ Remove the control FIFO """
+        if self.fifo is not None and os.path.exists(self.fifo):
+            os.remove(self.fifo)
+            self.fifo = None
+
+    def wait_while_paused(self, interval=1):
+        """ Block while paused """
+        while self.paused.value:
+            time.sleep(interval)
@@ -0,0 +1,506 @@
+#! /usr/bin/python
+"""
+A pull-based work queue for running TALYS on several nodes without MPI.
+
+The coordinator is started by talys.py with --serve ADDRESS. It creates the
+directories and input files as usual, but instead of running TALYS itself it
+serves the jobs to any number of workers and collects their completions.
+A worker is started on each node with
+
+    python coordinator.py ADDRESS -p N
+
+where N is the number of TALYS processes the worker runs at once. Each of
+the N slots pulls a new job as soon as it is done with the previous one, so
+the load is balanced dynamically. Workers can join and leave at any time.
+A job held by a worker that disconnects is put back in the queue and given
+to the next worker asking for one. Its TALYS may still be running, so the
+job is given a fresh copy of its work directory.
+
+ADDRESS is either HOST:PORT for TCP or a path for a Unix socket. The
+directories are given to the workers as absolute paths, so the run
+directory must be on a filesystem shared by the nodes.
+
+The protocol is one JSON object per line. A worker sends {"op": "get",
+"host": ...} and receives {"job": {...}, ...} with the names of the files
+and the time limits of the launcher, {"wait": seconds} or {"stop": true}. When the job is done, it sends {"op": "done", "id": ..., "time": ..., "errors": [...],
+"timed_out": ..., "timings": {...}}.
+"""
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import affinity
+import runner
+
+try:
+    # Python 3
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+
+
+def parse_address(address):
+    """ Parse the address given by the user
+
+    Parameters: address: HOST:PORT or a path
+    Returns:    (family, address) to be used with socket
+    Algorithm:  If the address ends with :PORT it is TCP, else it is the path
+                of a Unix socket
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """ Serves one connection, i.e. one slot of a worker """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        # The jobs this connection holds. Put back in the queue if the
+        # connection is lost
+        leased = {}
+        try:
+            for line in self.rfile:
+                message = json.loads(line.decode("utf8"))
+                if message["op"] == "get":
+                    reply = coordinator.lease(leased, message.get("host", ""))
+                elif message["op"] == "done":
+                    coordinator.complete(leased.pop(message["id"]),
+                                         message.get("time", 0),
+                                         message.get("errors", []),
+                                         message.get("host", ""),
+                                         message.get("timed_out", False),
+                                         message.get("timings"))
+                    continue
+                else:
+                    reply = {"error": "unknown op {}".format(message["op"])}
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf8"))
+                self.wfile.flush()
+                if "stop" in reply:
+                    break
+        except (socket.error, ValueError, KeyError):
+            pass
+        finally:
+            coordinator.release(leased)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class Coordinator(object):
+    """ Serves the job plan to the workers and collects the completions """
+
+    def __init__(self, address, logger, config, poll=1.0, collect=None,
+                 timeout=None, timeout_factor=None, retries=1):
+        """ Set up the queue
+
+        Parameters: address: HOST:PORT or the path of a Unix socket
+                    logger: the logger to report progress to
+                    config: the Configuration, giving the names of the files
+                    poll: the number of seconds a worker waits before asking
+                          again if no job is available yet
+                    collect: how the workers place the results, see
+                             runner.place_file
+                    timeout, timeout_factor, retries: the time limits of the
+                             jobs, see runner.job_timeout. Used by the
+                             workers not given their own
+        Returns:    None
+        Algorithm:  Create the queue and the lock. The server is not started
+                    before start() is called
+        """
+        self.address = address
+        self.logger = logger
+        self.poll = poll
+        self.files = {"input_file": config.input_file,
+                      "output_file": config.output_file,
+                      "result_files": list(config.result_files),
+                      "collect": collect,
+                      "timeout": timeout,
+                      "timeout_factor": timeout_factor,
+                      "retries": retries}
+        self.pending = collections.deque()
+        self.lock = threading.Condition()
+        self.planned = 0
+        self.completed = 0
+        self.failed = 0
+        self.leased = 0
+        self.planning_done = False
+        # The jobs killed for exceeding their time limit
+        self.timed_out = []
+        # Called with (job, time, errors, host, timed_out, timings) when a
+        # job completes
+        self.on_complete = None
+        # Called with (host, job) when a job is given to a worker
+        self.on_lease = None
+        # Returns True if no jobs shall be given out
+        self.is_paused = None
+        self.server = None
+
+    def start(self):
+        """ Start serving in a background thread """
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _UnixServer(address, _Handler)
+        else:
+            self.server = _TCPServer(address, _Handler)
+        self.server.coordinator = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.logger.info("Serving jobs on %s", self.address)
+
+    def stop(self):
+        """ Stop serving and remove the Unix socket """
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+    def add(self, work_directory, result_directory, name, mass, element,
+            job=None):
+        """ Add a job to the plan. Workers can take it immediately. job is
+        the name of the job a chunk of the energies belongs to """
+        with self.lock:
+            self.planned += 1
+            self.pending.append({"id": self.planned,
+                                 "work_directory": os.path.abspath(work_directory),
+                                 "result_directory": os.path.abspath(result_directory),
+                                 "name": name,
+                                 "mass": mass,
+                                 "element": element,
+                                 "job": job})
+            self.lock.notify_all()
+
+    def finish_planning(self):
+        """ Tell the coordinator that no more jobs will be added """
+        with self.lock:
+            self.planning_done = True
+            self.lock.notify_all()
+
+    def is_done(self):
+        return (self.planning_done and not self.pending
+                and self.leased == 0)
+
+    def wait(self):
+        """ Block until every job is completed """
+        with self.lock:
+            while not self.is_done():
+                self.lock.wait(self.poll)
+
+    def drain(self):
+        """ Block until the jobs added so far are completed. More may be
+        added afterwards """
+        with self.lock:
+            while self.pending or self.leased:
+                self.lock.wait(self.poll)
+
+    def lease(self, leased, host=""):
+        """ Give the next job to a worker
+
+        Parameters: leased: the jobs held by the connection asking
+                    host: the name of the worker's host and slot
+        Returns:    The reply to the worker
+        Algorithm:  Wait a short while for a job. If none arrives, tell the
+                    worker to ask again later, or to stop if everything is
+                    done
+        """
+        with self.lock:
+            if not self.pending and not self.is_done():
+                self.lock.wait(self.poll)
+            if self.is_paused is not None and self.is_paused():
+                return {"wait": self.poll}
+            if self.pending:
+                job = self.pending.popleft()
+                leased[job["id"]] = job
+                self.leased += 1
+                reply = {"job": job}
+                reply.update(self.files)
+            elif self.is_done():
+                return {"stop": True}
+            else:
+                return {"wait": self.poll}
+        if "inputs" not in job:
+            # The files made for the job, in case it must be reissued
+            try:
+                job["inputs"] = os.listdir(job["work_directory"])
+            except OSError:
+                job["inputs"] = []
+        if self.on_lease is not None:
+            self.on_lease(host, job)
+        return reply
+
+    def complete(self, job, execution_time, errors, host, timed_out=False,
+                 timings=None):
+        """ Record a completed job """
+        with self.lock:
+            self.leased -= 1
+            self.completed += 1
+            if errors:
+                self.failed += 1
+            if timed_out:
+                self.timed_out.append("{}{}-{}".format(job["mass"],
+                                                       job["element"],
+                                                       job["name"]))
+            self.lock.notify_all()
+        if self.on_complete is not None:
+            self.on_complete(job, execution_time, errors, host, timed_out,
+                             timings)
+
+    def release(self, leased):
+        """ Put the jobs of a lost worker back in the queue, each in a fresh
+        work directory """
+        if not leased:
+            return
+        for job in leased.values():
+            self.reissue(job)
+        with self.lock:
+            for job_id in sorted(leased, reverse=True):
+                self.pending.appendleft(leased[job_id])
+                self.leased -= 1
+            self.lock.notify_all()
+        self.logger.warning("A worker left. %s job(s) put back in the queue",
+                            len(leased))
+        leased.clear()
+
+    def reissue(self, job):
+        """ Give a job of a lost worker a work directory of its own
+
+        Parameters: job: the job, which is changed
+        Returns:    None
+        Algorithm:  The lost worker's TALYS may still run in the work
+                    directory. Copy the files there before the job was first
+                    leased, i.e. the input and the energies, to a new
+                    directory beside it. If that fails, the job keeps its
+                    directory
+        """
+        original = job.setdefault("original_directory", job["work_directory"])
+        job["reissued"] = job.get("reissued", 0) + 1
+        directory = "{}-reissued{}".format(original, job["reissued"])
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for filename in job.get("inputs", []):
+                path = os.path.join(original, filename)
+                if os.path.isfile(path):
+                    shutil.copy2(path, directory)
+        except (IOError, OSError) as exc:
+            self.logger.error("Could not make a fresh work directory for "
+                              "%s: %s", job["name"], exc)
+            return
+        job["work_directory"] = directory
+
+
+class Worker(object):
+    """ Pulls jobs from a coordinator and runs them on this node """
+
+    def __init__(self, address, processes, spawner=None, retry=60,
+                 timeout=None, retries=None, timeout_factor=None):
+        """ Parameters: address: the address of the coordinator
+                        processes: the number of TALYS processes to run at once
+                        spawner: the runner.Spawner starting TALYS, or None
+                                 for talys from PATH
+                        retry: the number of seconds to keep trying to connect
+                        timeout: kill TALYS after this many seconds
+                        timeout_factor: kill TALYS after this many times the
+                                        median execution time
+                        retries: the number of times to rerun a job that
+                                 timed out
+                        The limits given as None are taken from the
+                        coordinator
+        """
+        self.address = address
+        self.processes = processes
+        self.spawner = spawner or runner.make_spawner()
+        self.retry = retry
+        self.timeout = timeout
+        self.timeout_factor = timeout_factor
+        self.retries = retries
+        # The execution times of this worker, to predict the time limit
+        self.durations = []
+        self.host = socket.gethostname()
+        self.jobs_done = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """ Connect to the coordinator, retrying until it is up """
+        family, address = parse_address(self.address)
+        deadline = time.time() + self.retry
+        while True:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.connect(address)
+                return sock
+            except socket.error:
+                sock.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(1)
+
+    def run(self):
+        """ Start one thread per process and wait for them to finish """
+        threads = [threading.Thread(target=self.slot, args=(i,))
+                   for i in range(self.processes)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # Join with a timeout so KeyboardInterrupt reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        print("{}: done with {} jobs".format(self.host, self.jobs_done))
+
+    def slot(self, index):
+        """ Pull and run jobs until the coordinator says stop
+
+        Parameters: index: the number of the slot on this node
+        Algorithm:  Each slot has its own connection. Ask for a job, run it
+                    and report back. If told to wait, sleep and ask again.
+                    Stop if the connection to the coordinator is lost. A job
+                    which can not be run is reported as failed
+        """
+        # Reported to the coordinator, which tracks each slot's utilisation
+        name = "{}/{}".format(self.host, index)
+        sock = self.connect()
+        rfile = sock.makefile("rb")
+        try:
+            while True:
+                sock.sendall((json.dumps({"op": "get", "host": name}) + "\n").encode("utf8"))
+                line = rfile.readline()
+                if not line:
+                    break
+                reply = json.loads(line.decode("utf8"))
+                if "stop" in reply:
+                    break
+                if "wait" in reply:
+                    time.sleep(reply["wait"])
+                    continue
+                job = reply["job"]
+                timings = {}
+                elapsed, errors, timed_out = self.run_job(job, reply, timings)
+                sock.sendall((json.dumps({"op": "done",
+                                          "id": job["id"],
+                                          "time": elapsed,
+                                          "errors": errors,
+                                          "host": name,
+                                          "timed_out": timed_out,
+                                          "timings": timings})
+                              + "\n").encode("utf8"))
+                with self.lock:
+                    self.jobs_done += 1
+                    if not timed_out:
+                        self.durations.append(elapsed)
+        except socket.error:
+            # The coordinator is gone. Either it is done, or its jobs are
+            # lost anyway
+            pass
+        finally:
+            rfile.close()
+            sock.close()
+
+    def run_job(self, job, reply, timings):
+        """ Run TALYS for a job given by the coordinator
+
+        Parameters: job: the job
+                    reply: the coordinator's reply, with the names of the
+                           files and the time limits
+                    timings: filled in with the times of the stages
+        Returns:    (execution time, errors, timed out)
+        Algorithm:  An error starting TALYS, e.g. a missing binary, is
+                    returned as an error of the job, so it is not mistaken
+                    for the coordinator being gone
+        """
+        timeout = runner.job_timeout(self.durations,
+                                     self.limit("timeout", reply),
+                                     self.limit("timeout_factor", reply))
+        start = time.time()
+        try:
+            elapsed, errors, _, timed_out = runner.run_with_retries(
+                self.limit("retries", reply) or 0,
+                job["work_directory"],
+                job["result_directory"],
+                job["name"],
+                reply["input_file"],
+                reply["output_file"],
+                reply["result_files"],
+                spawner=self.spawner,
+                timeout=timeout,
+                timings=timings,
+                collect=reply.get("collect"))
+        except Exception as exc:
+            return time.time() - start, ["Could not run TALYS on {}: {}".format(
+                self.host, exc)], False
+        return elapsed, errors, timed_out
+
+    def limit(self, key, reply):
+        """ The worker's own limit, or else the coordinator's """
+        value = getattr(self, key)
+        return value if value is not None else reply.get(key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=("Pull TALYS jobs from a "
+                                                  "coordinator started with "
+                                                  "talys.py --serve"))
+    parser.add_argument("address", help="HOST:PORT or the path of a Unix socket")
+    parser.add_argument("-p", "--processes",
+                        help=("the number of TALYS processes to run at once."
+                              " Default is all available cores"),
+                        type=int, default=0, metavar="N")
+    parser.add_argument("--talys", help="the TALYS binary",
+                        default="talys", dest="executable")
+    parser.add_argument("--spawn",
+                        help="how TALYS is started: session (default) or preexec",
+                        choices=sorted(runner.SPAWNERS), default=None)
+    parser.add_argument("--retry",
+                        help="seconds to keep trying to connect to the coordinator",
+                        type=int, default=60)
+    parser.add_argument("--timeout",
+                        help=("kill TALYS if it runs longer than this many seconds."
+                              " Default is the launcher's --timeout"),
+                        type=float, default=None, metavar="SECONDS")
+    parser.add_argument("--timeout-factor",
+                        help=("kill TALYS if it runs longer than F times the median"
+                              " execution time. Default is the launcher's"),
+                        type=float, default=None, metavar="F",
+                        dest="timeout_factor")
+    parser.add_argument("--retries",
+                        help=("the number of times to rerun a job that timed out."
+                              " Default is the launcher's --retries"),
+                        type=int, default=None, metavar="N")
+    args = parser.parse_args()
+    if args.processes == 0:
+        # Only the cores allocated to us, as for talys.py -p
+        args.processes = len(affinity.available_cpus())
+    executable = args.executable
+    if os.sep in executable:
+        # Relative to where the worker was started, not the job directory
+        executable = os.path.abspath(executable)
+    try:
+        Worker(args.address, args.processes,
+               runner.make_spawner(args.spawn, executable), args.retry,
+               args.timeout, args.retries, args.timeout_factor).run()
+    except KeyboardInterrupt:
+        sys.exit("Worker stopped. Its jobs are put back in the queue")
@@ -0,0 +1,291 @@
+#! /usr/bin/python
+"""
+Opens the results of a completed sweep as an N-dimensional array, with one
+axis for the isotopes, one for each varying keyword, one for each group of
+dependents and one for the temperatures of astrorate.g:
+
+    from cube import ResultCube
+    cube = ResultCube.open("TALYS-calculations-180101-120000")
+    rates = cube.select(element="Dy", strength=8)
+    rates.axes      # isotope, massmodel, localomp/jlmomp, temperature
+    rates.data      # the numbers, a numpy array
+
+The jobs, their keywords and the paths of their results are read from the
+catalog of the sweep, not from the names of the directories. On the first
+open, every result is read once and the array is written next to the
+catalog as cube-FILE-COLUMN.npy, with the axes in a .json beside it. Later
+opens map the array into memory, so only the parts used are read from disk.
+The cache is rebuilt when the catalog is newer. Combinations not run, e.g.
+with sampling or refinement, or whose results are missing, are NaN.
+
+It is also a script building the cache and showing the axes:
+python cube.py DIRECTORY [--result astrorate.g] [--column 2]
+"""
+
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import sqlite3
+import numpy as np
+import catalog
+
+ISOTOPE = "isotope"
+TEMPERATURE = "temperature"
+
+
+def read_table(path):
+    """ Read the rows of numbers in a TALYS result table
+
+    Returns:    A 2D array, or None if the file can not be read
+    Algorithm:  Only lines of numbers are used, which skips the comments.
+                Rows shorter than the first are dropped
+    """
+    rows = []
+    try:
+        with open(path) as table:
+            for line in table:
+                try:
+                    row = [float(word) for word in line.split()]
+                except ValueError:
+                    continue
+                if row and (not rows or len(row) >= len(rows[0])):
+                    rows.append(row[:len(rows[0])] if rows else row)
+    except (IOError, OSError):
+        return None
+    return np.array(rows) if rows else None
+
+
+def label_key(label):
+    """ Sort numbers by value and before other labels """
+    try:
+        return (0, float(label), "")
+    except ValueError:
+        return (1, 0.0, label)
+
+
+def isotope_key(label):
+    """ Sort isotopes such as 160Dy by element, then mass """
+    digits = len(label) - len(label.lstrip("0123456789"))
+    return (label[digits:], int(label[:digits] or 0))
+
+
+def same(label, value):
+    """ Whether the label of an axis is the value asked for """
+    if str(label) == str(value):
+        return True
+    try:
+        return float(label) == float(value)
+    except (TypeError, ValueError):
+        return False
+
+
+def find_run_path(directory, path):
+    """ The path of a result, also if the run directory was moved """
+    if os.path.exists(path):
+        return path
+    index = path.find("results_data")
+    if index >= 0:
+        return os.path.join(directory, path[index:])
+    return path
+
+
+class ResultCube(object):
+    """ The results of a sweep as an array with named axes """
+
+    def __init__(self, data, axes):
+        """ Parameters: data: an array, e.g. a numpy.memmap
+                        axes: a list over (name, labels), one for each
+                              dimension of data
+        """
+        self.data = data
+        self.axes = list(axes)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def names(self):
+        return [name for name, labels in self.axes]
+
+    def labels(self, name):
+        """ The labels along the axis named name """
+        return dict(self.axes)[name]
+
+    @classmethod
+    def open(cls, directory, result="astrorate.g", column=2, rebuild=False):
+        """ Open the results of a sweep
+
+        Parameters: directory: the TALYS-calculations directory
+                    result: the result file to read
+                    column: the column of the table, counting from 0.
+                            The first column is the temperature axis
+                    rebuild: read the results again, also if cached
+        Returns:    A ResultCube over a memory map of the cache
+        Raises:     IOError if the directory has no catalog
+        """
+        path = os.path.join(directory, catalog.FILENAME)
+        if not os.path.exists(path):
+            raise IOError("No {} in {}. Only sweeps run with a catalog can be "
+                          "opened".format(catalog.FILENAME, directory))
+        base = os.path.join(directory, "cube-{}-{}".format(result, column))
+        cached = (os.path.exists(base + ".npy") and os.path.exists(base + ".json")
+                  and os.path.getmtime(base + ".npy") >= os.path.getmtime(path))
+        if rebuild or not cached:
+            data, axes = cls.build(directory, path, result, column)
+            np.save(base + ".npy", data)
+            with open(base + ".json", "w") as outfile:
+                json.dump(axes, outfile)
+        with open(base + ".json") as infile:
+            axes = [(name, labels) for name, labels in json.load(infile)]
+        return cls(np.load(base + ".npy", mmap_mode="r"), axes)
+
+    @staticmethod
+    def build(directory, path, result, column):
+        """ Read every result of the sweep into an array
+
+        Parameters: directory: the run directory
+                    path: the path of the catalog
+                    result, column: as for open()
+        Returns:    (data, axes), axes being a list over [name, labels]
+        Algorithm:  Find the axes from the jobs done in the catalog: the
+                    isotopes, the values of each varying keyword and the
+                    chosen keyword of each group of dependents. The
+                    temperatures are the first column of the first result
+                    read. Then fill in the column of each job's result
+        """
+        connection = sqlite3.connect(path)
+        try:
+            run = dict(connection.execute("SELECT key, value FROM run"))
+            varying = json.loads(run.get("varying", "[]"))
+            dependents = json.loads(run.get("dependents", "[]"))
+            jobs = {}
+            rows = connection.execute(
+                "SELECT jobs.id, jobs.element, jobs.mass, results.path "
+                "FROM jobs JOIN results ON results.job_id = jobs.id "
+                "WHERE jobs.status IN ('done', 'duplicate') AND results.file = ?",
+                (result,))
+            for job_id, element, mass, result_path in rows:
+                jobs[job_id] = {ISOTOPE: "{}{}".format(mass, element),
+                                "path": find_run_path(directory, result_path)}
+            rows = connection.execute(
+                "SELECT job_id, keyword, value FROM parameters WHERE varying = 1")
+            for job_id, keyword, value in rows:
+                if job_id not in jobs:
+                    continue
+                if keyword in varying:
+                    jobs[job_id][keyword] = value
+                for group in dependents:
+                    if keyword in group:
+                        jobs[job_id]["/".join(group)] = keyword
+        finally:
+            connection.close()
+
+        names = [ISOTOPE] + list(varying) + ["/".join(group) for group in dependents]
+        axes = []
+        for name in names:
+            labels = set(job[name] for job in jobs.values() if name in job)
+            axes.append([name, sorted(labels, key=isotope_key if name == ISOTOPE
+                                      else label_key)])
+        index = [dict((label, i) for i, label in enumerate(labels))
+                 for name, labels in axes]
+
+        data = None
+        for job in jobs.values():
+            table = read_table(job["path"])
+            if table is None or table.shape[1] <= column:
+                continue
+            if data is None:
+                temperatures = table[:, 0]
+                shape = [len(labels) for name, labels in axes] + [len(temperatures)]
+                data = np.full(shape, np.nan)
+            cell = tuple(i[job[name]] for i, (name, labels) in zip(index, axes))
+            values = table[:len(temperatures), column]
+            data[cell][:len(values)] = values
+        if data is None:
+            temperatures = np.array([])
+            data = np.full([len(labels) for name, labels in axes] + [0], np.nan)
+        axes.append([TEMPERATURE, [float(t) for t in temperatures]])
+        return data, axes
+
+    def select(self, element=None, **criteria):
+        """ Select a part of the cube
+
+        Parameters: element: keep the isotopes of this element, e.g. "Dy"
+                    criteria: {axis name: value or list of values}. A single
+                              value drops the axis, a list keeps it. Numbers
+                              match labels of the same value, so strength=8
+                              matches "8" and "8.0". The dependents are
+                              given by the name of their axis, e.g.
+                              **{"localomp/jlmomp": "jlmomp"}
+        Returns:    A ResultCube over the selection
+        Raises:     KeyError for an unknown axis or value
+        """
+        if element is not None:
+            isotopes = [label for label in self.labels(ISOTOPE)
+                        if label.lstrip("0123456789") == element]
+            wanted = criteria.get(ISOTOPE)
+            if isinstance(wanted, (list, tuple)):
+                isotopes = [label for label in isotopes
+                            if any(same(label, v) for v in wanted)]
+            elif wanted is not None:
+                # A single isotope drops the axis, as for the other axes
+                if not any(same(label, wanted) for label in isotopes):
+                    raise KeyError("{} is not an isotope of {}".format(
+                        wanted, element))
+                isotopes = wanted
+            criteria[ISOTOPE] = isotopes
+        for name in criteria:
+            if name not in self.names:
+                raise KeyError("No axis {}. The axes are {}".format(
+                    name, ", ".join(self.names)))
+        # Single values first, by basic indexing, which is a view
+        index = []
+        axes = []
+        for name, labels in self.axes:
+            wanted = criteria.get(name)
+            if wanted is None:
+                index.append(slice(None))
+                axes.append((name, labels))
+            elif isinstance(wanted, (list, tuple)):
+                index.append(slice(None))
+                axes.append((name, labels))
+            else:
+                index.append(self.position(name, labels, wanted))
+        data = self.data[tuple(index)]
+        # Then the lists, one axis at a time
+        for axis, (name, labels) in enumerate(axes):
+            wanted = criteria.get(name)
+            if isinstance(wanted, (list, tuple)):
+                positions = [self.position(name, labels, value) for value in wanted]
+                data = np.take(data, positions, axis=axis)
+                axes[axis] = (name, [labels[i] for i in positions])
+        return ResultCube(data, axes)
+
+    @staticmethod
+    def position(name, labels, value):
+        for i, label in enumerate(labels):
+            if same(label, value):
+                return i
+        raise KeyError("{} is not on the axis {}".format(value, name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=("Cache the results of a "
+                                                  "sweep as an array and "
+                                                  "show its axes"))
+    parser.add_argument("directory", help="the TALYS-calculations directory")
+    parser.add_argument("--result", help="the result file to read",
+                        default="astrorate.g")
+    parser.add_argument("--column", help="the column to read, counting from 0",
+                        type=int, default=2)
+    parser.add_argument("--rebuild", help="read the results even if cached",
+                        action="store_true")
+    args = parser.parse_args()
+    cube = ResultCube.open(args.directory, args.result, args.column, args.rebuild)
+    missing = int(np.isnan(cube.data).sum())
+    print("Shape", cube.shape, "with", missing, "missing values")
+    for name, labels in cube.axes:
+        shown = labels if len(labels) <= 10 else labels[:5] + ["..."] + labels[-5:]
+        print("{:<20} {}".format(name, " ".join(str(label) for label in shown)))
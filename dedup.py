@@ -0,0 +1,126 @@
+"""
+This module finds jobs whose TALYS inputs are the same, so each input is only
+run once. Different combinations of the keywords may give the same input,
+e.g. when two values mean the same to TALYS, when the choices of a dependent
+collapse, or when a custom block does not apply to an isotope. The inputs are
+compared in a canonical form: without comments, in lower case, with the
+numbers normalised and the lines sorted. The first job with an input runs it,
+and the results of the others are linked to its results when it is done.
+Turned off with --no-dedup.
+"""
+
+import hashlib
+import os
+import shutil
+from runner import result_path
+
+
+def canonical_input(text):
+    """ The canonical form of a TALYS input
+
+    Parameters: text: the content of the input file
+    Returns:    The canonical form as a string
+    Algorithm:  Remove comments and blank lines. TALYS reads the input in
+                lower case, so lower it. Write every number as a float, so
+                1, 1.0 and 1E0 are equal. Sort the lines, as their order does
+                not matter to TALYS
+    """
+    lines = []
+    for line in text.splitlines():
+        words = line.split("#")[0].lower().split()
+        if not words:
+            continue
+        for i, word in enumerate(words):
+            try:
+                words[i] = repr(float(word))
+            except ValueError:
+                pass
+        lines.append(" ".join(words))
+    return "\n".join(sorted(lines))
+
+
+def text_key(text):
+    """ A digest of the canonical form of the content of an input """
+    return hashlib.sha1(canonical_input(text).encode("utf8")).hexdigest()
+
+
+def input_key(path):
+    """ A digest of the canonical form of the input file """
+    with open(path) as infile:
+        return text_key(infile.read())
+
+
+def link(source, destination):
+    """ Hard link the file, or copy it if the file system can not """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError):
+        shutil.copy2(source, destination)
+
+
+class Deduplicator(object):
+    """ Keeps the first job of every input and the jobs with the same input """
+
+    def __init__(self, seen=None, duplicates=None):
+        """ Parameters: seen: a dict shared with the children, such as
+                              multiprocessing.Manager().dict(), or None if
+                              only this process plans jobs
+                        duplicates: a list shared likewise
+        """
+        # {digest of the input: the first job with it}
+        self.seen = seen if seen is not None else {}
+        # (first job, duplicate job) waiting to be linked
+        self.duplicates = duplicates if duplicates is not None else []
+        # The number of runs saved so far
+        self.saved = 0
+
+    def original(self, input_file, job, text=None):
+        """ Find the first job with the same input
+
+        Parameters: input_file: the path of the job's input file
+                    job: (result directory, name, label) of the job
+                    text: the content of the input, if it is not written
+                          yet, or None to read input_file
+        Returns:    The first job with the input, or None if this is it
+        Algorithm:  setdefault is a single call to the shared dict, so two
+                    children can not both become the first
+        """
+        job = tuple(job)
+        key = text_key(text) if text is not None else input_key(input_file)
+        first = tuple(self.seen.setdefault(key, job))
+        if first == job:
+            return None
+        self.duplicates.append((first, job))
+        return first
+
+    def link_results(self, result_files, log_file=None):
+        """ Link the results of the first jobs to their duplicates
+
+        Parameters: result_files: the names of the result files
+                    log_file: the file to append "duplicate: first" lines
+                              to, or None
+        Returns:    A list over errors, e.g. if the first job failed
+        Algorithm:  Only the duplicates present when starting are linked,
+                    so call it when their first jobs are done
+        """
+        count = len(self.duplicates)
+        duplicates = self.duplicates[:count]
+        del self.duplicates[:count]
+        errors = []
+        lines = []
+        for first, duplicate in duplicates:
+            try:
+                for filename in result_files:
+                    link(result_path(first[0], first[1], filename),
+                         result_path(duplicate[0], duplicate[1], filename))
+            except (IOError, OSError) as exc:
+                errors.append("Could not link the results of {} to {}: {}".format(
+                    first[2], duplicate[2], exc))
+            lines.append("{}: {}\n".format(duplicate[2], first[2]))
+            self.saved += 1
+        if log_file is not None and lines:
+            with open(log_file, "a") as outfile:
+                outfile.writelines(lines)
+        return errors
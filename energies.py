@@ -0,0 +1,92 @@
+"""
+This module makes the energy grid of the non-astro runs, and splits it into
+chunks run as separate TALYS jobs with --energy-chunks K. Each chunk runs in
+a directory of its own below the job's directory, with the same input and
+the chunk's part of the energy file. When the chunks are done, the result
+tables are merged back into one result per job: the comments of the first
+chunk and the rows of every chunk, sorted by energy.
+"""
+
+import os
+import re
+import numpy as np
+
+ENERGY_COUNT = re.compile(r"(energies\s*=\s*)(\d+)")
+
+
+def make_energies(start, stop, number):
+    """ The energy grid: number energies from start to stop, both included """
+    return np.linspace(float(start), float(stop), int(float(number)))
+
+
+def write_energies(path, energies):
+    """ Write the energies to an energy file, one in each line """
+    with open(path, "w") as outfile:
+        for energy in energies:
+            outfile.write('%.2E \n' % energy)
+
+
+def read_energies(path):
+    """ Read an energy file written by write_energies """
+    with open(path) as infile:
+        return [float(line) for line in infile if line.strip()]
+
+
+def split(energies, chunks):
+    """ Split the energies into contiguous chunks of nearly equal length
+
+    Parameters: energies: the list of energies
+                chunks: the number of chunks. At most one per energy
+    Returns:    A list over the chunks, each a list of energies
+    """
+    chunks = max(1, min(chunks, len(energies)))
+    return [list(chunk) for chunk in np.array_split(np.asarray(energies), chunks)]
+
+
+def chunk_name(name, index):
+    """ The name of a chunk of the job, as used for its results """
+    return "{}-chunk{}".format(name, index) if name else "chunk{}".format(index)
+
+
+def merge_tables(sources, destination):
+    """ Merge the result tables of the chunks into one
+
+    Parameters: sources: the paths of the chunks' tables, in the order of
+                         the energies. Missing files are skipped
+                destination: the path of the merged table
+    Returns:    The number of tables merged
+    Algorithm:  Keep the comments of the first table. A line is a row if
+                its first word is a number. Sort the rows by it, keeping the
+                order of equal energies, and drop repeated rows. A count of
+                energies in the comments, as in TALYS' "# energies =", is
+                set to the number of rows
+    """
+    comments = []
+    rows = []
+    merged = 0
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        with open(source) as infile:
+            for line in infile:
+                words = line.split()
+                try:
+                    energy = float(words[0])
+                except (IndexError, ValueError):
+                    if not merged:
+                        comments.append(line)
+                    continue
+                rows.append((energy, line))
+        merged += 1
+    if not merged:
+        return 0
+    rows.sort(key=lambda row: row[0])
+    lines = []
+    for energy, line in rows:
+        if not lines or lines[-1] != line:
+            lines.append(line)
+    comments = [ENERGY_COUNT.sub(lambda match: match.group(1) + str(len(lines)), line)
+                for line in comments]
+    with open(destination, "w") as outfile:
+        outfile.writelines(comments + lines)
+    return merged
@@ -0,0 +1,97 @@
+#! /usr/bin/python
+"""
+A stand-in for the TALYS binary, used by benchmark.py to measure the
+launcher without running TALYS. Like TALYS, it reads the input file from
+stdin and writes the output to stdout. It then spends the time given by the
+environment and writes fake result files in the working directory.
+
+    FAKETALYS_TIME      the seconds to spend on each job. Default is 0
+    FAKETALYS_MODE      "sleep" to sleep, or "burn" to keep a core busy
+    FAKETALYS_FAIL      write an error to stderr for jobs whose input
+                        contains this text
+
+tools.talys_version() recognizes the binary by its strings, so this comment
+mentions the keywords massmodel and pshiftadjust, making it pass as TALYS 1.8.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+
+
+def read_input(lines):
+    """ Parse the keywords of a TALYS input file
+
+    Parameters: lines: the lines of the input file
+    Returns:    A dict over the keywords and their values
+    """
+    keywords = {}
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if line:
+            key, _, value = line.partition(" ")
+            keywords[key] = value.strip()
+    return keywords
+
+
+def spend(seconds, mode="sleep"):
+    """ Spend the time, either sleeping or keeping a core busy """
+    if mode == "burn":
+        deadline = time.time() + seconds
+        x = 0
+        while time.time() < deadline:
+            for i in range(1000):
+                x += i*i
+    elif seconds > 0:
+        time.sleep(seconds)
+
+
+def main():
+    start = time.time()
+    lines = sys.stdin.readlines()
+    keywords = read_input(lines)
+    fail = os.environ.get("FAKETALYS_FAIL")
+    if fail and fail in "".join(lines):
+        sys.stderr.write("faketalys: failing on purpose\n")
+        return 1
+    spend(float(os.environ.get("FAKETALYS_TIME", 0)),
+          os.environ.get("FAKETALYS_MODE", "sleep"))
+
+    # Columns as in astrorate.g: temperature, partition function, rate and
+    # MACS. The rate grows with gnorm, so the refinement has something to do
+    mass = int(float(keywords.get("mass", 0)))
+    gnorm = float(keywords.get("gnorm", 1))
+    for filename in ("astrorate.g", "astrorate.tot"):
+        with open(filename, "w") as outfile:
+            outfile.write("# {}{} fake reaction rates\n".format(
+                mass, keywords.get("element", "")))
+            outfile.write("#    T       G(T)        Rate       MACS\n")
+            for i in range(1, 31):
+                rate = 1e-3*i*mass*gnorm**2
+                outfile.write(" {:8.4f} {:12.5E} {:12.5E} {:12.5E}\n".format(
+                    0.1*i, 1.0, rate, rate/(0.1*i)))
+
+    # Without astro, a table over the energies in the energy file, as in
+    # TALYS' total.tot
+    energy = keywords.get("energy", "")
+    if keywords.get("astro", "n") in ("n", "no") and os.path.isfile(energy):
+        with open(energy) as infile:
+            grid = [float(line) for line in infile if line.strip()]
+        with open("total.tot", "w") as outfile:
+            outfile.write("# {}{} fake total cross sections\n".format(
+                mass, keywords.get("element", "")))
+            outfile.write("# # energies ={:6d}\n".format(len(grid)))
+            for e in grid:
+                outfile.write(" {:12.5E} {:12.5E}\n".format(e, mass*gnorm/(1 + e)))
+
+    print(" TALYS-1.8 (fake)")
+    print(" ".join("{}={}".format(key, value)
+                   for key, value in sorted(keywords.items())))
+    elapsed = time.time() - start
+    print(" Execution time: 0 hours 0 minutes {:.2f} seconds".format(elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
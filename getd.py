@@ -38,8 +38,13 @@ version, and the newest chromedriver must be installed.
 See https://splinter.readthedocs.io/en/latest/drivers/chrome.html for
 more information and installtion instructions
 
+BRUSLIB stores the rates of several isotopes in each data file, so the
+file is only downloaded once per element and split into one file per isotope.
+By giving an existing directory with -o, isotopes already downloaded are
+skipped.
+
 The syntax for the script is
-python getd.py inputfile library
+python getd.py inputfile library [-o directory]
 """
 
 import requests, sys, bs4, re, argparse, os, time
@@ -68,6 +73,9 @@ Z_nr = {'H': '001',  'He': '002', 'Li': '003',  'Be': '004', 'B': '005',   'C':
 ## FUNCTIONS
 
 _nsre = re.compile('([0-9]+)')
+# Match the mass+symbol of an isotope, e.g. 160Dy
+_bruslib_name = re.compile(r"(\d{1,3}[a-zA-Z]{1,3})")
+
 def natural_sort_key(s):
     """ Sorts alphanumerically
 
@@ -119,15 +127,35 @@ def save_data(filename, link):
     return True
 
 
-def scrape(address):
+def save_lines(filename, lines):
+    """ Saves lines of text to the filename
+
+    Parameters: filename: the name of the file to be saved
+                lines:    the lines to write, including newlines
+    Returns:    True if successful, False if not
+    Algorithm:  Write the lines to the file. Any exception makes the function
+                return False"""
+    write("Saving to {}...".format(filename))
+    try:
+        with open(filename, 'w') as wFile:
+            wFile.writelines(lines)
+    except Exception as exc:
+        print("Error:", exc)
+        return False
+    print("ok")
+    return True
+
+
+def scrape(address, session=None):
     """ Get HTML-page for the given url
 
     Parameters: address: the address to fetch the HTML-page from
+                session: an optional requests.Session to reuse the connection
     Returns:    requests-object if successful, else None
     Algorithm:  Simple wrapper for requests.get(address)
     """
     try:
-        res = requests.get(address)
+        res = (session or requests).get(address)
         res.raise_for_status()
     except Exception as e:
         print("An exception occured: {}".format(e))
@@ -135,20 +163,23 @@ def scrape(address):
     return res
 
 
-def change_directory(library):
+def change_directory(library, directory=None):
     """ Creates and moves working directory to decrease clutter
 
     Parameters: library: the name of the library to collect data from
+                directory: use this directory instead of a new one. Files
+                           already in it are not downloaded again
     Returns:    None
     Algorithm:  The name is created by the date, time and library.
                 If the name does not exist, create it.
     """
-    date_dir = time.strftime('%y%m%d')
-    time_dir = time.strftime('%H%M%S')
-    directory = "{}-reaction-rates-{}-{}".format(library, date_dir, time_dir)
+    if directory is None:
+        date_dir = time.strftime('%y%m%d')
+        time_dir = time.strftime('%H%M%S')
+        directory = "{}-reaction-rates-{}-{}".format(library, date_dir, time_dir)
     if not os.path.exists(directory):
         os.makedirs(directory)
-        os.chdir(directory)
+    os.chdir(directory)
 
 
 def get_REACLIB(reader):
@@ -176,7 +207,7 @@ def get_REACLIB(reader):
         print("ok")
 
         # Find an occurence of the rate index and use it 
-        pattern = re.compile("rateindex=(\d+)")
+        pattern = re.compile(r"rateindex=(\d+)")
         rateindex = re.search(pattern, res.text)
         if rateindex is None:
             print("Could not find the rate index. Probably unexpected HTML-encoding. Skipping ", reaction)
@@ -190,48 +221,112 @@ def get_REACLIB(reader):
             continue
 
 
+def split_bruslib(lines):
+    """ Split a BRUSLIB data file into the blocks of each isotope
+
+    Parameters: lines: the lines of a downloaded BRUSLIB data file
+    Returns:    A dict of the form {"160dy": [line, line, ...]}
+    Algorithm:  The rates of each isotope are stored in blocks of 33 lines,
+                with the mass and symbol on the second line of the block.
+                Chop the lines into blocks and key them on the lowercased
+                mass+symbol. Blocks without a mass+symbol are skipped
+    """
+    blocks = {}
+    for start in range(0, len(lines), 33):
+        chunk = lines[start:start+33]
+        if len(chunk) < 2:
+            continue
+        match = re.search(_bruslib_name, chunk[1])
+        if match is None:
+            continue
+        blocks[match.group(1).lower()] = chunk
+    return blocks
+
+
 def get_BRUSLIB(reader):
     """ Get data from BRUSLIB
 
     Parameters: reader: a Basic_reader object
     Returns:    None
-    Algorithm:  Convert Basic_reader to BRUSLIB-format, open the HTML-page,
-                parse the page, find the link to the download page and
-                save the result.
+    Algorithm:  Convert Basic_reader to BRUSLIB-format and group the
+                reactions by element. Isotopes whose file already exists
+                are skipped. For each element, open the HTML-page of the
+                first missing isotope, find the link to the data and
+                download it once. The data file contains the blocks of
+                several isotopes, so split it locally and save every block
+                that is asked for. Repeat until every isotope of the element
+                is saved or could not be found.
     """
 
-    # Create a list over reactions compatible with BRUSLIB
-    reactions = []
+    # Create a list over reactions compatible with BRUSLIB, grouped by element
+    reactions = {}
     for element in reader.keywords["element"]:
-        for mass in reader.keywords["mass"][element]:
-            protons = int(Z_nr[element])
-            reactions.append([protons, element, mass-protons])
-
-    pattern = re.compile("data for Proton Reaction Rates")
-    for reaction in reactions:
-        # Attempt to open the HTML-page
-        address = address_bruslib.format(reaction[0], reaction[2])
-        write("Attempting to open BRUSLIB for {}{}{}...".format(reaction[0],
-                                                                reaction[1], reaction[2]))
-        res = scrape(address)
-        if res is None:
-            continue
-        print("ok")
+        protons = int(Z_nr[element])
+        reactions[element] = [[protons, element, mass-protons]
+                              for mass in reader.keywords["mass"][element]]
+
+    # Reuse the connection, and remember the files already downloaded
+    session = requests.Session()
+    downloaded = {}
+    requests_made = 0
+    for element in reader.keywords["element"]:
+        missing = []
+        for reaction in reactions[element]:
+            filename = "{}{}{}_bruslib.txt".format(*reaction)
+            if os.path.exists(filename):
+                print("{} exists. Skipping".format(filename))
+            else:
+                missing.append(reaction)
+
+        while missing:
+            reaction = missing.pop(0)
+            filename = "{}{}{}_bruslib.txt".format(*reaction)
+            # Attempt to open the HTML-page
+            address = address_bruslib.format(reaction[0], reaction[2])
+            write("Attempting to open BRUSLIB for {}{}{}...".format(*reaction))
+            res = scrape(address, session)
+            requests_made += 1
+            if res is None:
+                continue
+            print("ok")
 
-        # Look for the link to the data
-        write("Looking for link...")
-        soup = bs4.BeautifulSoup(res.text, "html.parser")
-        link_to_data = address_bruslib_data
-        for link in soup.findAll('a'):
-            if link.contents[0] == "data for Neutron Reaction Rates":
-                link_to_data += link.get('href')[2:]
-                break
+            # Look for the link to the data
+            write("Looking for link...")
+            soup = bs4.BeautifulSoup(res.text, "html.parser")
+            link_to_data = None
+            for link in soup.findAll('a'):
+                if link.contents and link.contents[0] == "data for Neutron Reaction Rates":
+                    link_to_data = address_bruslib_data + link.get('href')[2:]
+                    break
+            if link_to_data is None:
+                print("not found. Skipping")
+                continue
             print("ok")
 
-        # Download and save the data
-        filename = "{}{}{}_bruslib.txt".format(reaction[0], reaction[1], reaction[2])
-        if not save_data(filename, link_to_data):
-            continue
+            # Download the data, unless an earlier isotope already did
+            if link_to_data not in downloaded:
+                write("Downloading {}...".format(link_to_data))
+                res = scrape(link_to_data, session)
+                requests_made += 1
+                if res is None:
+                    continue
+                print("ok")
+                lines = res.text.splitlines(True)
+                downloaded[link_to_data] = (lines, split_bruslib(lines))
+            lines, blocks = downloaded[link_to_data]
+
+            # Save the requested isotope. If the file could not be split,
+            # keep the whole file as before
+            key = "{}{}".format(reaction[0]+reaction[2], reaction[1]).lower()
+            save_lines(filename, blocks.get(key, lines))
+
+            # Save the other missing isotopes found in the same file
+            for other in missing[:]:
+                key = "{}{}".format(other[0]+other[2], other[1]).lower()
+                if key in blocks:
+                    save_lines("{}{}{}_bruslib.txt".format(*other), blocks[key])
+                    missing.remove(other)
+    print("Done with {} requests".format(requests_made))
 
 
 def get_EXFOR(reader):
@@ -293,6 +388,10 @@ if __name__ == "__main__":
     parser.add_argument("database", help="The database to search",
                         choices=["REACLIB", "BRUSLIB", "EXFOR"],
                         type=str.upper)
+    parser.add_argument("-o", "--output",
+                        help=("the directory to save the data to. Existing files"
+                              " are not downloaded again"),
+                        type=str, default=None)
     args = parser.parse_args()
     
     if "json" in args.input:
@@ -306,11 +405,11 @@ if __name__ == "__main__":
     print("ok")
 
     if args.database == "REACLIB":
-        change_directory("REACLIB")
+        change_directory("REACLIB", args.output)
         get_REACLIB(reader)
     elif args.database == "BRUSLIB":
-        change_directory("BRUSLIB")
+        change_directory("BRUSLIB", args.output)
         get_BRUSLIB(reader)
     elif args.database == "EXFOR":
-        change_directory("EXFOR")
+        change_directory("EXFOR", args.output)
         get_EXFOR(reader)
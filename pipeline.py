@@ -0,0 +1,114 @@
+"""
+This module contains the pipeline preparing the jobs ahead of running them.
+Making the directories, writing the input and copying the energy file of the
+next jobs is done in a thread while TALYS runs, so a job is ready to start as
+soon as a core or MPI rank is free. The number of jobs prepared ahead is
+bounded, so the preparation never runs far ahead of TALYS.
+"""
+
+import sys
+import threading
+try:
+    import queue                         # Python 3
+except ImportError:
+    import Queue as queue                # Python 2
+
+# Put on the queue by the producer when it is done
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """ Raised in the producer when the consumer has stopped """
+
+
+class Pipeline(object):
+    """ Runs a producer of jobs in a thread and the consumer in this one """
+
+    def __init__(self, depth, poll=1):
+        """ Parameters: depth: the most jobs prepared ahead
+                        poll: the seconds between each check whether the
+                              consumer has stopped, while the queue is full
+        """
+        self.depth = depth
+        self.poll = poll
+        self.queue = None
+        self.stopped = threading.Event()
+
+    def put(self, job):
+        """ Hand a prepared job to the consumer. Called by the producer
+
+        Algorithm:  Block while depth jobs are waiting. Raise
+                    PipelineStopped if the consumer stops meanwhile, which
+                    unwinds the producer
+        """
+        while True:
+            if self.stopped.is_set():
+                raise PipelineStopped()
+            try:
+                self.queue.put(job, timeout=self.poll)
+                return
+            except queue.Full:
+                pass
+
+    def run(self, produce, consume, waiting=None):
+        """ Produce and consume the jobs
+
+        Parameters: produce: called without arguments in a thread. Calls
+                             put for each job
+                    consume: called with each job, in this thread
+                    waiting: a context manager entered while waiting for
+                             the producer, e.g. a stage of the profiler, or
+                             None
+        Returns:    None
+        Algorithm:  The consumer stays in the calling thread, so MPI and
+                    fork are only used from there. An exception in the
+                    producer is raised here when the jobs before it are
+                    consumed. If the consumer raises, the producer is stopped
+        """
+        self.queue = queue.Queue(max(1, self.depth))
+        self.stopped.clear()
+        error = []
+
+        def producer():
+            try:
+                produce()
+            except PipelineStopped:
+                pass
+            except BaseException:
+                error.append(sys.exc_info()[1])
+            finally:
+                # Blocks until there is room, unless the consumer is gone
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put(_DONE, timeout=self.poll)
+                        break
+                    except queue.Full:
+                        pass
+
+        thread = threading.Thread(target=producer, name="pipeline")
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                if waiting is not None:
+                    with waiting:
+                        job = self.next_job()
+                else:
+                    job = self.next_job()
+                if job is _DONE:
+                    break
+                consume(job)
+        finally:
+            # The producer may be paused, so do not wait for it
+            self.stopped.set()
+        thread.join()
+        if error:
+            raise error[0]
+
+    def next_job(self):
+        """ Wait for the next job. A timeout keeps Ctrl-C working """
+        while True:
+            try:
+                return self.queue.get(timeout=self.poll)
+            except queue.Empty:
+                pass
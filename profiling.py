@@ -0,0 +1,138 @@
+"""
+This module times the stages of the launcher, to tell how much of the wall
+time of a sweep is spent in TALYS and how much in the launcher itself.
+The stages are timed with the highest resolution timer available, in
+whichever process runs them, and the timings of the children are sent to the
+launcher when they finish.
+"""
+
+from __future__ import division
+import collections
+import os
+import time
+
+# time.perf_counter is only available in Python 3
+timer = getattr(time, "perf_counter", time.time)
+
+# Stages which are not overhead of the launcher. Starting TALYS, "spawn",
+# is both overhead and part of "talys". Waiting for the jobs prepared ahead,
+# "pipeline", is the time of the stages preparing them, which are counted
+NOT_OVERHEAD = ("talys", "wait", "pipeline")
+
+
+class _Stage(object):
+    """ Times one stage when used in a with-statement """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = timer()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.name, timer() - self.start)
+
+
+class _NoStage(object):
+    """ Does nothing, so disabled profiling costs next to nothing """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_no_stage = _NoStage()
+
+
+class Profiler(object):
+    """ Accumulates the time spent in each stage of the launcher """
+
+    def __init__(self, enabled=False, results=None):
+        """ Parameters: enabled: whether to time anything at all
+                        results: a list shared with the children, such as
+                                 multiprocessing.Manager().list(), or None
+        """
+        self.enabled = enabled
+        # {stage: seconds} and {stage: number of calls} in this process
+        self.totals = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        # The process the timings belong to. A forked child starts afresh
+        self.pid = os.getpid()
+        # The timings sent by the children
+        self.results = results if results is not None else []
+
+    def stage(self, name):
+        """ A context manager timing the stage
+
+        Usage:      with profiler.stage("mkdir"):
+                        mkdir(directory)
+        """
+        if not self.enabled:
+            return _no_stage
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        """ Add time spent in the stage """
+        if self.enabled:
+            if os.getpid() != self.pid:
+                # Inherited from the parent, which reports them itself
+                self.pid = os.getpid()
+                self.totals.clear()
+                self.calls.clear()
+            self.totals[name] += seconds
+            self.calls[name] += 1
+
+    def flush(self):
+        """ Send the timings of this process to the launcher and reset them
+
+        Algorithm:  Called by the children when they are done
+        """
+        if not self.enabled or not self.calls:
+            return
+        self.results.append((dict(self.totals), dict(self.calls)))
+        self.totals.clear()
+        self.calls.clear()
+
+    def collect(self):
+        """ Add the timings sent by the children to this process' """
+        if not self.enabled:
+            return
+        count = len(self.results)
+        results = self.results[:count]
+        del self.results[:count]
+        for totals, calls in results:
+            for name, seconds in totals.items():
+                self.totals[name] += seconds
+                self.calls[name] += calls[name]
+
+    def report(self, jobs, wall_time):
+        """ Make a table of the time spent in each stage
+
+        Parameters: jobs: the number of TALYS jobs run
+                    wall_time: the total wall time of the sweep in seconds
+        Returns:    The table as a string
+        Algorithm:  List the stages by total time, with the time per job and
+                    the share of the wall time, which is above 100 % for
+                    stages run by several children at once. The overhead is
+                    the sum of every stage except running TALYS and waiting
+                    for a free slot
+        """
+        self.collect()
+        jobs = max(jobs, 1)
+        wall_time = max(wall_time, 1e-9)
+        lines = ["{:<12} {:>8} {:>12} {:>14} {:>7}".format(
+            "Stage", "Calls", "Total [s]", "Per job [ms]", "Wall %")]
+        for name, seconds in sorted(self.totals.items(),
+                                    key=lambda item: -item[1]):
+            lines.append("{:<12} {:>8} {:>12.3f} {:>14.3f} {:>7.1f}".format(
+                name, self.calls[name], seconds, seconds/jobs*1000,
+                seconds/wall_time*100))
+        overhead = sum(seconds for name, seconds in self.totals.items()
+                       if name not in NOT_OVERHEAD)
+        lines.append("Launcher overhead: {:.3f} s in total, {:.3f} ms per job"
+                     " for {} jobs in {:.1f} s".format(
+                         overhead, overhead/jobs*1000, jobs, wall_time))
+        return "\n".join(lines)
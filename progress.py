@@ -0,0 +1,187 @@
+"""
+This module keeps track of the progress of a sweep. Jobs report when they
+start and finish, from whichever process runs them, and a thread in the
+launcher periodically writes a summary with the throughput, the utilisation
+of each worker and an estimated time of arrival to status.json in the run
+directory. The same numbers can also be written in the Prometheus textfile
+collector format.
+"""
+
+from __future__ import division
+import collections
+import json
+import os
+import threading
+import time
+
+
+def write_atomically(path, text):
+    """ Write to a temporary file and rename it, so readers never see a
+    half-written file """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as outfile:
+        outfile.write(text)
+    os.rename(tmp, path)
+
+
+class Progress(object):
+    """ Tracks completed, running and failed jobs and writes the status """
+
+    def __init__(self, directory, total, interval=30, metrics_file=None,
+                 window=600, events=None):
+        """ Parameters: directory: the run directory to write status.json to
+                        total: the number of jobs in the sweep
+                        interval: seconds between each write
+                        metrics_file: the Prometheus textfile, or None
+                        window: seconds of history used for the rate
+                        events: a list shared with the children, such as
+                                multiprocessing.Manager().list(), or None if
+                                only this process reports
+        """
+        self.path = os.path.join(directory, "status.json")
+        self.total = total
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.window = window
+        # Events from every process: (kind, worker, time, elapsed, failed).
+        # Not a multiprocessing.Queue, as a child exiting with unread data in
+        # its pipe would block until the queue is read
+        self.events = events if events is not None else []
+        self.start_time = time.time()
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        # The times of the recent completions, for the rolling rate
+        self.recent = collections.deque()
+        # {worker: {"completed":, "busy_seconds":, "slots":}}
+        self.workers = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def job_started(self, worker):
+        """ Report that a job started on the worker. Any process may call it """
+        self.events.append(("start", worker, time.time(), 0, False))
+
+    def job_finished(self, worker, elapsed, failed=False):
+        """ Report that a job finished. Any process may call it """
+        self.events.append(("done", worker, time.time(), elapsed, failed))
+
+    def set_slots(self, worker, slots):
+        """ Set the number of jobs the worker runs at once """
+        self.events.append(("slots", worker, time.time(), slots, False))
+
+    def worker(self, name):
+        """ The counters of the worker, created on first use """
+        if name not in self.workers:
+            self.workers[name] = {"completed": 0, "busy_seconds": 0.0,
+                                  "slots": 1}
+        return self.workers[name]
+
+    def drain(self):
+        """ Apply the events reported since the last time
+
+        Algorithm:  Only the events present when starting are removed, as
+                    the children may append more meanwhile
+        """
+        count = len(self.events)
+        events = self.events[:count]
+        del self.events[:count]
+        for kind, name, when, value, failed in events:
+            worker = self.worker(name)
+            if kind == "start":
+                self.started += 1
+            elif kind == "done":
+                self.completed += 1
+                self.failed += 1 if failed else 0
+                self.recent.append(when)
+                worker["completed"] += 1
+                worker["busy_seconds"] += value
+            elif kind == "slots":
+                worker["slots"] = value
+
+    def snapshot(self):
+        """ The current status as a dict
+
+        Algorithm:  The rate is the number of completions within the last
+                    window, divided by the window, or by the elapsed time if
+                    the run is younger than the window.
+                    The ETA is the remaining jobs divided by the rate. The
+                    utilisation of a worker is its busy time divided by the
+                    elapsed time and its number of slots
+        """
+        now = time.time()
+        while self.recent and self.recent[0] < now - self.window:
+            self.recent.popleft()
+        elapsed = now - self.start_time
+        span = min(self.window, elapsed)
+        rate = len(self.recent)/span*60 if span > 0 else 0.0
+        remaining = max(0, self.total - self.completed)
+        eta = remaining/rate*60 if rate > 0 else None
+        workers = {}
+        for name, worker in sorted(self.workers.items()):
+            capacity = elapsed*worker["slots"]
+            workers[name] = {"completed": worker["completed"],
+                             "busy_seconds": round(worker["busy_seconds"], 1),
+                             "utilisation": round(worker["busy_seconds"]/capacity, 3)
+                             if capacity > 0 else 0.0}
+        return {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "elapsed_seconds": round(elapsed, 1),
+                "total": self.total,
+                "completed": self.completed,
+                "failed": self.failed,
+                "running": max(0, self.started - self.completed),
+                "remaining": remaining,
+                "jobs_per_minute": round(rate, 2),
+                "eta_seconds": round(eta) if eta is not None else None,
+                "eta": time.strftime("%Y-%m-%d %H:%M:%S",
+                                     time.localtime(now + eta))
+                       if eta is not None else None,
+                "workers": workers}
+
+    def write(self):
+        """ Write status.json, and the metrics file if asked for """
+        self.drain()
+        status = self.snapshot()
+        write_atomically(self.path, json.dumps(status, indent=4) + "\n")
+        if self.metrics_file is not None:
+            write_atomically(self.metrics_file, self.prometheus(status))
+        return status
+
+    def prometheus(self, status):
+        """ Format the status for the Prometheus textfile collector """
+        lines = []
+        for name, key, text in [("jobs_total", "total", "Jobs in the sweep"),
+                                ("jobs_completed", "completed", "Jobs completed"),
+                                ("jobs_failed", "failed", "Jobs completed with errors"),
+                                ("jobs_running", "running", "Jobs running"),
+                                ("jobs_per_minute", "jobs_per_minute",
+                                 "Jobs completed per minute, rolling"),
+                                ("eta_seconds", "eta_seconds",
+                                 "Estimated seconds until the sweep is done")]:
+            if status[key] is None:
+                continue
+            lines.append("# HELP talys_{} {}".format(name, text))
+            lines.append("# TYPE talys_{} gauge".format(name))
+            lines.append("talys_{} {}".format(name, status[key]))
+        lines.append("# HELP talys_worker_utilisation Busy fraction of each worker")
+        lines.append("# TYPE talys_worker_utilisation gauge")
+        for name, worker in status["workers"].items():
+            lines.append('talys_worker_utilisation{{worker="{}"}} {}'.format(
+                name, worker["utilisation"]))
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """ Write the status every interval in a background thread """
+        def loop():
+            while not self.stop_event.wait(self.interval):
+                self.write()
+        self.thread = threading.Thread(target=loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the thread and write the final status """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.write()
@@ -6,6 +6,53 @@ the input from the user.
 from tools import make_iterable
 import json
 
+
+class Configuration(object):
+    """ A validated and frozen view of the input, compiled once by
+    Basic_reader.compile(). The attributes are looked up directly, so
+    this is what the launcher uses for every job.
+
+    Attributes: keywords: {keyword: [values]}, with unique values
+                varying: the keywords with more than one value in
+                         alphabetical order, without element and mass
+                fixed: {keyword: value} for the keywords that do not vary
+                elements: a tuple over the elements
+                mass: {element: (mass, ...)}
+                dependents: a tuple over the exclusive keyword groups
+                conditions: {keyword: value} for every keyword in dependents
+                blocks: {name: block} for the custom blocks
+                script_keywords: {keyword: value}
+                input_file, output_file, result_files: from script_keywords
+    """
+    __slots__ = ("keywords", "varying", "fixed", "elements", "mass",
+                 "dependents", "conditions", "blocks", "script_keywords",
+                 "input_file", "output_file", "result_files", "_lookup")
+
+    def __init__(self, fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+        # Keywords take precedence over script keywords, as in Basic_reader
+        lookup = dict(self.script_keywords)
+        lookup.update(self.keywords)
+        object.__setattr__(self, "_lookup", lookup)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The configuration is frozen")
+
+    def __reduce__(self):
+        """ Support pickling, which is needed to send it over MPI """
+        fields = dict((name, getattr(self, name)) for name in self.__slots__
+                      if name != "_lookup")
+        return (Configuration, (fields,))
+
+    def __getitem__(self, index):
+        """ Config[index] returns the keyword, or else the script keyword """
+        return self._lookup[index]
+
+    def __contains__(self, index):
+        return index in self._lookup
+
+
 class Basic_reader(object):
     """ A basic reader to build upon """
     def __init__(self):
@@ -20,18 +67,79 @@ class Basic_reader(object):
         self.dependents = []
         # Contains the keywords related to the script
         self.script_keywords = {}
+        # Contains the custom blocks
+        self.blocks = {}
+
+    # The script keywords that must be given for compile() to succeed
+    required_script_keywords = ()
 
     def __getitem__(self, index, s=False):
         """ Reader[index] first tries to return Reader.keywords[index]
         and if it fails, returns Reader.script_keywords[index]
         """
-        if s:
+        if s or index not in self.keywords:
             return self.script_keywords[index]
-        else:
-            try:
-                return self.keywords[index]
-            except KeyError:
-                return self.script_keywords[index]
+        return self.keywords[index]
+
+    def compile(self):
+        """ Validate the input and compile it into a Configuration
+
+        Parameters: None
+        Returns:    A Configuration
+        Algorithm:  Make the keywords iterable and unique, check that every
+                    element has masses and that the required script keywords
+                    are given, then sort the keywords into varying and fixed
+                    and flatten the dependents. Raise a ValueError if the input
+                    is invalid
+        """
+        keywords = make_iterable(self.keywords)
+        elements = tuple(keywords.get("element", ()))
+        mass = keywords.get("mass", {})
+        if not isinstance(mass, dict):
+            raise ValueError("mass must be given as {element: [masses]}")
+        for element in elements:
+            if not mass.get(element):
+                raise ValueError("No masses given for {}".format(element))
+        for key in self.required_script_keywords:
+            if key not in self.script_keywords:
+                raise ValueError("Missing script keyword {}".format(key))
+
+        varying = []
+        fixed = {}
+        for key in sorted(keywords):
+            if key in ("element", "mass"):
+                continue
+            if len(keywords[key]) > 1:
+                varying.append(key)
+            else:
+                fixed[key] = keywords[key][0]
+
+        conditions = {}
+        for condition in self.dependents:
+            for key, value in condition.items():
+                # The first group with the keyword wins, as in
+                # get_condition_val
+                conditions.setdefault(key, value)
+
+        result_files = self.script_keywords.get("result_files", ())
+        if not isinstance(result_files, (list, tuple)):
+            result_files = [result_files]
+
+        return Configuration({
+            "keywords": keywords,
+            "varying": tuple(varying),
+            "fixed": fixed,
+            "elements": elements,
+            "mass": dict((element, tuple(masses))
+                         for element, masses in mass.items()),
+            "dependents": tuple(tuple(condition.keys())
+                                for condition in self.dependents),
+            "conditions": conditions,
+            "blocks": dict(self.blocks),
+            "script_keywords": dict(self.script_keywords),
+            "input_file": self.script_keywords.get("input_file"),
+            "output_file": self.script_keywords.get("output_file"),
+            "result_files": tuple(result_files)})
 
     def convert(self, var):
         try:
@@ -53,6 +161,8 @@ class Basic_reader(object):
 
 class Json_reader(Basic_reader):
     """ Parses input from json file """
+    required_script_keywords = ("input_file", "output_file", "result_files")
+
     def __init__(self, filename):
         """ Reads the json file and puts the result into the correct variables
 
@@ -92,12 +202,12 @@ class Json_reader(Basic_reader):
                 if "active" in data[block]:
                     if data[block]["active"] == "False":
                         continue
-                # Read the block
+                # Read the block. It is also available as an attribute
+                self.blocks[block] = {}
+                self.__dict__[block] = self.blocks[block]
                 for key, value in data[block].items():
-                    if not hasattr(self, block):
-                        self.__dict__[block] = {}
                     if key != "comment":
-                        self.__dict__[block][key] = self.convert(value)
+                        self.blocks[block][key] = self.convert(value)
 
 
 class BRUSLIB_reader(Basic_reader):
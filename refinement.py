@@ -0,0 +1,171 @@
+"""
+This module refines the grid of one numeric keyword, such as gnorm or
+strength, where the results change the most. The values given in the input
+file are the coarse grid. When it is done, the rates in each job's
+astrorate.g are compared along the keyword, for every isotope and every
+combination of the other keywords. Between two neighbouring values whose
+rates differ by more than the tolerance, the midpoint is run in the next
+round. This goes on until the rates agree everywhere or max_rounds is
+reached. It is set up by a "refine" block in the input file:
+
+    "refine": {"keyword": "gnorm", "tolerance": 0.05, "max_rounds": 4}
+
+Optional are "result", the result file to compare (default astrorate.g),
+"column", the column of the rate in it (default 2, counting from 0),
+"digits", the decimals the new values are rounded to (default 6), and
+"max_points", the largest number of values along one line (default 65).
+"""
+
+from __future__ import division
+
+
+def read_rates(filename, column=2):
+    """ Read a column of a TALYS result table
+
+    Parameters: filename: e.g. the path of astrorate.g
+                column: the index of the column, counting from 0
+    Returns:    A list over the numbers in the column, or None if the file
+                can not be read
+    Algorithm:  Use every line consisting of numbers only, which skips the
+                comments and headers. Lines too short for the column are
+                skipped
+    """
+    rates = []
+    try:
+        with open(filename) as table:
+            for line in table:
+                try:
+                    numbers = [float(word) for word in line.split()]
+                except ValueError:
+                    continue
+                if len(numbers) > column:
+                    rates.append(numbers[column])
+    except (IOError, OSError):
+        return None
+    return rates
+
+
+def difference(rates1, rates2):
+    """ The largest relative difference between two lists of rates """
+    largest = 0.0
+    for r1, r2 in zip(rates1, rates2):
+        scale = max(abs(r1), abs(r2))
+        if scale > 0:
+            largest = max(largest, abs(r1 - r2)/scale)
+    return largest
+
+
+class Round(object):
+    """ The jobs of one refinement round. Used in place of the Sampler """
+
+    def __init__(self, number, values, combinations):
+        """ Parameters: number: the number of the round, from 1
+                        values: every new value of the keyword, sorted
+                        combinations: {isotope: [combinations]}
+        """
+        self.number = number
+        self.values = values
+        self.combinations = combinations
+        self.total = sum(len(c) for c in combinations.values())
+
+    def select(self, values, isotope=None):
+        """ The combinations to run for the isotope. See Sampler.select """
+        return list(self.combinations.get((str(isotope[0]), str(isotope[1])), []))
+
+    def count(self, sizes, isotope=None):
+        return len(self.select(None, isotope))
+
+
+class Refiner(object):
+    """ Plans the refinement rounds from the results of the previous """
+
+    def __init__(self, block, varying, result_files):
+        """ Parameters: block: the "refine" block of the input
+                        varying: the names of the varying keywords
+                        result_files: the result files collected from each job
+            Raises:     ValueError if the block is invalid
+        """
+        self.keyword = block.get("keyword")
+        if self.keyword not in varying:
+            raise ValueError("The keyword to refine must have several values, "
+                             "not {}".format(self.keyword))
+        self.tolerance = float(block.get("tolerance", 0.05))
+        self.max_rounds = int(block.get("max_rounds", 4))
+        self.result = block.get("result", "astrorate.g")
+        if self.result not in result_files:
+            raise ValueError("{} is not one of the result files".format(self.result))
+        self.column = int(block.get("column", 2))
+        self.digits = int(block.get("digits", 6))
+        self.max_points = int(block.get("max_points", 65))
+        self.rounds = 0
+        # (isotope, combination, index of the keyword, result file) of
+        # every job. Replaced by a list shared with the children
+        self.jobs = []
+
+    def describe(self):
+        """ A short description for the information file """
+        return "{} to a tolerance of {:g} in {}, at most {} rounds".format(
+            self.keyword, self.tolerance, self.result, self.max_rounds)
+
+    def record(self, isotope, combination, index, result_file):
+        """ Remember a job, to read its result when the round is done
+
+        Parameters: isotope: (element, mass)
+                    combination: the values of the job, as from select()
+                    index: the position of the keyword in the combination
+                    result_file: the path of the result to compare
+        """
+        self.jobs.append(((str(isotope[0]), str(isotope[1])), tuple(combination),
+                          index, result_file))
+
+    def lines(self):
+        """ Group the jobs by isotope and the values of the other keywords
+
+        Returns:    {(isotope, combination without the keyword, index):
+                     {value: result file}}
+        """
+        lines = {}
+        for isotope, combination, index, result_file in self.jobs:
+            rest = combination[:index] + combination[index+1:]
+            line = lines.setdefault((isotope, rest, index), {})
+            line[float(combination[index])] = result_file
+        return lines
+
+    def next_round(self):
+        """ Plan the next round
+
+        Returns:    A Round, or None if the tolerance is met everywhere or
+                    max_rounds is reached
+        Algorithm:  Along each line, sort the values and compare the rates
+                    of neighbours. Add the midpoint of each interval where
+                    they differ by more than the tolerance, unless rounding
+                    makes it equal to an end point. Jobs without a readable
+                    result are left out of the comparison
+        """
+        if self.rounds >= self.max_rounds:
+            return None
+        combinations = {}
+        values = set()
+        for (isotope, rest, index), line in sorted(self.lines().items()):
+            points = []
+            for value in sorted(line):
+                rates = read_rates(line[value], self.column)
+                if rates:
+                    points.append((value, rates))
+            new = []
+            for (v1, r1), (v2, r2) in zip(points, points[1:]):
+                if len(line) + len(new) >= self.max_points:
+                    break
+                if difference(r1, r2) <= self.tolerance:
+                    continue
+                middle = round((v1 + v2)/2, self.digits)
+                if v1 < middle < v2:
+                    new.append(middle)
+            for value in new:
+                combination = rest[:index] + (value,) + rest[index:]
+                combinations.setdefault(isotope, []).append(combination)
+                values.add(value)
+        if not values:
+            return None
+        self.rounds += 1
+        return Round(self.rounds, sorted(values), combinations)
@@ -0,0 +1,209 @@
+#! /usr/bin/python
+"""
+Compares the results of two sweeps, e.g. before and after changing the
+TALYS build or the input, and reports the jobs and temperatures whose
+results differ.
+Syntax:
+python rundiff.py DIRECTORY_A DIRECTORY_B [--files astrorate.g astrorate.tot]
+                  [--rtol 1e-6] [--atol 0] [-p N]
+
+The jobs are matched by isotope and by the values of the keywords varied in
+either sweep, as recorded in their catalogs, so the sweeps may be run with
+different directories, orders or subsets of the grid. If a sweep has no
+catalog, the jobs are matched by the names of their result files instead.
+Two numbers differ if |a - b| > atol + rtol*|b|. Every column of the tables
+is compared, and a row is reported by its first column, the temperature.
+The files are compared in parallel by -p processes. The exit code is 1 if
+anything differs.
+"""
+
+from __future__ import print_function, division
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import numpy as np
+import catalog
+from cube import read_table, find_run_path
+
+
+def normalise(value):
+    """ Numbers as floats, so 1 and 1.0 match """
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return value
+
+
+def load_jobs(directory, files):
+    """ Find the jobs of a sweep
+
+    Parameters: directory: the TALYS-calculations directory
+                files: the result files to compare
+    Returns:    (jobs, varying), jobs a list over (isotope, {keyword: value},
+                {file: path}), varying the set of keywords varied, or None
+                if there is no catalog
+    """
+    path = os.path.join(directory, catalog.FILENAME)
+    jobs = {}
+    if not os.path.exists(path):
+        top = os.path.join(directory, "results_data")
+        for root, dirs, names in os.walk(top):
+            dirs.sort()
+            for filename in sorted(names):
+                for result in files:
+                    if filename == result or filename.endswith("-" + result):
+                        name = filename[:-len(result)].rstrip("-")
+                        isotope = os.path.basename(root)
+                        job = jobs.setdefault((isotope, name),
+                                              (isotope, {"name": name}, {}))
+                        job[2][result] = os.path.join(root, filename)
+        return list(jobs.values()), None
+    connection = sqlite3.connect(path)
+    try:
+        varying = set()
+        rows = connection.execute(
+            "SELECT jobs.id, jobs.element, jobs.mass, jobs.name, results.file, "
+            "results.path FROM jobs JOIN results ON results.job_id = jobs.id "
+            "WHERE jobs.status IN ('done', 'duplicate')")
+        for job_id, element, mass, name, result, result_path in rows:
+            if result not in files:
+                continue
+            job = jobs.setdefault(job_id, ("{}{}".format(mass, element),
+                                           {"name": name}, {}))
+            job[2][result] = find_run_path(directory, result_path)
+        rows = connection.execute("SELECT job_id, keyword, value, varying "
+                                  "FROM parameters")
+        for job_id, keyword, value, swept in rows:
+            if job_id in jobs:
+                jobs[job_id][1][keyword] = value
+                if swept:
+                    varying.add(keyword)
+    finally:
+        connection.close()
+    return list(jobs.values()), varying
+
+
+def match(jobs_a, jobs_b, keywords):
+    """ Pair the jobs of two sweeps
+
+    Parameters: jobs_a, jobs_b: as given by load_jobs
+                keywords: the keywords identifying a job besides the isotope
+    Returns:    (pairs, only_a, only_b), pairs a list over (label, job_a,
+                job_b), the others lists over labels
+    """
+    def key(job):
+        isotope, parameters, results = job
+        return (isotope,) + tuple(normalise(parameters.get(k, "")) for k in keywords)
+
+    def label(job):
+        isotope, parameters, results = job
+        return " ".join([isotope] + ["{}={}".format(k, parameters[k])
+                                     for k in keywords if k in parameters])
+
+    a = dict((key(job), job) for job in jobs_a)
+    b = dict((key(job), job) for job in jobs_b)
+    pairs = [(label(a[k]), a[k], b[k]) for k in sorted(set(a) & set(b))]
+    only_a = sorted(label(a[k]) for k in set(a) - set(b))
+    only_b = sorted(label(b[k]) for k in set(b) - set(a))
+    return pairs, only_a, only_b
+
+
+def compare_files(task):
+    """ Compare two result tables
+
+    Parameters: task: (label, file, path_a, path_b, rtol, atol)
+    Returns:    (label, file, differences, error), differences a list over
+                (temperature, row_a, row_b) of the rows that differ, error a
+                message or None
+    Algorithm:  Compare all numbers at once. Tables of different shapes
+                are reported as an error
+    """
+    label, filename, path_a, path_b, rtol, atol = task
+    a = read_table(path_a)
+    b = read_table(path_b)
+    if a is None or b is None:
+        return label, filename, [], "could not read {}".format(
+            path_a if a is None else path_b)
+    if a.shape != b.shape:
+        return label, filename, [], "shapes differ: {} and {}".format(a.shape, b.shape)
+    differ = np.abs(a - b) > atol + rtol*np.abs(b)
+    # NaN on both sides is equal
+    differ &= ~(np.isnan(a) & np.isnan(b))
+    differ |= np.isnan(a) != np.isnan(b)
+    rows = np.nonzero(differ.any(axis=1))[0]
+    return label, filename, [(a[i, 0], a[i], b[i]) for i in rows], None
+
+
+def diff(directory_a, directory_b, files=("astrorate.g", "astrorate.tot"),
+         rtol=1e-6, atol=0.0, processes=None):
+    """ Compare two sweeps
+
+    Returns:    (results, only_a, only_b), results a list over the return
+                values of compare_files of the files that differ
+    Algorithm:  Identify the jobs by the keywords varied in either sweep,
+                or by name if a sweep has no catalog
+    """
+    jobs_a, varying_a = load_jobs(directory_a, files)
+    jobs_b, varying_b = load_jobs(directory_b, files)
+    if varying_a is None or varying_b is None:
+        keywords = ["name"]
+    else:
+        keywords = sorted(varying_a | varying_b)
+    pairs, only_a, only_b = match(jobs_a, jobs_b, keywords)
+    tasks = [(label, filename, job_a[2][filename], job_b[2][filename], rtol, atol)
+             for label, job_a, job_b in pairs
+             for filename in files
+             if filename in job_a[2] and filename in job_b[2]]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(compare_files, tasks, chunksize=max(1, len(tasks)//64))
+    finally:
+        pool.close()
+        pool.join()
+    return [r for r in results if r[2] or r[3]], only_a, only_b
+
+
+def report(results, only_a, only_b, outfile=sys.stdout):
+    for label in only_a:
+        print("Only in A:", label, file=outfile)
+    for label in only_b:
+        print("Only in B:", label, file=outfile)
+    for label, filename, differences, error in results:
+        if error:
+            print("{} {}: {}".format(label, filename, error), file=outfile)
+            continue
+        print("{} {}: {} temperatures differ".format(label, filename,
+                                                     len(differences)), file=outfile)
+        for temperature, a, b in differences:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                relative = np.nanmax(np.abs(a - b)/np.abs(b))
+            print("    T = {:<10g} A: {}".format(temperature, " ".join(
+                "{:.5E}".format(x) for x in a[1:])), file=outfile)
+            print("    {:14} B: {}   largest relative difference {:.3g}".format(
+                "", " ".join("{:.5E}".format(x) for x in b[1:]), relative),
+                file=outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=("Report the results which "
+                                                  "differ between two sweeps"))
+    parser.add_argument("a", help="the first TALYS-calculations directory")
+    parser.add_argument("b", help="the second TALYS-calculations directory")
+    parser.add_argument("--files", help="the result files to compare",
+                        nargs="+", default=["astrorate.g", "astrorate.tot"])
+    parser.add_argument("--rtol", help="the relative tolerance",
+                        type=float, default=1e-6)
+    parser.add_argument("--atol", help="the absolute tolerance",
+                        type=float, default=0.0)
+    parser.add_argument("-p", "--processes",
+                        help="the number of processes comparing files. Default is all cores",
+                        type=int, default=None)
+    args = parser.parse_args()
+    results, only_a, only_b = diff(args.a, args.b, args.files, args.rtol,
+                                   args.atol, args.processes)
+    report(results, only_a, only_b)
+    print("{} files differ, {} jobs only in A, {} only in B".format(
+        len(results), len(only_a), len(only_b)))
+    sys.exit(1 if results or only_a or only_b else 0)
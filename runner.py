@@ -0,0 +1,343 @@
+"""
+This module contains the functions that run a single TALYS job and collect
+its results. They are shared by the Manager, the MPI children and the
+workers of the coordinator, and do not depend on any of them.
+"""
+
+from __future__ import print_function
+import errno
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import affinity
+from tools import which
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows
+    fcntl = None
+
+# How collect_results places the result files, in the order auto tries them
+COLLECT_MODES = ("reflink", "hardlink", "copy")
+DEFAULT_COLLECT = "auto"
+
+# The FICLONE ioctl of Linux, making a copy-on-write clone of a file
+FICLONE = 0x40049409
+
+# (mode, device) which were found not to work, so auto does not try them again
+_unsupported = set()
+
+
+class TalysTimeout(Exception):
+    """ Raised when TALYS is killed for running longer than its time limit """
+    def __init__(self, elapsed):
+        super(TalysTimeout, self).__init__(
+            "TALYS was killed after {:.0f} seconds".format(elapsed))
+        self.elapsed = elapsed
+
+
+class Spawner(object):
+    """ Starts TALYS in a process group of its own
+
+    The process group lets the timeout and the control kill, stop and
+    continue TALYS together with anything it starts, and keeps signals sent
+    to the launcher, such as Ctrl-C, from reaching TALYS. The subclasses
+    differ in how the group is made.
+    """
+    name = None
+
+    def __init__(self, executable="talys"):
+        """ Parameters: executable: the TALYS binary. Looked up in PATH
+                                    once, here. Paths containing a directory
+                                    are relative to the work directory
+        """
+        if os.sep in executable:
+            self.executable = executable
+        else:
+            self.executable = which(executable) or executable
+
+    def popen(self, cwd, stdin, stdout):
+        """ Start TALYS
+
+        Parameters: cwd: the directory to run in
+                    stdin, stdout: the open input and output files
+        Returns:    The subprocess.Popen object
+        """
+        return subprocess.Popen([self.executable], cwd=cwd, stdin=stdin,
+                                stdout=stdout, stderr=subprocess.PIPE,
+                                close_fds=True, **self.options())
+
+    def options(self):
+        """ The options to Popen making the process group """
+        raise NotImplementedError
+
+
+class SessionSpawner(Spawner):
+    """ Makes the group with start_new_session
+
+    The session is made in C by the child, so CPython can start TALYS with
+    vfork instead of fork, and no Python runs between fork and exec, which
+    is not safe when the launcher has threads
+    """
+    name = "session"
+
+    def options(self):
+        return {"start_new_session": True}
+
+
+class PreexecSpawner(Spawner):
+    """ Makes the group with preexec_fn=os.setpgrp
+
+    Runs Python in the child between fork and exec, which forces a full fork.
+    The only choice on Python 2
+    """
+    name = "preexec"
+
+    def options(self):
+        return {"preexec_fn": os.setpgrp}
+
+
+SPAWNERS = dict((spawner.name, spawner)
+                for spawner in (SessionSpawner, PreexecSpawner))
+# start_new_session came in Python 3.2
+DEFAULT_SPAWNER = "session" if sys.version_info >= (3, 2) else "preexec"
+
+
+def make_spawner(name=None, executable="talys"):
+    """ Make the spawner of the given name, or the default one
+
+    Parameters: name: a key of SPAWNERS, or None for DEFAULT_SPAWNER
+                executable: the TALYS binary
+    Returns:    The Spawner
+    """
+    return SPAWNERS[name or DEFAULT_SPAWNER](executable)
+
+
+def run_talys(work_directory, result_directory, name, input_file,
+              output_file, result_files, spawner=None, cpu=None,
+              timeout=None, pids=None, timings=None, collect=None):
+    """ Runs TALYS in the work directory and collects the results
+
+    Parameters: work_directory: the directory containing the input file
+                result_directory: the directory to copy the results to
+                name: the name of the job, used as prefix for the results
+                input_file: the name of the TALYS input file
+                output_file: the name of the TALYS output file
+                result_files: the names of the files to collect
+                spawner: the Spawner starting TALYS, or None to start
+                         talys from PATH the default way
+                cpu: the core to pin TALYS to, or None to not pin it
+                timeout: the wall-time limit in seconds, or None
+                pids: a list to hold the PID of TALYS while it runs, so it
+                      can be signalled from outside, or None
+                timings: a dict to fill with the times TALYS was started
+                         ("start"), was running ("spawned") and ended ("end")
+                         and the results were copied ("collected"), or None
+                collect: how the results are placed in the result
+                         directory, one of COLLECT_MODES or "auto", see
+                         place_file. None is the default, auto
+    Returns:    The execution time in seconds and a list over errors
+    Algorithm:  Start TALYS in the work directory with the input file as
+                stdin and the output file as stdout. The working directory
+                is passed to the child instead of changing it in this process,
+                which makes the function safe to use from several threads.
+                If the timeout is reached, a timer kills the process group of
+                TALYS, which was made by the spawner, and TalysTimeout is
+                raised
+    """
+    killed = []
+
+    def kill(process):
+        killed.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # Already terminated
+            pass
+
+    if spawner is None:
+        spawner = make_spawner()
+    errors = []
+    start = time.time()
+    with open(os.path.join(work_directory, input_file), "r") as stdin:
+        with open(os.path.join(work_directory, output_file), "w") as stdout:
+            process = spawner.popen(work_directory, stdin, stdout)
+            spawned = time.time()
+            affinity.pin(process.pid, cpu)
+            if pids is not None:
+                pids.append(process.pid)
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, kill, (process,))
+                timer.daemon = True
+                timer.start()
+            # Check STDERR and see if they are non-empty
+            _, stderr = process.communicate()
+            if timer is not None:
+                timer.cancel()
+            if pids is not None:
+                pids.remove(process.pid)
+    end = time.time()
+    elapsed = end - start
+    if timings is not None:
+        timings.update(start=start, spawned=spawned, end=end, collected=end)
+    if killed:
+        raise TalysTimeout(elapsed)
+    if stderr:
+        errors.append("TALYS could not be run: {}".format(
+            stderr.decode("utf8", "replace").rstrip()))
+
+    errors.extend(collect_results(work_directory, result_directory, name,
+                                  output_file, result_files, collect))
+    if timings is not None:
+        timings["collected"] = time.time()
+    return elapsed, errors
+
+
+def run_with_retries(retries, *args, **kwargs):
+    """ Runs TALYS, and again if it is killed by the timeout
+
+    Parameters: retries: the number of times to run again after a timeout
+                args, kwargs: the arguments to run_talys
+    Returns:    The execution time, a list over errors, the number of
+                attempts and whether the last attempt timed out
+    """
+    for attempt in range(1, retries+2):
+        try:
+            elapsed, errors = run_talys(*args, **kwargs)
+            return elapsed, errors, attempt, False
+        except TalysTimeout as exc:
+            timeout = exc
+    return timeout.elapsed, [str(timeout)], attempt, True
+
+
+def job_timeout(durations, timeout=None, factor=None, min_samples=5):
+    """ The wall-time limit of the next job
+
+    Parameters: durations: the execution times of the completed jobs
+                timeout: an absolute limit in seconds, or None
+                factor: a limit as a multiple of the median execution time,
+                        or None
+                min_samples: the number of completed jobs needed before the
+                             median is trusted
+    Returns:    The limit in seconds, or None if there is no limit
+    Algorithm:  Use the median of the last 100 jobs as the predicted
+                execution time. If both limits are given, use the smallest
+    """
+    limits = []
+    if timeout:
+        limits.append(timeout)
+    if factor and len(durations) >= min_samples:
+        recent = sorted(durations[-100:])
+        limits.append(factor*recent[len(recent)//2])
+    return min(limits) if limits else None
+
+
+def result_path(result_directory, name, filename):
+    """ The path a result file of the job is collected to """
+    return os.path.join(result_directory,
+                        "{}-{}".format(name, filename) if name else filename)
+
+
+def reflink(source, destination):
+    """ Make destination a copy-on-write clone of source
+
+    Raises:     OSError or IOError if the file system can not clone
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported")
+    with open(source, "rb") as infile:
+        with open(destination, "wb") as outfile:
+            try:
+                fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            except (IOError, OSError) as exc:
+                outfile.close()
+                os.remove(destination)
+                raise OSError(exc.errno, "Could not reflink {} to {}: {}".format(
+                    source, destination, exc.strerror))
+
+
+def place_file(source, destination, mode=None):
+    """ Place a copy of the file at destination
+
+    Parameters: source: the path of the file
+                destination: the path of the copy. Replaced if it exists
+                mode: "reflink", "hardlink", "copy", or "auto" or None to try
+                      them in that order
+    Returns:    The mode used
+    Raises:     OSError or IOError if the mode asked for does not work
+    Algorithm:  A reflink shares the data blocks of the files until one of
+                them is changed, as on Btrfs and XFS. A hard link is the same
+                file under two names, so changing one changes both. Both
+                only write metadata. A mode failing on a device is not tried
+                again there by auto, so only the first file pays for it
+    """
+    mode = mode or DEFAULT_COLLECT
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode != "auto":
+        modes = [mode]
+    else:
+        device = os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+        modes = [m for m in COLLECT_MODES if (m, device) not in _unsupported]
+    for m in modes:
+        try:
+            if m == "reflink":
+                reflink(source, destination)
+            elif m == "hardlink":
+                os.link(source, destination)
+            else:
+                shutil.copy(source, destination)
+            return m
+        except (IOError, OSError, AttributeError) as exc:
+            if mode != "auto" or m == "copy":
+                raise
+            if getattr(exc, "errno", None) == errno.ENOENT:
+                # The source is missing, which no mode can help
+                raise
+            _unsupported.add((m, device))
+
+
+def collect_results(work_directory, result_directory, name, output_file,
+                    result_files, collect=None):
+    """ Place the result files in the result directory
+
+    Parameters: work_directory: the directory TALYS was run in
+                result_directory: the directory to copy the results to
+                name: the name of the job, used as prefix for the results
+                output_file: the name of the TALYS output file
+                result_files: the names of the files to collect
+                collect: the mode of place_file
+    Returns:    A list over errors
+    Algorithm:  Reflink, link or copy each result file. If it fails, the
+                filesize of the output file is an indicator of whether the
+                execution was successful or not. If it is small, add its
+                content to the errors
+    """
+    errors = []
+    try:
+        for filename in result_files:
+            place_file(os.path.join(work_directory, filename),
+                       result_path(result_directory, name, filename), collect)
+    except Exception as exc:
+        # Give TALYS some time to write the output.txt
+        time.sleep(1)
+
+        errors.append(str(exc))
+        path = os.path.join(work_directory, output_file)
+        if os.path.exists(path) and os.path.getsize(path) < 600:
+            # Execution failed. Open the file and log the output
+            with open(path, "r") as output:
+                msg = ''.join(output.readlines()).rstrip()
+            errors.append(msg[1:])
+    return errors
+
+
+def format_time(seconds):
+    """ Format an execution time as MM:SS, as used in the log """
+    return time.strftime("%M:%S", time.gmtime(seconds))
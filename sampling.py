@@ -0,0 +1,165 @@
+"""
+This module selects which points of the parameter grid are run. By default
+every combination of the varying keywords and the dependents is run for each
+isotope. A "sampling" block in the input file runs a subset instead:
+
+    "sampling": {"method": "lhs", "samples": 50, "seed": 1}
+
+The methods are
+    full        every combination, the default
+    random      "samples" combinations drawn without replacement
+    lhs         a Latin hypercube of "samples" points: each value of each
+                keyword is used about equally often
+
+"fraction" can be given instead of "samples", e.g. 0.1 for a tenth of the
+grid. With "per_isotope": "y", each isotope gets a sample of its own, drawn
+with a seed made from "seed" and the isotope. Otherwise every isotope runs
+the same combinations, which makes the isotopes comparable. The same seed
+always gives the same sample.
+"""
+
+import random
+from itertools import product
+
+METHODS = ("full", "random", "lhs")
+
+
+def grid_point(index, sizes):
+    """ Convert an index into the flattened grid to one index per dimension
+
+    Parameters: index: the index into the flattened grid
+                sizes: the number of values along each dimension
+    Returns:    A tuple over the index along each dimension
+    Algorithm:  The last dimension varies fastest, as in itertools.product
+    """
+    point = []
+    for size in reversed(sizes):
+        index, i = divmod(index, size)
+        point.append(i)
+    return tuple(reversed(point))
+
+
+def random_points(sizes, samples, rng):
+    """ Draw grid points uniformly without replacement
+
+    Returns:    A list over the points, in the order of the grid
+    """
+    total = 1
+    for size in sizes:
+        total *= size
+    indices = rng.sample(range(total), min(samples, total))
+    return [grid_point(index, sizes) for index in sorted(indices)]
+
+
+def latin_hypercube(sizes, samples, rng):
+    """ Draw a Latin hypercube over the grid
+
+    Returns:    A list over the points, without duplicates
+    Algorithm:  Split each dimension into as many strata as samples, and
+                give every sample a different stratum along each dimension
+                by a random permutation. A point inside the stratum is
+                drawn and mapped onto the values of the dimension. With fewer
+                values than samples, points may coincide and are only run
+                once
+    """
+    columns = []
+    for size in sizes:
+        strata = rng.sample(range(samples), samples)
+        columns.append([int((stratum + rng.random())*size/samples)
+                        for stratum in strata])
+    points = []
+    seen = set()
+    for point in zip(*columns):
+        if point not in seen:
+            seen.add(point)
+            points.append(point)
+    return points
+
+
+class Sampler(object):
+    """ Selects the combinations of keywords to run """
+
+    def __init__(self, block=None):
+        """ Parameters: block: the "sampling" block of the input, or None to
+                               run the full grid
+            Raises:     ValueError if the block is invalid
+        """
+        block = dict(block or {})
+        self.method = block.get("method", "full")
+        if self.method not in METHODS:
+            raise ValueError("Unknown sampling method {}. Use one of {}".format(
+                self.method, ", ".join(METHODS)))
+        self.samples = block.get("samples")
+        self.fraction = block.get("fraction")
+        if self.method != "full":
+            if (self.samples is None) == (self.fraction is None):
+                raise ValueError("Give either samples or fraction for "
+                                 "sampling method {}".format(self.method))
+            if self.fraction is not None and not 0 < float(self.fraction) <= 1:
+                raise ValueError("The sampling fraction must be in (0, 1]")
+            if self.samples is not None and int(self.samples) < 1:
+                raise ValueError("The number of samples must be at least 1")
+        # The reader converts numbers to float
+        self.seed = int(block.get("seed", 0))
+        self.per_isotope = str(block.get("per_isotope", "n")).lower() in ("y", "yes", "true")
+
+    def number(self, total):
+        """ The number of samples to draw from a grid of the given size """
+        if self.samples is not None:
+            return min(int(self.samples), total)
+        return max(1, int(round(float(self.fraction)*total)))
+
+    def points(self, sizes, isotope=None):
+        """ The grid points to run
+
+        Parameters: sizes: the number of values along each dimension
+                    isotope: e.g. ("Dy", 160), used for the seed if
+                             per_isotope
+        Returns:    A list over tuples of indices, or None for the full grid
+        """
+        if self.method == "full":
+            return None
+        seed = self.seed
+        if self.per_isotope and isotope is not None:
+            seed = "{}-{}{}".format(self.seed, isotope[1], isotope[0])
+        rng = random.Random(seed)
+        total = 1
+        for size in sizes:
+            total *= size
+        if self.method == "random":
+            return random_points(sizes, self.number(total), rng)
+        return latin_hypercube(sizes, self.number(total), rng)
+
+    def select(self, values, isotope=None):
+        """ The combinations of values to run
+
+        Parameters: values: a list over the values of each dimension, as
+                            given to itertools.product
+                    isotope: e.g. ("Dy", 160), used for the seed if
+                             per_isotope
+        Returns:    An iterable over tuples, one value from each dimension
+        """
+        values = [list(v) for v in values]
+        points = self.points([len(v) for v in values], isotope)
+        if points is None:
+            return product(*values)
+        return (tuple(v[i] for v, i in zip(values, point)) for point in points)
+
+    def count(self, sizes, isotope=None):
+        """ The number of combinations select() gives """
+        points = self.points(sizes, isotope)
+        if points is None:
+            total = 1
+            for size in sizes:
+                total *= size
+            return total
+        return len(points)
+
+    def describe(self):
+        """ A short description for the information file """
+        if self.method == "full":
+            return "full grid"
+        amount = ("{} samples".format(int(self.samples)) if self.samples is not None
+                  else "{:g} of the grid".format(float(self.fraction)))
+        return "{}, {}, seed {}{}".format(self.method, amount, self.seed,
+                                          ", per isotope" if self.per_isotope else "")
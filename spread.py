@@ -0,0 +1,212 @@
+#! /usr/bin/python
+"""
+Computes the spread of the rates across the variations of a sweep. For each
+isotope, the rates of every job, i.e. every combination of strength,
+massmodel, ldmodel, the dependents and the other varying keywords, are
+reduced to the minimum, the maximum, the mean and percentiles at each
+temperature. One table is written for each isotope.
+Syntax:
+python spread.py DIRECTORY [--result astrorate.g] [--column 2]
+                 [--percentiles 5 16 50 84 95] [--output DIR] [--max-rows N]
+
+The results are read once, one isotope at a time, so only the rates of one
+isotope are held in memory. The jobs are found in the catalog of the sweep,
+or else by walking results_data. The minimum, maximum and mean are exact.
+The percentiles are exact up to --max-rows jobs for an isotope, and estimated
+from a uniform sample of that many jobs above it.
+"""
+
+from __future__ import print_function, division
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import numpy as np
+import catalog
+from cube import read_table, find_run_path
+
+
+class Accumulator(object):
+    """ The statistics of the rates of one isotope, fed one job at a time """
+
+    def __init__(self, temperatures, max_rows=100000, seed=0):
+        """ Parameters: temperatures: the temperatures of the table
+                        max_rows: the most rates kept for the percentiles
+                        seed: the seed of the sample kept above max_rows
+        """
+        self.temperatures = np.asarray(temperatures)
+        width = len(self.temperatures)
+        self.max_rows = max_rows
+        self.rows = np.empty((min(256, max_rows), width))
+        self.kept = 0
+        self.count = np.zeros(width, dtype=int)
+        self.minimum = np.full(width, np.inf)
+        self.maximum = np.full(width, -np.inf)
+        self.sum = np.zeros(width)
+        self.seen = 0
+        self.rng = random.Random(seed)
+
+    def add(self, rates):
+        """ Add the rates of a job, one for each temperature
+
+        Algorithm:  Update the minimum, maximum and sum of every temperature
+                    at once. Keep the rates for the percentiles, doubling the
+                    buffer up to max_rows. Above it, replace a kept job with
+                    the probability max_rows/seen, a reservoir sample
+        """
+        row = np.full(len(self.temperatures), np.nan)
+        n = min(len(rates), len(row))
+        row[:n] = rates[:n]
+        valid = ~np.isnan(row)
+        self.count += valid
+        self.minimum = np.where(valid, np.fmin(self.minimum, row), self.minimum)
+        self.maximum = np.where(valid, np.fmax(self.maximum, row), self.maximum)
+        self.sum += np.where(valid, row, 0)
+        self.seen += 1
+        if self.kept < self.max_rows:
+            if self.kept == len(self.rows):
+                grown = np.empty((min(2*len(self.rows), self.max_rows),
+                                  self.rows.shape[1]))
+                grown[:self.kept] = self.rows
+                self.rows = grown
+            self.rows[self.kept] = row
+            self.kept += 1
+        else:
+            j = self.rng.randrange(self.seen)
+            if j < self.max_rows:
+                self.rows[j] = row
+
+    def table(self, percentiles):
+        """ The statistics as columns
+
+        Returns:    (names, array), the array with a row for each
+                    temperature and a column for each name
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum/self.count
+        kept = self.rows[:self.kept]
+        if len(percentiles):
+            quantiles = np.nanpercentile(kept, percentiles, axis=0)
+        else:
+            quantiles = np.empty((0, len(self.temperatures)))
+        missing = self.count == 0
+        names = (["T", "n", "min"] + ["p{:g}".format(p) for p in percentiles]
+                 + ["max", "mean"])
+        columns = ([self.temperatures, self.count,
+                    np.where(missing, np.nan, self.minimum)]
+                   + list(quantiles)
+                   + [np.where(missing, np.nan, self.maximum), mean])
+        return names, np.column_stack(columns)
+
+
+def jobs_from_catalog(directory, result):
+    """ The result files of the jobs done, from the catalog
+
+    Returns:    An iterator over (isotope, path), grouped by isotope
+    """
+    connection = sqlite3.connect(os.path.join(directory, catalog.FILENAME))
+    try:
+        rows = connection.execute(
+            "SELECT jobs.element, jobs.mass, results.path FROM jobs "
+            "JOIN results ON results.job_id = jobs.id "
+            "WHERE jobs.status IN ('done', 'duplicate') AND results.file = ? "
+            "ORDER BY jobs.element, jobs.mass", (result,))
+        for element, mass, path in rows:
+            yield "{}{}".format(mass, element), find_run_path(directory, path)
+    finally:
+        connection.close()
+
+
+def jobs_from_directories(directory, result):
+    """ The result files found in results_data, for sweeps without a catalog
+
+    Returns:    An iterator over (isotope, path), grouped by isotope
+    Algorithm:  results_data has a directory for each element, with one for
+                each isotope, e.g. 066Dy/160Dy, holding the results of the
+                isotope's jobs
+    """
+    top = os.path.join(directory, "results_data")
+    for element in sorted(os.listdir(top)):
+        for isotope in sorted(os.listdir(os.path.join(top, element))):
+            path = os.path.join(top, element, isotope)
+            if not os.path.isdir(path):
+                continue
+            for filename in sorted(os.listdir(path)):
+                if filename == result or filename.endswith("-" + result):
+                    yield isotope, os.path.join(path, filename)
+
+
+def write_table(path, isotope, result, column, jobs, names, table):
+    with open(path, "w") as outfile:
+        outfile.write("# Spread of column {} of {} for {} over {} jobs\n".format(
+            column, result, isotope, jobs))
+        outfile.write("# " + " ".join("{:>12}".format(name) for name in names) + "\n")
+        for row in table:
+            outfile.write("  " + " ".join("{:12.5E}".format(value) for value in row)
+                          + "\n")
+
+
+def spread(directory, result="astrorate.g", column=2,
+           percentiles=(5, 16, 50, 84, 95), output=None, max_rows=100000):
+    """ Write the spread of each isotope's rates
+
+    Parameters: directory: the TALYS-calculations directory
+                result: the result file to read
+                column: the column of the rate, counting from 0. The first
+                        column is the temperature
+                percentiles: the percentiles to give
+                output: the directory to write to. Default is spread in the
+                        run directory
+                max_rows: the most jobs held for an isotope's percentiles
+    Returns:    A list over the tables written
+    """
+    if output is None:
+        output = os.path.join(directory, "spread")
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    if os.path.exists(os.path.join(directory, catalog.FILENAME)):
+        jobs = jobs_from_catalog(directory, result)
+    else:
+        jobs = jobs_from_directories(directory, result)
+    written = []
+    for isotope, paths in itertools.groupby(jobs, key=lambda job: job[0]):
+        accumulator = None
+        for _, path in paths:
+            table = read_table(path)
+            if table is None or table.shape[1] <= column:
+                continue
+            if accumulator is None:
+                accumulator = Accumulator(table[:, 0], max_rows)
+            accumulator.add(table[:, column])
+        if accumulator is None:
+            continue
+        names, table = accumulator.table(list(percentiles))
+        path = os.path.join(output, "{}-spread.txt".format(isotope))
+        write_table(path, isotope, result, column, accumulator.seen, names, table)
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=("Compute the spread of the "
+                                                  "rates across the variations "
+                                                  "of a sweep"))
+    parser.add_argument("directory", help="the TALYS-calculations directory")
+    parser.add_argument("--result", help="the result file to read",
+                        default="astrorate.g")
+    parser.add_argument("--column", help="the column of the rate, counting from 0",
+                        type=int, default=2)
+    parser.add_argument("--percentiles", help="the percentiles to give",
+                        type=float, nargs="*", default=[5, 16, 50, 84, 95])
+    parser.add_argument("-o", "--output",
+                        help="the directory to write to. Default is DIRECTORY/spread",
+                        default=None)
+    parser.add_argument("--max-rows",
+                        help="the most jobs of an isotope kept for the percentiles",
+                        type=int, default=100000, dest="max_rows")
+    args = parser.parse_args()
+    written = spread(args.directory, args.result, args.column, args.percentiles,
+                     args.output, args.max_rows)
+    print("Wrote", len(written), "tables to",
+          args.output or os.path.join(args.directory, "spread"))
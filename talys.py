@@ -42,8 +42,12 @@ input file. By using array jobs on a cluster, one can iterate through the
 enumerated files and run talys. The files "arrayscript" and "workerscript" show
 an example of this.
 
+Each TALYS process can be pinned to a dedicated core with --pin, which
+refuses to run if there are more processes or ranks than cores on a node.
+Without --pin, oversubscription only gives a warning. --numa spreads the
+pinned processes across the NUMA nodes.
+
 TODO: Add failsafe for multiprocessing. Very technically challenging
-TODO: Maybe look into os.sched_* for controlling cpu affinity
 TODO: Unit tests
 
 ###############################################################################
@@ -52,9 +56,7 @@ Imports
 """
 
 from __future__ import print_function    # Turns print into print()
-import numpy as np                       # Linspace
 import time                              # Time and date
-from itertools import product            # Nested for-loops
 import sys                               # Functions to access system functions
 import os                                # Functions to access IO of the OS
 import shutil                            # High-level file manegement
@@ -64,7 +66,30 @@ import logging                           # Logging progress from the processes
 import copy                              # For deepcopy
 import traceback                         # To log tracebacks
 import json                              # Write json to the information file
-import subprocess                        # More flexible os.system
+import runner                            # Runs a single TALYS job
+import affinity                          # Pinning TALYS to cores
+import admission                         # Adaptive number of processes
+from admission import AdmissionController
+import resource                          # Memory used by TALYS
+try:
+    import queue                         # Python 3
+except ImportError:
+    import Queue as queue                # Python 2
+from coordinator import Coordinator      # Work queue for --serve
+from control import Control              # Pausing and resizing
+from progress import Progress            # Throughput, ETA and metrics
+from sampling import Sampler             # Subsampling of the grid
+from refinement import Refiner           # Adaptive refinement of the grid
+from dedup import Deduplicator           # Running identical inputs once
+from pipeline import Pipeline            # Preparing jobs ahead of TALYS
+import energies                          # The energy grid and its chunks
+import catalog                           # The SQLite catalog of the jobs
+from catalog import Catalog
+import profiling                         # Timing of the launcher's stages
+from profiling import Profiler
+from timeline import Timeline, LAUNCHER  # Trace of every job's life
+import cProfile                          # Profiling of the launcher
+import threading                         # Reading keystrokes
 from tools import *                      # Functions are put there to remove clutter
 from readers import *                    # The input readers
 
@@ -98,6 +123,14 @@ Z_nr = {'H':  '001', 'He': '002', 'Li': '003', 'Be': '004', 'B':  '005',
         'Rg': '111', 'Cn': '112', 'Uut': '113', 'Fl': '114', 'Uup': '115',
         'Lv': '116', 'Uus': '117', 'Uuo': '118'}
 
+# The directories of the jobs, from the top: one for each element, one for
+# each isotope and one for each job, named by run_rest
+STRUCTURE = [
+    {"element": "{Z_nr[element]}{element}"},
+    {"mass": "{mass}{element}"},
+    {"rest": ""},
+]
+
 """
 ###############################################################################
 Functions
@@ -105,6 +138,52 @@ Functions
 """
 
 
+def job_name(keywords):
+    """ The name of a job as used in the log, e.g. 160Dy-1-2
+
+    Parameters: keywords: a dict with the mass, element and name of the job
+    Returns:    The name
+    """
+    if keywords["name"]:
+        return "{mass}{element}-{name}".format(**keywords)
+    return "{mass}{element}".format(**keywords)
+
+
+def isotope_directory(top, element, mass):
+    """ The directory of an isotope below top, as made by run_deeper
+
+    Parameters: top: original_data or results_data of the run directory
+                element, mass: the isotope
+    Returns:    The path
+    """
+    fmt = StyleFormatter()
+    keywords = {"Z_nr": Z_nr, "element": element, "mass": mass}
+    return os.path.join(top, *[fmt.format(style, **keywords)
+                               for level in STRUCTURE
+                               for name, style in level.items()
+                               if name != "rest"])
+
+
+def run_in_child(func, *args, **kwargs):
+    """ The target of the children started by support_multiprocessing
+
+    Parameters: func: the decorated function
+                args, kwargs: the arguments to func. args[0] is the Manager
+    Returns:    None
+    Algorithm:  Mark the Manager as a child and call the function. When it
+                returns, send the timings of --profile and put the PID on
+                the queue, to let the next child begin
+    """
+    manager = args[0]
+    manager.is_child = True
+    try:
+        func(*args, **kwargs)
+    finally:
+        manager.profiler.flush()
+        manager.logger.debug("%s is terminating", os.getpid())
+        manager.queue.put(os.getpid())
+
+
 def support_multiprocessing(check_list=False):
     """ A decorator running functions with multiprocessing
 
@@ -115,8 +194,10 @@ def support_multiprocessing(check_list=False):
                 the function will be called as normal;
     Returns:    Next level decorator.
     Algorithm:  Create a standard decorator and return it
-    Note:       The target function must put the terminating child's PID
-                on self.queue.
+    Note:       A child started by the decorator runs the functions it calls
+                itself, as it already holds one of the --processes slots.
+                Otherwise, the children of --multi would wait forever for
+                slots held by their siblings
     """
     def decorator(func):
         def inner(*args, **kwargs):
@@ -143,44 +224,30 @@ def support_multiprocessing(check_list=False):
                     do_run = False
             else:
                 do_run = True
-            if args[0].use_multiprocessing and do_run:
+            if args[0].is_child:
+                func(*args, **kwargs)
+            elif args[0].use_multiprocessing and do_run:
                 # Only pause if the limit set by --processes is reached
-                if args[0].running_children.value >= args[0].args.processes:
-                    try:
-                        args[0].logger.debug("Waiting for available process")
-                    except:
-                        pass
-                    pid = args[0].queue.get()
-                    # Wait a second to let the process be terminated
-                    time.sleep(1)
-                    for process in args[0].mps_list:
-                        if process == pid:
-                            # If it did not terminate, wait till it does
-                            #process.join()
-                            try:
-                                args[0].logger.debug("Removing %s from list", pid)
-                            except:
-                                pass
-                            # Finally, remove it
-                            args[0].mps_list.remove(process)
-                            args[0].running_children.value -= 1
-                            break
-                    if args[0].running_children.value >= args[0].args.processes:
-                        try:
-                            args[0].logger.exception("PID not in list")
-                        except:
-                            pass
-                        finally:
-                            raise RuntimeError("PID not in list")
+                waited = time.time()
+                with args[0].profiler.stage("wait"):
+                    args[0].wait_for_process()
+                args[0].trace_dispatch(waited, kwargs)
                 args[0].running_children.value += 1
                 job = multiprocessing.Process(
-                    target=func,
-                    args=args, kwargs=kwargs)
+                    target=run_in_child,
+                    args=(func,) + args, kwargs=kwargs)
                 # Keep a reference to shut them down
                 # Start it
-                job.start()
+                with args[0].profiler.stage("fork"):
+                    job.start()
                 args[0].mps_list.append(job.pid)
             else:
+                # Only to pause if paused or the disk is full
+                waited = time.time()
+                with args[0].profiler.stage("wait"):
+                    args[0].wait_for_process()
+                if not check_list:
+                    args[0].trace_dispatch(waited, kwargs)
                 func(*args, **kwargs)
     
         return inner
@@ -207,45 +274,122 @@ class Manager:
         """
         self.reader = options  # Arguments read from file
         self.args = args       # Arguments read from terminal
+        # The validated input. Compiled once, and used for every job
+        try:
+            self.config = options.compile()
+        except ValueError as exc:
+            self.exit("Invalid input file: {}".format(exc))
 
         # Check the size given by MPI.COMM to determine if the
         # script is being run by MPI
         self.use_MPI = size > 1
+        # With MPI, -p is the number of TALYS processes of each rank, as
+        # given by affinity.rank_processes
+        self.rank_processes = args.processes if self.use_MPI else None
         # Set a multiprocessing flag if running several processes
         if args.processes == 0:
             try:
-                self.args.processes = multiprocessing.cpu_count()
+                # Only the cores allocated to us
+                self.args.processes = len(affinity.available_cpus())
             except NotImplementedError:
-                sys.exit("Could not find cpu count. Specify -p N")
+                self.exit("Could not find cpu count. Specify -p N")
 
         if args.processes is not None:
             self.use_multiprocessing = True
         else:
             self.use_multiprocessing = False
 
-        # Multiprocessing and MPI may not be used in conjunction
+        # The ranks run their processes themselves, so rank 0 does not fork
         if self.use_MPI and self.use_multiprocessing:
-            print("Multiprocessing can not be used with MPI")
-            comm.Abort()
+            self.use_multiprocessing = False
+        # With --serve, the workers run TALYS, not this process
+        self.use_coordinator = args.serve is not None
+        if self.use_coordinator and (self.use_MPI or self.use_multiprocessing):
+            self.exit("--serve can not be used with MPI or multiprocessing")
         # The number of MPI nodes
         self.mpisize = size
-        # Counter to store the total number of TALYS-executions
-        self.counter_max = 0
+        # Which combinations of the keywords to run
+        try:
+            self.sampler = Sampler(self.config.blocks.get("sampling"))
+        except ValueError as exc:
+            self.exit("Invalid sampling block: {}".format(exc))
+        # Refines the grid where the rates change the most
+        self.refiner = None
+        if "refine" in self.config.blocks:
+            try:
+                self.refiner = Refiner(self.config.blocks["refine"],
+                                       self.config.varying,
+                                       self.config.result_files)
+            except ValueError as exc:
+                self.exit("Invalid refine block: {}".format(exc))
+        # The number of TALYS runs each job's energies are split into
+        self.energy_chunks = max(1, args.energy_chunks or 1)
+        if self.energy_chunks > 1:
+            if args.dummy:
+                self.exit("--energy-chunks can not be used with --dummy, as the "
+                         "chunks must be merged")
+            if not any(astro in self.config["astro"] for astro in ("n", "no")):
+                self.exit("--energy-chunks needs astro n, since TALYS only "
+                         "reads the energy file then")
+            self.energy_chunks = min(self.energy_chunks,
+                                     int(float(self.config["N"])))
+        # The total number of TALYS-executions
+        self.counter_max = self.count()*self.energy_chunks
         # Keeps the queues for multiprocessing
         self.queue = multiprocessing.Queue()
         # Counter showing how many child processing are running around
         self.running_children = multiprocessing.Value('i', 0)
+        # Shared lists between the processes
+        self.sync = multiprocessing.Manager()
         # List containing references to all running children
-        self.mps_list = multiprocessing.Manager().list()
+        self.mps_list = self.sync.list()
+        # The execution times, to predict the time limit of a job
+        self.durations = self.sync.list()
+        # The jobs killed for exceeding their time limit
+        self.timed_out = self.sync.list()
+        # The jobs sent to the MPI ranks, and when, by their number
+        self.sent_jobs = {}
+        # The number of the next job sent to a rank
+        self.job_index = 0
+        # The PIDs of the running TALYS processes
+        self.talys_pids = self.sync.list()
+        # Starts TALYS. The binary is looked up in PATH once, here
+        self.spawner = runner.make_spawner(args.spawn)
+        # Times the stages of the launcher with --profile
+        self.profiler = Profiler(args.profile,
+                                 self.sync.list() if args.profile else None)
+        # The life of every job, written with --trace
+        self.timeline = Timeline(args.trace,
+                                 self.sync.list() if args.trace else None)
+        if self.refiner is not None:
+            # The jobs may be planned in the children with --multi
+            self.refiner.jobs = self.sync.list()
+        # The jobs split into chunks, to merge when the chunks are done
+        self.merges = self.sync.list()
+        # Finds the jobs with the same input as an earlier job. Not with
+        # --dummy, as the results are not there to link
+        self.dedup = None
+        if not args.no_dedup and not args.dummy:
+            self.dedup = Deduplicator(self.sync.dict(), self.sync.list())
+        # Prepares the next jobs while TALYS runs. Only without -p, which
+        # forks the children, and without --serve, which queues every job
+        self.pipeline = None
+        if (args.lookahead > 0 and not self.use_multiprocessing
+                and not self.use_coordinator and not args.dummy):
+            self.pipeline = Pipeline(args.lookahead)
         # Names for where multiprocessing will be run
         self.multi_list = args.multi
+        # Set in the children started by support_multiprocessing
+        self.is_child = False
         # Shared memory resource for keeping track of how many
         # TALYS-executions has been done
         self.counter = multiprocessing.Value('i', 0)
-        # Keeps track of the number of running MPI ranks
-        self.used_ranks = 1
-        # The current MPI rank to send to
-        self.send_to_rank = 1
+        # The jobs waiting to be sent to the MPI ranks in one message
+        self.batch = []
+        # The number of TALYS processes of each MPI rank
+        self.rank_slots = {}
+        # The number of jobs each MPI rank has not reported back yet
+        self.rank_jobs = {}
 
         if self.args.dummy:
             self.indices_directory = "indices"
@@ -256,18 +400,79 @@ class Manager:
         self.root_directory = 'TALYS-calculations-{}-{}'.format(
             time.strftime('%y%m%d'), time.strftime('%H%M%S'))
         mkdir(self.root_directory)
+        # Every job, its keywords, status, timings and results
+        self.catalog = Catalog(self.root_directory, self.sync.list())
+        # The keywords varied by the sweep, including the dependents
+        self.swept = set(self.config.varying) | set(self.config.conditions)
 
         # Initialize and start the logging
         self.init_logger()
 
+        # Queue of the cores free for TALYS, if pinning
+        self.cores = None
+        # The largest number of processes --processes can be resized to
+        self.max_processes = None
+        if not self.use_MPI:
+            self.init_affinity()
+
+        # Pausing and resizing while running
+        self.control = Control(self.args.processes or 1, self.logger,
+                               self.talys_pids, self.max_processes)
+        self.control.install_signals()
+        self.control.listen(os.path.join(self.root_directory, "control"))
+        self.logger.info("Pause with kill -USR1 %s and resume with kill -USR2 %s",
+                         os.getpid(), os.getpid())
+
+        # Throughput, ETA and utilisation, written to status.json
+        self.progress = Progress(self.root_directory, self.counter_max,
+                                 interval=self.args.status_interval,
+                                 metrics_file=self.args.metrics,
+                                 events=self.sync.list())
+        if not self.use_MPI and not self.use_coordinator and self.cores is None:
+            self.progress.set_slots("local", self.args.processes or 1)
+
+        # Adapts the number of processes to the free resources
+        self.admission = None
+        # The largest memory used by a TALYS process, in kB
+        self.job_memory = multiprocessing.Value('d', 0)
+        if self.args.adaptive and not (self.use_MPI or self.use_coordinator):
+            self.admission = AdmissionController(
+                self.args.processes or 1, self.root_directory, self.logger,
+                min_memory=self.args.min_memory*admission.MB,
+                min_disk=self.args.min_disk*admission.MB)
+
         # sys.excepthook is what deals with an unhandled exception
         if not self.args.default_excepthook:
             sys.excepthook = self.excepthook
 
         # send the input options to the mpichildren
         for n in range(1, self.mpisize):
-            self.logger.debug("Sending reader to %s", n)
-            comm.send(self.reader, dest=n, tag=1)
+            self.logger.debug("Sending configuration to %s", n)
+            comm.send((self.config, {"pin": self.args.pin,
+                                     "numa": self.args.numa,
+                                     "timeout": self.args.timeout,
+                                     "timeout_factor": self.args.timeout_factor,
+                                     "retries": self.args.retries,
+                                     "collect": self.args.collect,
+                                     "spawn": self.args.spawn,
+                                     "root_directory": self.root_directory,
+                                     "energy_chunks": self.energy_chunks,
+                                     "processes": self.rank_processes}),
+                      dest=n, tag=1)
+        if self.use_MPI:
+            # Collective. Every rank checks its placement
+            _, local_size, local_cpus = affinity.mpi_local_placement(
+                comm, MPI, self.args.numa)
+            if local_size > local_cpus:
+                self.logger.warning("%s ranks share %s cores on the node of "
+                                    "rank 0", local_size, local_cpus)
+            # Every rank tells how many TALYS processes it runs
+            for n in range(1, self.mpisize):
+                self.rank_slots[n] = comm.recv(source=n, tag=2)
+                self.rank_jobs[n] = 0
+                self.progress.set_slots("rank{}".format(n), self.rank_slots[n])
+            self.logger.info("%s TALYS runs at a time on %s MPI ranks",
+                             sum(self.rank_slots.values()), self.mpisize - 1)
 
         self.get_checkpoint()
 
@@ -278,33 +483,110 @@ class Manager:
     def __exit__(self, exc_type, exc_value, traceback):
         """ Shut down the children when exiting """
         for rank in range(1, self.mpisize):
-            self.logger.debug("Sending stop to", rank)
-            comm.send(("stop",)*5, dest=rank)
+            self.logger.debug("Sending stop to %s", rank)
+            comm.send(None, dest=rank)
 
-    def count(self, values):
+    def count(self):
         """ Find the total number of TALYS runs
 
-        Parameters: values: a list over the keywords
+        Parameters: None
+        Returns:    The number of TALYS runs
+        Algorithm:  Every isotope runs the combinations of the varying
+                    keywords and the dependents chosen by the sampler, by
+                    default all of them. Count the masses of every element,
+                    not only those of the first isotope
+        """
+        sizes = [len(self.config.keywords[key]) for key in self.config.varying
+                 if key in self.config.keywords]
+        sizes.extend(len(dependents) for dependents in self.config.dependents)
+        return sum(self.sampler.count(sizes, (element, mass))
+                   for element in self.config.elements
+                   for mass in self.config.mass[element])
+
+    def init_affinity(self):
+        """ Set up the pinning of the TALYS processes to cores
+
+        Parameters: None
         Returns:    None
-        Algorithm:  Iterates through the elements, masses and product, each
-                    time increasing the self.counter_max
+        Algorithm:  Compare the number of processes with the cores given
+                    to us by sched_getaffinity. Refuse to run if pinning is
+                    asked for and there are too few cores, else warn. If
+                    pinning, put one core per process in a queue. Each TALYS
+                    run takes a core and puts it back when done
+        """
+        cpus = affinity.placement_order(affinity.available_cpus(),
+                                        self.args.numa)
+        processes = self.args.processes if self.use_multiprocessing else 1
+        if processes > len(cpus):
+            msg = "{} TALYS at once on {} available cores".format(processes, len(cpus))
+            if self.args.pin:
+                self.logger.critical("Can not pin %s", msg)
+                sys.exit("Use fewer processes or do not use --pin")
+            self.logger.warning("Oversubscribing: %s", msg)
+        if self.args.pin:
+            # Every core is put in the queue, so the number of processes
+            # can be raised while running
+            self.cores = multiprocessing.Queue()
+            for cpu in cpus:
+                self.cores.put(cpu)
+            self.max_processes = len(cpus)
+            self.logger.info("Pinning TALYS to the cores %s",
+                             ",".join(str(cpu) for cpu in cpus))
+
+    def exit(self, message):
+        """ Exit with an error message before the MPI ranks are started
+
+        Algorithm:  The other ranks wait for the configuration from rank 0,
+                    so with MPI every rank is aborted, as they would
+                    otherwise wait forever
         """
-        elements = self.reader["element"]
-        masses = self.reader["mass"]
-        for e in elements:
-            for m in masses[e]:
-                for p in product(*values):
-                    self.counter_max += 1
+        if size > 1:
+            print(message)
+            sys.stdout.flush()
+            comm.Abort()
+        sys.exit(message)
 
-    def make_checkpoint(self, msg):
-        """ Overwrite the checkpoint file with a new checkpoint
+    def wait_for_process(self):
+        """ Wait until another TALYS process may be started
 
         Parameters: None
         Returns:    None
-        Algorithm:  Open checkpointfile and write {Element} {Mass}
+        Algorithm:  The limit is --processes, as changed by the control, or
+                    the number decided by the admission controller if
+                    --adaptive is set. It is 0 while paused. While the
+                    limit is reached, wait at the queue for the PID of a
+                    finished child and remove it from the list over running
+                    children. Check the limit again every second, so a
+                    resume or a larger limit is noticed quickly
         """
-        with open(os.path.join(self.root_directory, "checkpoint"), "w") as chkfile:
-            chkfile.write(msg)
+        while True:
+            running = self.running_children.value
+            if self.control.paused.value:
+                limit = 0
+            elif self.admission is not None:
+                self.admission.maximum = self.control.processes.value
+                limit = self.admission.update(running,
+                                              self.job_memory.value*1024)
+            else:
+                limit = self.control.processes.value
+            if running < limit:
+                return
+            if running == 0:
+                time.sleep(1)
+                continue
+            self.logger.debug("Waiting for available process")
+            try:
+                pid = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # Wait a second to let the process be terminated
+            time.sleep(1)
+            if pid in self.mps_list:
+                self.logger.debug("Removing %s from list", pid)
+                self.mps_list.remove(pid)
+                self.running_children.value -= 1
+            else:
+                self.logger.error("PID %s not in list", pid)
 
     def get_checkpoint(self):
         """ Get the checkpoint of a previous run
@@ -312,13 +594,26 @@ class Manager:
         Parameters: None
         Returns:    None
         Algorithm:  Check if --resume is set. If it is, find previous
-                    TALYS-folders and use the checkpoint in the penultimate
-                    (the ultimate is created by this process)
+                    TALYS-folders and use the penultimate (the ultimate is
+                    created by this process). The jobs done there are read
+                    from its catalog and skipped. Folders from before the
+                    catalog have a checkpoint with the isotope planned last,
+                    and the isotopes before it are skipped
         """
+        self.resume_jobs = {}
         if self.args.resume:
-            folders = [os.path.abspath(name) for name in os.listdir(".") if
-                       os.path.isdir(name) and "TALYS" in name]
+            folders = sorted(os.path.abspath(name) for name in os.listdir(".") if
+                             os.path.isdir(name) and "TALYS" in name)
             if len(folders) > 1:
+                path = os.path.join(folders[-2], catalog.FILENAME)
+                if os.path.exists(path):
+                    self.resume_jobs = catalog.completed_jobs(path)
+                    self.catalog.set_info("resumed_from", folders[-2])
+                    self.logger.info("Resuming %s, where %s jobs are done",
+                                     folders[-2], len(self.resume_jobs))
+                    # Not by isotope
+                    self.args.resume = False
+                    return
                 names = [name for name in os.listdir(folders[-2])]
                 if "checkpoint" in names:
                     with open(os.path.join(folders[-2], "checkpoint"), "r") as checkpointfile:
@@ -457,23 +752,28 @@ class Manager:
 
         # Write energy information
         outfile.write('\n\n{:<{}s} {}'.format(
-            "name of energy file:", padding_size, self.reader['energy'][0]))
+            "name of energy file:", padding_size, self.config['energy'][0]))
         outfile.write('\n{:<{}s} {}'.format(
-            "energy min:", padding_size, self.reader['energy_start']))
+            "energy min:", padding_size, self.config['energy_start']))
         outfile.write('\n{:<{}s} {}'.format(
-            "energy max:", padding_size, self.reader['energy_stop']))
+            "energy max:", padding_size, self.config['energy_stop']))
         outfile.write('\n{:<{}s} {}'.format(
-            "number of energies:", padding_size, self.reader['N']))
+            "number of energies:", padding_size, self.config['N']))
 
         outfile.write('\n\n{:<{}s} {}'.format(
-            "name of self.reader file:", padding_size, self.reader['input_file']))
+            "name of self.reader file:", padding_size, self.config['input_file']))
         outfile.write('\n{:<{}s} {}'.format(
-            "name of output file:", padding_size, self.reader['output_file']))
+            "name of output file:", padding_size, self.config['output_file']))
+        outfile.write('\n{:<{}s} {}'.format(
+            "sampling:", padding_size, self.sampler.describe()))
+        if self.refiner is not None:
+            outfile.write('\n{:<{}s} {}'.format(
+                "refine:", padding_size, self.refiner.describe()))
         outfile.write('\n\nVariable self.reader:')
 
         # Write the rest of the keywords
-        for value, key in self.reader.keywords.items():
-            if len(key) == 1:
+        for value, key in self.config.keywords.items():
+            if isinstance(key, (list)) and len(key) == 1:
                 key = key[0]
             elif isinstance(key, (list)):
                 key = json.dumps(key, sort_keys=True)
@@ -484,36 +784,33 @@ class Manager:
                 value + ':',  padding_size, key))
 
 
-        if "n" in self.reader["astro"] or "no" in self.reader["astro"]:
+        if "n" in self.config["astro"] or "no" in self.config["astro"]:
             self.astro_yes = False
             # Create energy self.reader
             outfile.write('\n\nEnergies: \n')
-            energies = np.linspace(float(self.reader['energy_start']),
-                                   float(self.reader['energy_stop']),
-                                   float(self.reader['N']))
-            # Outfile named energy_file
-            outfile_energy = open(os.path.join(self.root_directory, self.reader['energy'][0]), 'w')
+            grid = energies.make_energies(self.config['energy_start'],
+                                          self.config['energy_stop'],
+                                          self.config['N'])
             # Write energies to energy_file and file in one column
-            for Ei in energies:
-                # Write energies to file in column
-                outfile_energy.write('%.2E \n' % Ei)
-                # Write energies to  file in one column
+            energies.write_energies(os.path.join(self.root_directory,
+                                                 self.config['energy'][0]), grid)
+            for Ei in grid:
                 outfile.write('%.2E \n' % Ei)
-            outfile_energy.close()
         else:
             self.astro_yes = True    
 
         outfile.close()
 
-    def make_input_file(self, keywords):
-        """ Creates the inputfile for TALYS
+    def render_input(self, keywords):
+        """ The content of the input file for TALYS
 
         Parameters: keywords: the input options
-        Returns:    None
+        Returns:    The content as a string
         Alogrithm:  Write a few lines of comment to explain the reaction and
                     write all of the TALYS keywords given in the input
         """
-        keywords = copy.deepcopy(keywords)
+        # The values are not changed, so a shallow copy is enough
+        keywords = dict(keywords)
 
         # Pop out the keywords that shouldn't be written twice
         projectile = keywords.pop('projectile')
@@ -521,40 +818,51 @@ class Manager:
         element = keywords.pop("element")
         energy = keywords.pop('energy')
 
-        # Open the file and begin writing
-        outfile_input = open(os.path.join(
-            self.rest_directory,
-            self.reader["input_file"]), 'w')
+        lines = []
         # This shows the reaction taking place, e.g 159Eu(n,g)160Eu
         reaction_line = '{}{}({},g){}{}'.format(mass, element, projectile,
                                                 int(mass)+1, element)
-        outfile_input.write('########################## \n')
-        outfile_input.write('##   TALYS input file   ## \n')
-        outfile_input.write('##{:^{}}## \n'.format(reaction_line, 22))
-        outfile_input.write('########################## \n \n')
-        outfile_input.write('# All keywords are explained in README. \n \n')
-
-        outfile_input.write('element {} \n'.format(element))
-        outfile_input.write('projectile {} \n'.format(projectile))
-        outfile_input.write('mass {} \n'.format(mass))
+        lines.append('########################## \n')
+        lines.append('##   TALYS input file   ## \n')
+        lines.append('##{:^{}}## \n'.format(reaction_line, 22))
+        lines.append('########################## \n \n')
+        lines.append('# All keywords are explained in README. \n \n')
+
+        lines.append('element {} \n'.format(element))
+        lines.append('projectile {} \n'.format(projectile))
+        lines.append('mass {} \n'.format(mass))
         if not self.astro_yes:
-            outfile_input.write('energy {} \n \n'.format(energy))
+            lines.append('energy {} \n \n'.format(energy))
         else:
-            outfile_input.write('energy 1\n')
+            lines.append('energy 1\n')
 
         # Write the keyword and corresponding value
         for key, value in keywords.items():
-            outfile_input.write('{} {} \n'.format(key, str(value)))
+            lines.append('{} {} \n'.format(key, str(value)))
+        return ''.join(lines)
+
+    def make_input_file(self, keywords):
+        """ Creates the inputfile for TALYS in self.rest_directory
 
-        # Bad things happen if the file isn't closed
-        outfile_input.close()
+        Parameters: keywords: the input options
+        Returns:    None
+        Alogrithm:  Write the input given by render_input, and copy the
+                    energy file unless astro is y
+        """
+        started = profiling.timer()
+        text = self.render_input(keywords)
+        with open(os.path.join(self.rest_directory,
+                               self.config.input_file), 'w') as outfile_input:
+            outfile_input.write(text)
+        self.profiler.add("input", profiling.timer() - started)
 
         if not self.astro_yes:
             # Copy energy file  to isotope directory
             src_energy_new = os.path.join(
-                self.root_directory, energy)
+                self.root_directory, keywords['energy'])
             dst_energy_input = self.rest_directory
-            shutil.copy(src_energy_new, dst_energy_input)
+            with self.profiler.stage("energy"):
+                shutil.copy(src_energy_new, dst_energy_input)
 
     def load_custom_keywords(self, talys_keywords, keywords):
         """ Load the custom blocks from input file
@@ -571,9 +879,10 @@ class Manager:
 
         # Add a criteria for when the custom block will be used
         # Here, check if the block has any keywords
-        if hasattr(self.reader, "scissors"):
+        if "scissors" in self.config.blocks:
             # The epr, gpr and spr are mass and element dependent
-            for key, value in self.reader.scissors[keywords["element"]][str(keywords["mass"])].items():
+            scissors = self.config.blocks["scissors"]
+            for key, value in scissors[keywords["element"]][str(keywords["mass"])].items():
                 # Add the keywords
                 talys_keywords[key] = "{} {} {} M1".format(int(Z_nr[keywords["element"]]),
                                                            int(keywords["mass"])+1,
@@ -585,29 +894,36 @@ class Manager:
 
         Parameters: None
         Returns:    None
-        Algortihm:  If --enable_pausing is not enabled, just call self._run()
-                    Otherwise, start self._run() as a subprocess and wait for
-                    keystrokes
+        Algortihm:  If --enable_pausing is enabled, read keystrokes in a
+                    thread and pause or resume on "p". Then call self._run()
         """
 
         if self.args.enable_pausing:
-            self.pausing_queue = multiprocessing.Queue()
-            self.do_pause = multiprocessing.Value('i', 0)
-            running_manager = multiprocessing.Process(target=self._run)
-            running_manager.start()
-            print("manager is running")
-            while True:
-                if getkey() == "p":
-                    if self.do_pause.value == 0:
-                        self.logger.info("PAUSING")
-                        self.do_pause.value = 1
-                    else:
-                        self.logger.info("STARTING")
-                        self.do_pause.value = 0
-                        self.pausing_queue.empty()
-                        self.pausing_queue.put_nowait("pause")
-        else:
-            self._run()
+            def read_keys():
+                while True:
+                    if getkey() in ("p", b"p"):
+                        if self.control.paused.value:
+                            self.control.resume()
+                        else:
+                            self.control.pause()
+            keys = threading.Thread(target=read_keys)
+            keys.daemon = True
+            keys.start()
+            print("Press p to pause and resume")
+        try:
+            if self.args.cprofile:
+                # Only this process. The children are timed by --profile
+                profile = cProfile.Profile()
+                try:
+                    profile.runcall(self._run)
+                finally:
+                    profile.dump_stats(self.args.cprofile)
+                    self.logger.info("Wrote the profile to %s",
+                                     self.args.cprofile)
+            else:
+                self._run()
+        finally:
+            self.control.close()
             
 
     def _run(self):
@@ -621,8 +937,17 @@ class Manager:
                     appropriatley
         """
         start = time.time()
+        self.progress.start()
+        self.catalog.start()
+        self.catalog.set_info("input_file", os.path.abspath(self.args.input_filename))
+        self.catalog.set_info("command", " ".join(sys.argv))
+        self.catalog.set_info("started", start)
+        # The axes of the sweep, for the result cube
+        self.catalog.set_info("varying", json.dumps(list(self.config.varying)))
+        self.catalog.set_info("dependents", json.dumps(
+            [list(group) for group in self.config.dependents]))
         # Do a deepcopy to prevent multiprocessing mixing
-        keywords = copy.deepcopy(self.reader.keywords)
+        keywords = copy.deepcopy(self.config.keywords)
 
         # Make the info file.
         self.make_info_file()
@@ -643,18 +968,168 @@ class Manager:
         self.result_directory = self.top_result_directory
 
         keywords["Z_nr"] = Z_nr
-        structure = [
-        {"element": "{Z_nr[element]}{element}"},
-            {"mass": "{mass}{element}"},
-            {"rest": ""},
-        ]
+        structure = copy.deepcopy(STRUCTURE)
+        # Serve the jobs to the workers as soon as they are planned
+        if self.use_coordinator:
+            self.coordinator = Coordinator(self.args.serve, self.logger,
+                                           self.config, collect=self.args.collect,
+                                           timeout=self.args.timeout,
+                                           timeout_factor=self.args.timeout_factor,
+                                           retries=self.args.retries)
+            self.coordinator.on_complete = self.log_completion
+            self.coordinator.on_lease = self.log_lease
+            self.coordinator.is_paused = lambda: self.control.paused.value
+            self.coordinator.start()
+
         # Run the rest
-        self.run_deeper(keywords, structure)
+        self.plan(keywords, structure)
+        self.refine(keywords, structure)
+
+        if self.use_coordinator:
+            self.coordinator.finish_planning()
+            self.logger.info("All %s jobs are planned. Waiting for the workers",
+                             self.coordinator.planned)
+            self.coordinator.wait()
+            self.coordinator.stop()
+
+        # Wait for the last jobs to finish
+        self.wait_for_jobs()
+        self.report_timeouts()
+        self.catalog.set_info("finished", time.time())
+        self.catalog.stop()
+        if self.dedup is not None and self.dedup.saved:
+            self.logger.info("%s jobs had the same input as another and were "
+                             "not run. See duplicates.txt", self.dedup.saved)
+        status = self.progress.stop()
+        self.logger.info("%s jobs completed, %s with errors, %s jobs per minute",
+                         status["completed"], status["failed"],
+                         status["jobs_per_minute"])
+        if self.args.profile:
+            report = self.profiler.report(status["completed"], time.time() - start)
+            self.logger.info("Time spent in each stage:\n%s", report)
+            with open(os.path.join(self.root_directory, "profile.txt"), "w") as outfile:
+                outfile.write(report + "\n")
+        if self.args.trace:
+            self.timeline.write()
+            self.logger.info("Wrote the trace to %s", self.args.trace)
 
         # When the script has completed, log the total time
         elapsed = time.strftime("%H:%M:%S", time.localtime(time.time() - start))
         self.logger.info("Total elapsed time: %s", elapsed)
 
+    def wait_for_jobs(self):
+        """ Wait until every job sent off so far has finished
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  Receive from the MPI ranks until all are idle, wait
+                    for the coordinator's queue to empty, and take the PID
+                    of every child from the queue. A child which died
+                    without giving its PID is removed once it is gone
+        """
+        if self.use_MPI:
+            self.send_batches(flush=True)
+            while any(self.rank_jobs.values()):
+                self.receive_from_rank()
+        if self.use_coordinator:
+            self.coordinator.drain()
+        while self.running_children.value > 0:
+            try:
+                pid = self.queue.get(timeout=1)
+            except queue.Empty:
+                alive = [child.pid for child in multiprocessing.active_children()]
+                pids = [pid for pid in self.mps_list if pid not in alive]
+            else:
+                pids = [pid]
+                for child in multiprocessing.active_children():
+                    if child.pid == pid:
+                        child.join()
+            for pid in pids:
+                if pid in self.mps_list:
+                    self.mps_list.remove(pid)
+                    self.running_children.value -= 1
+        self.merge_chunks()
+        # The results of the duplicates' first jobs are there now
+        if self.dedup is not None:
+            errors = self.dedup.link_results(
+                self.config.result_files,
+                os.path.join(self.root_directory, "duplicates.txt"))
+            for error in errors:
+                self.logger.error(error)
+
+    def merge_chunks(self):
+        """ Merge the results of the chunks of the jobs split by energy
+
+        Parameters: None
+        Returns:    None
+        Algorithm:  For each result file, merge the chunks' tables into the
+                    job's and remove them. Only the jobs present when
+                    starting are merged, so call it when their chunks are
+                    done
+        """
+        count = len(self.merges)
+        merges = self.merges[:count]
+        del self.merges[:count]
+        for result_directory, name, chunks, label in merges:
+            for filename in self.config.result_files:
+                sources = [runner.result_path(result_directory, chunk, filename)
+                           for chunk in chunks]
+                merged = energies.merge_tables(
+                    sources, runner.result_path(result_directory, name, filename))
+                if merged < len(chunks):
+                    self.logger.error("%s: %s of %s chunks of %s are missing",
+                                      label, len(chunks) - merged, len(chunks),
+                                      filename)
+                for source in sources:
+                    if os.path.exists(source):
+                        os.remove(source)
+
+    def refinement_round(self):
+        """ The round of the refinement being planned, 0 for the first """
+        return self.refiner.rounds if self.refiner is not None else 0
+
+    def refine(self, keywords, structure):
+        """ Run the rounds of the adaptive refinement, if any
+
+        Parameters: keywords: the input keywords, as given to run_deeper
+                    structure: the directory structure, as given to
+                               run_deeper
+        Returns:    None
+        Algorithm:  Wait for the jobs of the previous round and let the
+                    refiner pick the new values from their results. Run
+                    them through run_deeper with the round in place of the
+                    sampler and only the new values of the keyword. Stop
+                    when the refiner has no more values
+        """
+        if self.refiner is None:
+            return
+        if self.args.dummy:
+            self.logger.warning("The grid is not refined with --dummy, "
+                                "since TALYS is not run")
+            return
+        sampler = self.sampler
+        while True:
+            self.wait_for_jobs()
+            refinement = self.refiner.next_round()
+            if refinement is None:
+                break
+            self.logger.info("Refinement round %s: %s jobs with %s = %s",
+                             refinement.number, refinement.total,
+                             self.refiner.keyword,
+                             " ".join(str(v) for v in refinement.values))
+            self.counter_max += refinement.total*self.energy_chunks
+            self.progress.total = self.counter_max
+            self.sampler = refinement
+            keywords = dict(keywords)
+            keywords[self.refiner.keyword] = refinement.values
+            # run_deeper leaves them at the last isotope's directories
+            self.work_directory = self.top_original_directory
+            self.result_directory = self.top_result_directory
+            self.plan(keywords, structure)
+        self.sampler = sampler
+        self.logger.info("Refinement of %s done after %s rounds",
+                         self.refiner.keyword, self.refiner.rounds)
+
     def run_deeper(self, keywords, structure):
         """ A recursive function that creates the directory structure
 
@@ -668,8 +1143,9 @@ class Manager:
                     "rest" else create directories and call itself
         """
         # Deepcopy the mutable variables to prevent processing mixup
-        structure = copy.deepcopy(structure)
-        keywords = copy.deepcopy(keywords)
+        with self.profiler.stage("deepcopy"):
+            structure = copy.deepcopy(structure)
+            keywords = copy.deepcopy(keywords)
 
         # Iterate through the list consiting of [{name:style}, {name:style} ...]
         for name, style in structure[0].items():
@@ -685,7 +1161,8 @@ class Manager:
                 # If not, create the directories and go to the next level
                 # tmp_keywords is used if the keyword is a dict in order to
                 # store the resulting list
-                tmp_keywords = copy.deepcopy(keywords)
+                with self.profiler.stage("deepcopy"):
+                    tmp_keywords = copy.deepcopy(keywords)
                 if isinstance(keywords[name], (dict)):
                     # ex. keywords["prev_keyword"] = "Pr"
                     #     keywords["mass"] = {"Pr":[128, 129], "Sm":[158, 159, 160]}
@@ -694,7 +1171,8 @@ class Manager:
 
                 # new_keywords is to overwrite the keywords[name] without
                 # interfeering with the next iteration of the loop
-                new_keywords = copy.deepcopy(tmp_keywords)
+                with self.profiler.stage("deepcopy"):
+                    new_keywords = copy.deepcopy(tmp_keywords)
                 current_orig = self.work_directory
                 current_res = self.result_directory
                 for keyword in tmp_keywords[name]:
@@ -715,23 +1193,21 @@ class Manager:
                                     current_orig, current_res, name,
                                     style, structure):
         """ Split from run_deeper to support multiprocessing """
-        fmt = StyleFormatter()
-        # Create the directories with names according to the style
-        self.work_directory = os.path.join(
-            current_orig, fmt.format(style, **keywords))
-        self.result_directory = os.path.join(
-            current_res, fmt.format(style, **keywords))
-        mkdir(self.work_directory)
-        mkdir(self.result_directory)
+        with self.profiler.stage("format"):
+            fmt = StyleFormatter()
+            # Create the directories with names according to the style
+            self.work_directory = os.path.join(
+                current_orig, fmt.format(style, **keywords))
+            self.result_directory = os.path.join(
+                current_res, fmt.format(style, **keywords))
+        with self.profiler.stage("mkdir"):
+            mkdir(self.work_directory)
+            mkdir(self.result_directory)
         # This is an ugly piece of code. Since the "mass" keyword
         # is dependent on the current element, the current element
         # must be stored for this function to work
         keywords["prev_keyword"] = keyword
         self.run_deeper(keywords, structure)
-        if self.use_multiprocessing and False:
-            self.logger.debug("%s is terminating",
-                              multiprocessing.current_process().pid)
-            self.queue.put(multiprocessing.current_process().pid)
 
     def run_rest(self, keywords):
         """ Creates the name of the final directory and calls self.run_talys()
@@ -752,12 +1228,126 @@ class Manager:
                 return
 
         # deepcopy the mutable variables to prevent processing mixup
-        keywords = copy.deepcopy(keywords)
+        with self.profiler.stage("deepcopy"):
+            keywords = copy.deepcopy(keywords)
 
         # Z_nr and prev_keyword were added in the previous loop. Remove them
         del keywords["Z_nr"]
         del keywords["prev_keyword"]
 
+        keys, values, talys_keywords = self.isotope_keywords(keywords)
+
+        # The full grid, or the sample of it given in the input
+        combinations = self.sampler.select(values, (keywords["element"],
+                                                    keywords["mass"]))
+        for value in combinations:
+            # Hold if paused by a signal, the control FIFO or a keystroke
+            self.control.wait_while_paused()
+
+            name, talys_keywords_current = self.job_keywords(
+                talys_keywords, keys, value)
+            keywords["name"] = name
+
+            # Done in the sweep resumed from
+            key = catalog.job_key(keywords["element"], keywords["mass"], name)
+            resumed = self.resume_jobs.get((key["element"], key["mass"], name))
+            if resumed is not None:
+                with self.counter.get_lock():
+                    self.counter.value += self.energy_chunks
+                self.progress.job_started("resumed")
+                self.progress.job_finished("resumed", 0)
+                self.catalog.resumed(keywords["element"], keywords["mass"], name,
+                                     talys_keywords_current, self.swept,
+                                     resumed, self.refinement_round())
+                if self.refiner is not None and self.refiner.result in resumed:
+                    self.refiner.record(
+                        (keywords["element"], keywords["mass"]),
+                        tuple(value),
+                        keys.index(self.refiner.keyword),
+                        resumed[self.refiner.result])
+                self.logger.debug("Skipping %s, done before", job_name(keywords))
+                continue
+
+            if name:
+                self.rest_directory = os.path.join(
+                    self.work_directory, name)
+            else:
+                # If nothing varies, name the directories by a counter
+                self.rest_directory = self.work_directory
+
+            # The MPI ranks make the directory and input of their jobs
+            if not self.use_MPI:
+                if name:
+                    with self.profiler.stage("mkdir"):
+                        mkdir(self.rest_directory)
+                try:
+                    self.make_input_file(talys_keywords_current)
+                except Exception as exc:
+                    # No biggie. Just print an error and move on
+                    self.logger.error("An error occured with %s: %s", name, exc)
+                    continue
+            self.timeline.instant("plan", LAUNCHER, job=job_name(keywords))
+            with self.profiler.stage("catalog"):
+                self.catalog.planned(
+                    keywords["element"], keywords["mass"], name,
+                    self.rest_directory, self.result_directory,
+                    talys_keywords_current, self.swept,
+                    dict((filename, runner.result_path(self.result_directory,
+                                                       name, filename))
+                         for filename in self.config.result_files),
+                    self.refinement_round(), self.energy_chunks)
+            if self.refiner is not None:
+                result = self.refiner.result
+                self.refiner.record(
+                    (keywords["element"], keywords["mass"]),
+                    tuple(value),
+                    keys.index(self.refiner.keyword),
+                    runner.result_path(self.result_directory, name, result))
+            # Run each input once. The results are linked when done
+            if self.dedup is not None:
+                input_file = os.path.join(self.rest_directory,
+                                          self.config.input_file)
+                # Not written yet with MPI
+                text = (self.render_input(talys_keywords_current)
+                        if self.use_MPI else None)
+                first = self.dedup.original(input_file, (self.result_directory,
+                                                         name, job_name(keywords)),
+                                            text)
+                if first is not None:
+                    self.catalog.duplicate(keywords["element"], keywords["mass"],
+                                           name, first[1])
+                    with self.counter.get_lock():
+                        self.counter.value += self.energy_chunks
+                    self.progress.job_started("duplicate")
+                    self.progress.job_finished("duplicate", 0)
+                    self.logger.info("(%s/%s) Same input as %s: %s",
+                                     self.counter.value, self.counter_max,
+                                     first[2], job_name(keywords))
+                    continue
+
+            # Run TALYS, or each chunk of the energies as a TALYS of its own
+            if self.energy_chunks > 1:
+                jobs = self.prepare_chunks(keywords)
+            else:
+                jobs = [(keywords, self.rest_directory)]
+            for job_keywords, directory in jobs:
+                job = (dict(job_keywords), directory, self.result_directory,
+                       tuple(value))
+                if self.pipeline is not None:
+                    self.pipeline.put(job)
+                else:
+                    self.dispatch(*job)
+
+    def isotope_keywords(self, keywords):
+        """ Sort the keywords of an isotope into the varying and the fixed
+
+        Parameters: keywords: the input keywords, with the element and mass
+                    of the isotope
+        Returns:    (keys, values, talys_keywords): the varying keywords in
+                    alphabetical order, their values followed by the groups
+                    of dependents, and the fixed TALYS keywords, including
+                    those of the custom blocks
+        """
         keys = []
         values = []
         talys_keywords = {}
@@ -767,9 +1357,7 @@ class Manager:
         sorted_keys.sort()
         for key in sorted_keys:
             # Only use keywords that vary, and astro
-            if (len(self.reader[key]) > 1
-                and key != "element"
-                and key != "mass"):
+            if key in self.config.varying:
                 # the next two lists are in alphabetical order, and
                 # corresponding key-value pair have the same index
                 keys.append(key)
@@ -778,181 +1366,399 @@ class Manager:
                 talys_keywords[key] = keywords[key]
         # 1) append the conditional names to the keywords, since they
         # are the one to be chosen from. This is undone in 2)
-        for condition in self.reader.dependents:
-            values.append(condition.keys())
+        for condition in self.config.dependents:
+            values.append(condition)
 
         # Load the keywords from the custom blocks
         self.load_custom_keywords(talys_keywords, keywords)
+        return keys, values, talys_keywords
 
-        # Set the counter to inform the user on the progress
-        # It is at this stage that the script knows how many iterations it
-        # must do, so the counter_max is set only once - during the first run
-        if self.counter_max == 0:
-            self.count(values)
+    def job_keywords(self, talys_keywords, keys, value):
+        """ The name and the TALYS keywords of a combination
 
-        # Make a checkpoint at the current mass and element
-        self.make_checkpoint("{} {}".format(keywords["element"],
-                                            keywords["mass"]))
-        for value in product(*values):
+        Parameters: talys_keywords, keys: as given by isotope_keywords
+                    value: the combination: the values of keys followed by
+                           the dependents chosen
+        Returns:    (name, keywords)
+        """
+        with self.profiler.stage("deepcopy"):
             talys_keywords_current = copy.deepcopy(talys_keywords)
 
-            # If --enable_pausing is set, check if execution shall pause
-            if self.args.enable_pausing:
-                if self.do_pause.value == 1:
-                    self.logger.debug("Waiting to be restarted...")
-                    self.pausing_queue.get()
-                    self.logger.debug("Restarting")
-
-            # 2) splits the result back into keywords and conditions
-            keywordvals = value[:len(keys)]
-            conditionkeys = value[len(keys):]
-            # Name the directory according to the alphabetical order
-            # of the keywords
-            name = ''
-            for i in range(len(keywordvals)):
-                # Add to the name
-                name = "{}-{}".format(name, keywordvals[i])
-                # add the now one-option keyword to talys_keywords
-                talys_keywords_current[keys[i]] = keywordvals[i]
-
-            # Remove the unecessary -
-            name = name[1:]
-
-            # Furthermore, name the directory accoring to the chosen condition
-            for key in conditionkeys:
-                value = self.reader.get_condition_val(key)
-                name = "{}-{}-{}".format(name, key, value)
-                talys_keywords_current[key] = value
+        # 2) splits the result back into keywords and conditions
+        keywordvals = value[:len(keys)]
+        conditionkeys = value[len(keys):]
+        # Name the directory according to the alphabetical order
+        # of the keywords
+        name = ''
+        for i in range(len(keywordvals)):
+            # Add to the name
+            name = "{}-{}".format(name, keywordvals[i])
+            # add the now one-option keyword to talys_keywords
+            talys_keywords_current[keys[i]] = keywordvals[i]
+
+        # Remove the unecessary -
+        name = name[1:]
+
+        # Furthermore, name the directory accoring to the chosen condition
+        for key in conditionkeys:
+            condition = self.config.conditions[key]
+            name = "{}-{}-{}".format(name, key, condition)
+            talys_keywords_current[key] = condition
+
+        # Make all values to non-lists
+        for key, val in talys_keywords_current.items():
+            if isinstance(val, (list, tuple)):
+                talys_keywords_current[key] = val[0]
+        return name, talys_keywords_current
+
+    def plan(self, keywords, structure):
+        """ Prepare the jobs below structure and run them
+
+        Parameters: keywords, structure: as given to run_deeper
+        Returns:    None
+        Algorithm:  With the pipeline, run_deeper prepares the jobs in a
+                    thread while this one dispatches them, up to --lookahead
+                    jobs ahead. Otherwise, each job is dispatched when
+                    prepared
+        """
+        if self.pipeline is None:
+            self.run_deeper(keywords, structure)
+            return
 
-            keywords["name"] = name
+        def consume(job):
+            # The jobs prepared before a pause wait too
+            self.control.wait_while_paused()
+            self.dispatch(*job)
 
-            # Make all values to non-lists
-            for key, val in talys_keywords_current.items():
-                if isinstance(val, (list, tuple)):
-                    talys_keywords_current[key] = val[0]
+        self.pipeline.run(lambda: self.run_deeper(keywords, structure),
+                          consume, self.profiler.stage("pipeline"))
 
-            # Make the directories
-            if name:
-                self.rest_directory = os.path.join(
-                    self.work_directory, name)
-                mkdir(self.rest_directory)
-            else:
-                # If nothing varies, name the directories by a counter
-                self.rest_directory = self.work_directory
+    def prepare_chunks(self, keywords):
+        """ Split the energies of a job into chunks
 
-            # Make input file
-            try:
-                self.make_input_file(talys_keywords_current)
-            except Exception as exc:
-                # No biggie. Just print an error and move on
-                self.logger.error("An error occured with %s: %s", name, exc)
+        Parameters: keywords: the job's keywords, with the name
+        Returns:    A list over (keywords, directory) of the chunks
+        Algorithm:  Make a directory for each chunk below the job's, with
+                    the job's input and the chunk's part of the energy file.
+                    The chunks are named by the job and the number of the
+                    chunk. Their results are merged by wait_for_jobs
+        """
+        job_directory = self.rest_directory
+        directories = [os.path.join(job_directory, "chunk{}".format(index))
+                       for index in range(self.energy_chunks)]
+        # The MPI ranks make the chunks of their jobs
+        if not self.use_MPI:
+            energy_file = self.config['energy'][0]
+            chunks = energies.split(
+                energies.read_energies(os.path.join(job_directory, energy_file)),
+                self.energy_chunks)
+            for directory, chunk in zip(directories, chunks):
+                with self.profiler.stage("mkdir"):
+                    mkdir(directory)
+                shutil.copy(os.path.join(job_directory, self.config.input_file),
+                            directory)
+                energies.write_energies(os.path.join(directory, energy_file),
+                                        chunk)
+        names = [energies.chunk_name(keywords["name"], index)
+                 for index in range(self.energy_chunks)]
+        self.merges.append((self.result_directory, keywords["name"], names,
+                            job_name(keywords)))
+        jobs = []
+        for index, (directory, name) in enumerate(zip(directories, names)):
+            chunk_keywords = dict(keywords)
+            chunk_keywords["name"] = name
+            # The job in the catalog
+            chunk_keywords["job"] = keywords["name"]
+            chunk_keywords["chunk"] = index
+            jobs.append((chunk_keywords, directory))
+        return jobs
+
+    def dispatch(self, keywords, directory, result_directory, combination=None):
+        """ Run the job, or send it off
+
+        Parameters: keywords: the job's keywords, with the name
+                    directory: the directory with the job's input
+                    result_directory: the directory to collect the results to
+                    combination: the values of the varying keywords and the
+                                 dependents chosen, as given to job_keywords
+        Returns:    None
+        Algorithm:  Add it to the batch of the MPI ranks, add it to the
+                    coordinator's queue, run TALYS here or in a child, or
+                    write an index file with --dummy. An MPI rank is only
+                    sent the number of the job, the isotope, the combination
+                    and the chunk, from which it makes the job's directory
+                    and input
+        """
+        if self.use_MPI:
+            index = self.job_index
+            self.job_index += 1
+            self.sent_jobs[index] = ("{}{}-{}".format(
+                keywords["mass"], keywords["element"], keywords["name"]),
+                (keywords["element"], keywords["mass"],
+                 keywords.get("job", keywords["name"])))
+            self.batch.append((index,
+                               keywords["element"],
+                               keywords["mass"],
+                               combination,
+                               keywords.get("chunk")))
+            self.send_batches()
+        elif self.use_coordinator:
+            # A worker will pick it up
+            self.coordinator.add(directory,
+                                 result_directory,
+                                 keywords["name"],
+                                 keywords["mass"],
+                                 keywords["element"],
+                                 keywords.get("job"))
+        else:
+            # No kind of multiprocessing
+            if not self.args.dummy:
+                self.run_talys(keywords=keywords, directory=directory,
+                               result_directory=result_directory)
+            else:
+                with open(
+                os.path.join(self.indices_directory,
+                             str(self.index_counter)), "w") as index_file:
+                    # The directory to work in
+                    index_file.write(directory)
+                    index_file.write("\n")
+                    # The directory to store the results to
+                    name = keywords["name"] if keywords["name"] else ""
+                    index_file.write(
+                        os.path.join(result_directory,
+                                     name))
+                self.index_counter += 1
+
+    def send_batches(self, flush=False):
+        """ Send the jobs in the batch to the MPI ranks
+
+        Parameters: flush: send the jobs even if there are fewer than the
+                           rank has room for
+        Returns:    None
+        Algorithm:  Each rank holds up to twice its number of TALYS
+                    processes, so it has the next jobs at hand when one
+                    finishes. Take the reports already waiting, then send to
+                    the rank with the most room. Send at once if it has a
+                    free process, else once the batch has a job for each of
+                    its processes. If no rank has room, wait for one to
+                    report back
+        """
+        while comm.Iprobe(source=MPI.ANY_SOURCE):
+            self.receive_from_rank()
+        while self.batch:
+            rank = max(self.rank_slots, key=lambda n: (
+                2*self.rank_slots[n] - self.rank_jobs[n], -n))
+            room = 2*self.rank_slots[rank] - self.rank_jobs[rank]
+            if room <= 0:
+                self.logger.debug("Waiting for available rank")
+                with self.profiler.stage("wait"):
+                    self.receive_from_rank()
                 continue
+            slots = self.rank_slots[rank]
+            if room <= slots and len(self.batch) < slots and not flush:
+                return
+            jobs = self.batch[:room]
+            del self.batch[:room]
+            with self.profiler.stage("send"):
+                comm.send(jobs, dest=rank)
+            self.rank_jobs[rank] += len(jobs)
+            for job in jobs:
+                self.timeline.instant("dispatch", LAUNCHER,
+                                      job=self.sent_jobs[job[0]][0], rank=rank)
+                self.progress.job_started("rank{}".format(rank))
+
+    def receive_from_rank(self):
+        """ Wait for a rank to report its finished jobs and log them
 
-            # Run TALYS
-            if self.use_MPI:
-                if self.used_ranks >= self.mpisize:
-                    self.logger.debug("Waiting for available rank")
-                    try:
-                        self.send_to_rank, execution_time, errors = comm.recv(source=MPI.ANY_SOURCE)
-                        if execution_time != "null":
-                            self.logger.info('(%s/%s) %s', self.counter.value,
-                                             self.counter_max,
-                                             execution_time)
-                        for error in errors:
-                            self.logger.error(error)
-                        self.counter.value += 1
-                    finally:
-                        self.logger.debug("Sending to %s", self.send_to_rank)
-                    self.used_ranks -= 1
-                comm.send((self.rest_directory,
-                           self.result_directory,
-                           keywords["mass"],
-                           keywords["element"],
-                           keywords["name"]),
-                          dest=self.send_to_rank)
-                self.used_ranks += 1
-                self.send_to_rank = self.used_ranks
-            else:
-                # No kind of multiprocessing
-                if not self.args.dummy:
-                    self.run_talys(keywords=keywords)
-                else:
-                    with open(
-                    os.path.join(self.indices_directory,
-                                 str(self.index_counter)), "w") as index_file:
-                        # The directory to work in
-                        index_file.write(self.rest_directory)
-                        index_file.write("\n")
-                        # The directory to store the results to
-                        name = keywords["name"] if keywords["name"] else ""
-                        index_file.write(
-                            os.path.join(self.result_directory,
-                                         name))
-                    self.index_counter += 1
+        Parameters: None
+        Returns:    The rank that reported
+        """
+        rank, finished = comm.recv(source=MPI.ANY_SOURCE)
+        self.rank_jobs[rank] -= len(finished)
+        worker = "rank{}".format(rank)
+        for (index, slot, elapsed, execution_time, errors, timed_out,
+             timings) in finished:
+            job, key = self.sent_jobs.pop(index)
+            # A row of the trace for each process of the rank
+            self.trace_run(worker if self.rank_slots[rank] == 1
+                           else "{}/{}".format(worker, slot), job, timings)
+            self.catalog.finished(*key, seconds=elapsed,
+                                  failed=bool(errors), timed_out=timed_out,
+                                  host=worker, errors=errors,
+                                  started=timings.get("start") if timings else None)
+            self.progress.job_finished(worker, elapsed, bool(errors) or timed_out)
+            with self.counter.get_lock():
+                self.counter.value += 1
+            if execution_time != "null":
+                self.logger.info('(%s/%s) %s', self.counter.value,
+                                 self.counter_max,
+                                 execution_time)
+            for error in errors:
+                self.logger.error(error)
+            if timed_out:
+                self.timed_out.append(job)
+        return rank
+
+    def report_timeouts(self):
+        """ Log the jobs that timed out and write them to a file
+
+        Parameters: None
+        Returns:    None
+        """
+        timed_out = list(self.timed_out)
+        if self.use_coordinator:
+            timed_out.extend(self.coordinator.timed_out)
+        if not timed_out:
+            return
+        self.logger.warning("%s jobs timed out:\n%s", len(timed_out),
+                            "\n".join(timed_out))
+        with open(os.path.join(self.root_directory, "timeouts.txt"), "w") as report:
+            report.write("\n".join(timed_out) + "\n")
+
+    def trace_dispatch(self, waited, kwargs):
+        """ Record the wait for a free slot and the dispatch of a job
+
+        Parameters: waited: the time the wait began
+                    kwargs: the keyword arguments of the dispatched function
+        Returns:    None
+        Algorithm:  run_talys is given the keywords of a job, and
+                    run_deeper_useless_function the element or mass of a
+                    directory of --multi
+        """
+        if not self.timeline.enabled:
+            return
+        now = time.time()
+        if "keyword" in kwargs:
+            job = kwargs["keyword"]
+        else:
+            job = job_name(kwargs["keywords"])
+        if now - waited > 1e-3:
+            self.timeline.span("wait", LAUNCHER, waited, now, job=job)
+        self.timeline.instant("dispatch", LAUNCHER, now, job=job)
+
+    def trace_run(self, track, job, timings):
+        """ Record when TALYS ran and the results were copied
+
+        Parameters: track: the row of the worker, e.g. "rank3"
+                    job: the name of the job
+                    timings: the dict filled by runner.run_talys, or None
+        Returns:    None
+        """
+        if timings:
+            self.timeline.span("spawn", track, timings["start"],
+                               timings["spawned"], job=job)
+            self.timeline.span("talys", track, timings["spawned"],
+                               timings["end"], job=job)
+            self.timeline.span("collect", track, timings["end"],
+                               timings["collected"], job=job)
+
+    def log_lease(self, host, job):
+        """ Record a job given to a worker of the coordinator """
+        self.progress.job_started(host)
+        self.timeline.instant("dispatch", LAUNCHER, job=job_name(job),
+                              worker=host)
+
+    def log_completion(self, job, execution_time, errors, host,
+                       timed_out=False, timings=None):
+        """ Log a job completed by a worker of the coordinator
+
+        Parameters: job: the job as given to the worker
+                    execution_time: the execution time in seconds
+                    errors: a list over errors reported by the worker
+                    host: the name of the worker's host and slot
+                    timed_out: whether the job was killed for running too long
+                    timings: the dict filled by runner.run_talys, or None
+        Returns:    None
+        """
+        self.trace_run(host, job_name(job), timings)
+        self.progress.job_finished(host, execution_time,
+                                   bool(errors) or timed_out)
+        self.catalog.finished(job["element"], job["mass"],
+                              job.get("job") or job["name"], execution_time,
+                              failed=bool(errors), timed_out=timed_out,
+                              host=host, errors=errors,
+                              started=timings.get("start") if timings else None)
+        info = job_name(job)
+        # Called by the threads serving the workers
+        with self.counter.get_lock():
+            self.counter.value += 1
+            count = self.counter.value
+        self.logger.info("(%s/%s) Execution time: %s by %s on %s",
+                         count, self.counter_max,
+                         runner.format_time(execution_time), info, host)
+        for error in errors:
+            self.logger.error(error)
 
     @support_multiprocessing()
-    def run_talys(self, keywords):
+    def run_talys(self, keywords, directory, result_directory):
         """ Runs TALYS
 
         Parameters: keywords: the input options
+                    directory: the directory with the job's input
+                    result_directory: the directory to collect the results to
         Algorithm:  call system.fork() to run TALYS, and redirect the system
                     signals and standard outputs to this python script. Log
                     any errors and execution time
         """
 
+        # Take a free core if pinning
+        cpu = self.cores.get() if self.cores is not None else None
+        worker = "local" if cpu is None else "cpu{}".format(cpu)
+        self.progress.job_started(worker)
+        # The row of the trace. Pinned jobs have a row per core
+        lane = self.timeline.take_lane() if cpu is None else None
+        timings = {}
+        timeout = runner.job_timeout(self.durations, self.args.timeout,
+                                     self.args.timeout_factor)
         # Actually run TALYS and time its execution
-        start = time.time()
-        with Cd(self.rest_directory):
-            process = subprocess.Popen("talys",
-                                       # Do not send signals to the subprocess
-                                       preexec_fn=os.setpgrp,
-                                       # Send the input file as stdin
-                                       stdin=open(self.reader["input_file"], "r"),
-                                       # Send stdout to the output file
-                                       stdout=open(self.reader["output_file"], "w"),
-                                       # Errors are sent to stderr
-                                       stderr=subprocess.PIPE,
-                                       # Close all file descriptors except 0, 1, 2, 3
-                                       close_fds=True)
-        # Check STDERR and see if they are non-empty
-        _, stderr = process.communicate()
-        if stderr:
-            self.logger.critical("talys could not be run: %s", stderr)
-        elapsed = time.strftime("%M:%S", time.localtime(time.time() - start))
-        info = "{mass}{element}-{name}".format(**keywords) if keywords["name"] else "{mass}{element}".format(**keywords)
-        self.counter.value += 1
-        self.logger.info("(%s/%s) Execution time: %s by %s",
-                         self.counter.value,
-                         self.counter_max, elapsed, info)
-
-        # Move result file to
-        # TALYS-calculations-date-time/result_files/element/isotope
         try:
-            for filename in self.reader["result_files"]:
-                name = "{}-{}".format(keywords["name"], filename) if keywords["name"] else filename
-                shutil.copy(os.path.join(self.rest_directory, filename),
-                            os.path.join(self.result_directory,
-                                         name))
-        except Exception as exc:
-            # Give TALYS some time to write the output.txt
-            time.sleep(1)
-
-            self.logger.error(exc)
-            # The filesize of output_file is an indicator of whether the
-            # execution was successful or not
-            path = os.path.join(self.rest_directory,
-                                self.reader["output_file"])
-            if os.path.getsize(path) < 600:
-                # Execution failed. Open the file and log the output
-                with open(path, "r") as output_file:
-                    msg = ''.join(output_file.readlines()).rstrip()
-                self.logger.error(msg[1:])
-
-        # Tell the parent process that the child has finnished
-        # The purpose of this is to let the next process begin
-        self.logger.debug("%s is terminating",
-                          multiprocessing.current_process().pid)
-        self.queue.put(multiprocessing.current_process().pid)
+            with self.profiler.stage("talys"):
+                elapsed, errors, attempts, timed_out = runner.run_with_retries(
+                    self.args.retries,
+                    directory,
+                    result_directory,
+                    keywords["name"],
+                    self.config.input_file,
+                    self.config.output_file,
+                    self.config.result_files,
+                    spawner=self.spawner,
+                    cpu=cpu,
+                    timeout=timeout,
+                    pids=self.talys_pids,
+                    timings=timings,
+                    collect=self.args.collect)
+        finally:
+            if cpu is not None:
+                self.cores.put(cpu)
+            self.timeline.give_lane(lane)
+        self.trace_run(lane or worker, job_name(keywords), timings)
+        if "spawned" in timings:
+            self.profiler.add("spawn", timings["spawned"] - timings["start"])
+        self.progress.job_finished(worker, elapsed, bool(errors) or timed_out)
+        # This process only ran one TALYS, so this is its peak memory
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        with self.job_memory.get_lock():
+            self.job_memory.value = max(self.job_memory.value, peak)
+        self.catalog.finished(keywords["element"], keywords["mass"],
+                              keywords.get("job", keywords["name"]), elapsed,
+                              failed=bool(errors), timed_out=timed_out,
+                              host=worker, attempts=attempts, errors=errors,
+                              started=timings.get("start"))
+        info = job_name(keywords)
+        if timed_out:
+            self.timed_out.append(info)
+        else:
+            self.durations.append(elapsed)
+        if attempts > 1:
+            info = "{} after {} attempts".format(info, attempts)
+        with self.counter.get_lock():
+            self.counter.value += 1
+        with self.profiler.stage("logging"):
+            self.logger.info("(%s/%s) Execution time: %s by %s",
+                             self.counter.value,
+                             self.counter_max, runner.format_time(elapsed), info)
+            for error in errors:
+                self.logger.error(error)
 
 
 # For MPI
@@ -961,88 +1767,201 @@ class ChildRunner(Manager):
     def __init__(self, rank):
         self.rank = rank
         self.use_MPI = True
-        self.reader = comm.recv(source=0, tag=1)
+        self.config, self.options = comm.recv(source=0, tag=1)
+        pin = self.options["pin"]
+        # The execution times of this rank, to predict the time limit
+        self.durations = []
+        # Collective. Must be called by every rank
+        cpu, local_size, local_cpus = affinity.mpi_local_placement(
+            comm, MPI, self.options["numa"])
+        # The number of TALYS processes run by this rank
+        self.slots = affinity.rank_processes(self.options["processes"])
+        if local_size*self.slots > local_cpus:
+            msg = "{} ranks of {} processes share {} cores on {}".format(
+                local_size, self.slots, local_cpus, platform.node())
+            if pin:
+                print("Can not pin: " + msg)
+                comm.Abort()
+            print("Warning: oversubscribing: " + msg)
+        # The cpu of each process. They follow the rank's cpu in the
+        # placement order, so the ranks on a node do not share cpus
+        if not pin:
+            self.cpus = [None]*self.slots
+        elif self.slots == 1:
+            self.cpus = [cpu]
+        else:
+            order = affinity.placement_order(affinity.available_cpus(),
+                                             self.options["numa"])
+            start = order.index(cpu) if cpu in order else 0
+            self.cpus = [order[(start + i) % len(order)]
+                         for i in range(self.slots)]
+        comm.send(self.slots, dest=0, tag=2)
+        # Each job runs its own copy of talys
+        self.spawner = runner.make_spawner(self.options["spawn"], "./talys")
         self.directory = ''
+        # Used by the methods of the Manager making the input
+        self.profiler = Profiler()
+        self.root_directory = self.options["root_directory"]
+        self.astro_yes = not any(astro in self.config["astro"]
+                                 for astro in ("n", "no"))
+        # The keywords of the last isotope, as given by isotope_keywords
+        self.isotope = None
         self.wait_for_root()
 
     def wait_for_root(self):
         """ Waits for commands from the script running as rank 0
         Parameters: None
         Returns:    None
-        Algorithm:  For eternity, get commands from rank 0, break execution if
-                    commanded to do so, and run talys if commanded to do so
+        Algorithm:  Rank 0 sends batches of jobs, which are prepared here
+                    and run by a thread for each TALYS process, as in the
+                    workers of --serve. No Python process is forked after
+                    MPI is initialised. The finished jobs are reported
+                    together once half the processes are done, or when
+                    nothing else is running. Every job is answered, also if
+                    it failed, since rank 0 waits for the answer. Stop when
+                    sent None
+        """
+        jobs = queue.Queue()
+        finished = queue.Queue()
+        threads = [threading.Thread(target=self.slot, args=(n, jobs, finished))
+                   for n in range(self.slots)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        running = 0
+        done = []
+        stop = False
+        while not stop or running:
+            # Also look for jobs while TALYS runs, so no process is idle
+            while not stop and comm.Iprobe(source=0):
+                batch = comm.recv(source=0)
+                if batch is None:
+                    stop = True
+                    break
+                for job in batch:
+                    running += 1
+                    try:
+                        jobs.put((job[0], job[1], job[2]) + self.prepare(*job[1:]))
+                    except Exception as e:
+                        finished.put((job[0], None, 0, "null", [
+                            "An error occured on rank {}: {}".format(self.rank, e)],
+                            False, {}))
+            try:
+                done.append(finished.get(timeout=0.05))
+                running -= 1
+            except queue.Empty:
+                pass
+            if done and (len(done) >= max(1, self.slots//2) or running == 0):
+                comm.send((self.rank, done), dest=0)
+                done = []
+        for thread in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+    def slot(self, slot, jobs, finished):
+        """ Run the jobs put on the queue, until given None
+
+        Parameters: slot: the number of the process, which decides its cpu
+                    jobs: a queue over (index, element, mass, work directory,
+                          result directory, name)
+                    finished: the queue to put the result of each job on
         """
         while True:
+            job = jobs.get()
+            if job is None:
+                return
+            index, element, mass, work_directory, result_directory, name = job
+            start = time.time()
             try:
-                work_directory, result_directory, mass, element, name = comm.recv(source=0)
-                if "stop" in name:
-                    break
-                self.errors = []
-                self.execution_time = "null"
-                self.run_talys(work_directory, result_directory,
-                               mass, element, name)
-                comm.send((self.rank, self.execution_time, self.errors), dest=0)
+                result = self.run_talys(slot, work_directory, result_directory,
+                                        mass, element, name)
             except Exception as e:
-                print("An error occured: ", e)
-
-    def run_talys(self, work_directory, result_directory, mass, element, name):
+                result = ("null", ["An error occured on rank {}: {}".format(
+                    self.rank, e)], False, {})
+            finished.put((index, slot, time.time() - start) + result)
+
+    def prepare(self, element, mass, combination, chunk):
+        """ Make the directories and the input of a job
+
+        Parameters: element, mass: the isotope
+                    combination: as given to job_keywords
+                    chunk: the number of the chunk of the energies, or None
+        Returns:    (work directory, result directory, name)
+        Algorithm:  Find the keywords the same way as rank 0 does in
+                    run_rest, from the configuration sent at start. A chunk
+                    is run in a directory below the job's, with its part of
+                    the energies
+        """
+        if self.isotope is None or self.isotope[0] != (element, mass):
+            keywords = dict(self.config.keywords)
+            keywords["element"] = element
+            keywords["mass"] = mass
+            self.isotope = ((element, mass), self.isotope_keywords(keywords))
+        keys, _, talys_keywords = self.isotope[1]
+        name, talys_keywords = self.job_keywords(talys_keywords, keys,
+                                                 combination)
+        work_directory = isotope_directory(
+            os.path.join(self.root_directory, "original_data"), element, mass)
+        result_directory = isotope_directory(
+            os.path.join(self.root_directory, "results_data"), element, mass)
+        if name:
+            work_directory = os.path.join(work_directory, name)
+        if chunk is not None:
+            work_directory = os.path.join(work_directory, "chunk{}".format(chunk))
+            name = energies.chunk_name(name, chunk)
+        mkdir(work_directory)
+        mkdir(result_directory)
+        self.rest_directory = work_directory
+        self.make_input_file(talys_keywords)
+        if chunk is not None:
+            energy_file = self.config['energy'][0]
+            grid = energies.split(
+                energies.read_energies(os.path.join(self.root_directory,
+                                                    energy_file)),
+                self.options["energy_chunks"])[chunk]
+            energies.write_energies(os.path.join(work_directory, energy_file),
+                                    grid)
+        return work_directory, result_directory, name
+
+    def run_talys(self, slot, work_directory, result_directory, mass,
+                  element, name):
         """ Runs TALYS
 
-        Parameters: keywords: the input options
-        Algorithm:  call system.fork() to run TALYS, and redirect the system
-                    signals and standard outputs to this python script. Log
-                    any errors and execution time
+        Parameters: slot: the number of the process, which decides its cpu
+                    work_directory, result_directory: of the job
+                    mass, element, name: the job, for the log
+        Returns:    (execution time message, errors, timed out, timings)
+        Algorithm:  Run TALYS as a subprocess pinned to the slot's cpu,
+                    retrying on failure. Called by several threads at once,
+                    so nothing is kept on the instance
         """
 
         shutil.copy("talys", work_directory)
-        start = time.time()
-        with Cd(work_directory):
-            process = subprocess.Popen("./talys",
-                                       # Do not send signals to the subprocess
-                                       preexec_fn=os.setpgrp,
-                                       # Send the input file as stdin
-                                       stdin=open(self.reader["input_file"], "r"),
-                                       # Send stdout to the output file
-                                       stdout=open(self.reader["output_file"], "w"),
-                                       # Errors are sent to stderr
-                                       stderr=subprocess.PIPE,
-                                       # Close all file descriptors except 0, 1, 2, 3
-                                       close_fds=True)
-
-        # Check STDERR and see if they are non-empty
-        _, stderr = process.communicate()
-
-        if stderr:
-            self.errors.append("TALYS could not be run: {}".format(stderr.rstrip()))
-            return
-
+        timeout = runner.job_timeout(self.durations, self.options["timeout"],
+                                     self.options["timeout_factor"])
+        timings = {}
+        elapsed, errors, attempts, timed_out = runner.run_with_retries(
+            self.options["retries"],
+            work_directory, result_directory,
+            name,
+            self.config.input_file,
+            self.config.output_file,
+            self.config.result_files,
+            spawner=self.spawner,
+            cpu=self.cpus[slot],
+            timeout=timeout,
+            timings=timings,
+            collect=self.options["collect"])
         os.remove(os.path.join(work_directory, "talys"))
-        elapsed = time.strftime("%M:%S", time.localtime(time.time() - start))
+        if not timed_out:
+            self.durations.append(elapsed)
         info = "{}{}-{}".format(mass, element, name) if name else "{}{}".format(mass, element)
-        self.execution_time = "Execution time: {} by {}".format(elapsed, info)
-
-        # Move result file to
-        # TALYS-calculations-date-time/result_files/element/isotope
-        try:
-            for filename in self.reader["result_files"]:
-                fname = "{}-{}".format(name, filename) if name else filename
-                shutil.copy(os.path.join(work_directory, filename),
-                            os.path.join(result_directory,
-                                         fname))
-        except Exception as exc:
-            # Give TALYS some time to write the output.txt
-            time.sleep(1)
-
-            self.errors.append(exc)
-            # The filesize of output_file is an indicator of whether the
-            # execution was successful or not
-            path = os.path.join(work_directory,
-                                self.reader["output_file"])
-            if os.path.getsize(path) < 600:
-                # execution failed. Open the file and log the output
-                with open(path, "r") as output_file:
-                    msg = ''.join(output_file.readlines()).rstrip()
-                    self.errors.append(msg[1:])
+        if attempts > 1:
+            info = "{} after {} attempts".format(info, attempts)
+        execution_time = "Execution time: {} by {}".format(
+            runner.format_time(elapsed), info)
+        return execution_time, list(errors), timed_out, timings
 
 """
 ###############################################################################
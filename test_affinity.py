@@ -0,0 +1,18 @@
+import unittest
+import affinity
+
+
+class RankProcessesTest(unittest.TestCase):
+    def test_without_p_one_process(self):
+        self.assertEqual(affinity.rank_processes(None), 1)
+
+    def test_p_alone_every_available_cpu(self):
+        self.assertEqual(affinity.rank_processes(0),
+                         len(affinity.available_cpus()))
+
+    def test_p_n(self):
+        self.assertEqual(affinity.rank_processes(3), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
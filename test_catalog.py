@@ -0,0 +1,49 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import catalog
+from catalog import Catalog
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.catalog = Catalog(self.directory)
+
+    def tearDown(self):
+        self.catalog.stop()
+        shutil.rmtree(self.directory)
+
+    def plan(self, strength, round=0):
+        self.catalog.planned("Dy", 160, "job", "work", "result",
+                             {"strength": strength}, ["strength"],
+                             {"astrorate.g": "result/astrorate.g"}, round=round)
+
+    def query(self, sql):
+        connection = sqlite3.connect(os.path.join(self.directory, catalog.FILENAME))
+        try:
+            return connection.execute(sql).fetchall()
+        finally:
+            connection.close()
+
+    def test_planned_twice_keeps_one_job_without_orphans(self):
+        self.plan(1)
+        self.catalog.flush()
+        (first,), = self.query("SELECT id FROM jobs")
+        self.catalog.finished("Dy", 160, "job", seconds=1)
+        self.plan(2, round=1)
+        self.catalog.flush()
+        self.assertEqual(self.query("SELECT id, round, status, completed_runs "
+                                    "FROM jobs"), [(first, 1, "planned", 0)])
+        self.assertEqual(self.query("SELECT job_id, value FROM parameters"),
+                         [(first, "2")])
+        self.assertEqual(self.query("SELECT job_id FROM results"), [(first,)])
+        orphans = "SELECT COUNT(*) FROM {} WHERE job_id NOT IN (SELECT id FROM jobs)"
+        self.assertEqual(self.query(orphans.format("parameters")), [(0,)])
+        self.assertEqual(self.query(orphans.format("results")), [(0,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import runner
+from coordinator import Coordinator, Worker
+
+
+class Config(object):
+    input_file = "input.txt"
+    output_file = "output.txt"
+    result_files = ["astrorate.g"]
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, "socket")
+        self.coordinator = Coordinator(self.address, logging.getLogger(),
+                                       Config(), poll=0.1)
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.coordinator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_missing_binary_fails_the_job(self):
+        work = os.path.join(self.directory, "work")
+        os.makedirs(work)
+        with open(os.path.join(work, "input.txt"), "w") as infile:
+            infile.write("element Dy\n")
+        self.coordinator.add(work, os.path.join(self.directory, "results"),
+                             "job", 160, "Dy")
+        self.coordinator.finish_planning()
+        reports = []
+        self.coordinator.on_complete = lambda *report: reports.append(report)
+        spawner = runner.make_spawner(None, os.path.join(self.directory,
+                                                         "missing", "talys"))
+        Worker(self.address, 1, spawner, retry=5).run()
+        self.assertTrue(self.coordinator.is_done())
+        self.assertEqual(self.coordinator.completed, 1)
+        self.assertEqual(self.coordinator.failed, 1)
+        job, _, errors, _, _, _ = reports[0]
+        self.assertEqual(job["work_directory"], work)
+        self.assertIn("Could not run TALYS", errors[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
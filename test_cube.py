@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+from cube import ResultCube
+
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        axes = [("isotope", ["160Dy", "161Dy", "162Er"]),
+                ("strength", ["1", "2"]),
+                ("temperature", [0.1, 0.2])]
+        self.cube = ResultCube(np.arange(12.0).reshape(3, 2, 2), axes)
+
+    def test_element(self):
+        selection = self.cube.select(element="Dy")
+        self.assertEqual(selection.labels("isotope"), ["160Dy", "161Dy"])
+        self.assertEqual(selection.shape, (2, 2, 2))
+
+    def test_element_and_single_isotope(self):
+        selection = self.cube.select(element="Dy", isotope="161Dy")
+        self.assertEqual(selection.names, ["strength", "temperature"])
+        np.testing.assert_array_equal(selection.data, self.cube.data[1])
+
+    def test_element_and_list_of_isotopes(self):
+        selection = self.cube.select(element="Dy", isotope=["161Dy", "162Er"])
+        self.assertEqual(selection.labels("isotope"), ["161Dy"])
+        np.testing.assert_array_equal(selection.data, self.cube.data[1:2])
+
+    def test_isotope_of_other_element(self):
+        self.assertRaises(KeyError, self.cube.select, element="Dy",
+                          isotope="162Er")
+
+    def test_single_and_list_of_values(self):
+        selection = self.cube.select(isotope="162Er", strength=[2])
+        self.assertEqual(selection.names, ["strength", "temperature"])
+        np.testing.assert_array_equal(selection.data, self.cube.data[2, 1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
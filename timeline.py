@@ -0,0 +1,107 @@
+"""
+This module records the life of every job as trace events, written with
+--trace FILE in the Trace Event Format. The file can be loaded into
+chrome://tracing or https://ui.perfetto.dev, which show one row for the
+launcher and one for each worker: a pinned core, a slot of -p, an MPI rank or
+a slot of a coordinator's worker. The launcher's row shows when each job was
+planned and dispatched and how long the launcher waited for a free slot, and
+the rows of the workers show when TALYS ran and when the results were
+copied, so idle gaps between the jobs stand out.
+"""
+
+from __future__ import division
+import json
+import multiprocessing
+import os
+import time
+
+LAUNCHER = "launcher"
+
+
+class Timeline(object):
+    """ Collects the trace events of a sweep from every process """
+
+    def __init__(self, path, events=None, lanes=256):
+        """ Parameters: path: the file to write, or None to record nothing
+                        events: a list shared with the children, such as
+                                multiprocessing.Manager().list(), or None if
+                                only this process records
+                        lanes: the largest number of jobs running at once,
+                               as far as the rows of the -p slots go
+        """
+        self.path = path
+        self.enabled = path is not None
+        self.events = events if events is not None else []
+        self.start = time.time()
+        # Which rows of the -p slots are in use, shared with the children
+        self.lanes = multiprocessing.Array('b', lanes) if self.enabled else None
+
+    def span(self, name, track, start, end, **args):
+        """ Record something taking time
+
+        Parameters: name: what took time, e.g. "talys"
+                    track: the row to show it on, e.g. "rank3"
+                    start, end: the times as given by time.time()
+                    args: shown when the span is selected, e.g. job="..."
+        """
+        if self.enabled:
+            self.events.append(("X", name, track, start, end - start, args))
+
+    def instant(self, name, track, when=None, **args):
+        """ Record something happening at once, such as planning a job """
+        if self.enabled:
+            self.events.append(("i", name, track,
+                                time.time() if when is None else when, 0, args))
+
+    def take_lane(self):
+        """ Take the first free row for a -p slot
+
+        Returns:    The name of the row, or None if all are taken
+        """
+        if not self.enabled:
+            return None
+        with self.lanes.get_lock():
+            for i in range(len(self.lanes)):
+                if not self.lanes[i]:
+                    self.lanes[i] = 1
+                    return "slot {}".format(i)
+        return None
+
+    def give_lane(self, lane):
+        """ Give back a row taken by take_lane """
+        if lane is not None:
+            with self.lanes.get_lock():
+                self.lanes[int(lane.split()[-1])] = 0
+
+    def write(self):
+        """ Write the events in the Trace Event Format
+
+        Algorithm:  Every row is a thread of one process. The launcher is the
+                    first row and the workers follow in sorted order. Times
+                    are in microseconds since the start of the sweep
+        """
+        if not self.enabled:
+            return
+        events = list(self.events)
+        tracks = sorted(set(event[2] for event in events) - set([LAUNCHER]))
+        tids = dict((track, tid) for tid, track in enumerate([LAUNCHER] + tracks))
+        trace = [{"name": "process_name", "ph": "M", "pid": 1,
+                  "args": {"name": "TALYS sweep"}}]
+        for track, tid in sorted(tids.items(), key=lambda item: item[1]):
+            trace.append({"name": "thread_name", "ph": "M", "pid": 1,
+                          "tid": tid, "args": {"name": track}})
+            trace.append({"name": "thread_sort_index", "ph": "M", "pid": 1,
+                          "tid": tid, "args": {"sort_index": tid}})
+        for phase, name, track, when, duration, args in events:
+            event = {"name": name, "ph": phase, "pid": 1, "tid": tids[track],
+                     "ts": round((when - self.start)*1e6), "args": args}
+            if phase == "X":
+                event["dur"] = round(duration*1e6)
+            else:
+                # An instant event only on its own row
+                event["s"] = "t"
+            trace.append(event)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as outfile:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, outfile)
+        os.rename(tmp, self.path)
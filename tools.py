@@ -9,7 +9,6 @@ import argparse
 import sys
 import os
 import logging
-import copy
 import subprocess
 from operator import attrgetter
 from string import Formatter
@@ -85,7 +84,35 @@ def mkdir(directory):
     Algorithm:  Check if the direcctory exists, if not, create it
     """
     if not os.path.exists(directory):
-        os.makedirs(directory)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Made meanwhile by another process, e.g. another MPI rank
+            if not os.path.isdir(directory):
+                raise
+
+
+def unique(values):
+    """ Remove duplicates while keeping the order
+    Parameters: values: an iterable
+    Returns:    A list over the values, each only once
+    Algorithm:  Remember the values seen in a set, so the check is constant
+                time. Unhashable values fall back to a list
+    """
+    seen = set()
+    seen_unhashable = []
+    result = []
+    for value in values:
+        try:
+            if value in seen:
+                continue
+            seen.add(value)
+        except TypeError:
+            if value in seen_unhashable:
+                continue
+            seen_unhashable.append(value)
+        result.append(value)
+    return result
 
 
 def make_iterable(dictionary):
@@ -93,38 +120,19 @@ def make_iterable(dictionary):
     Parameters: dictionary: the dict to be made iterable
     Output:     The iterable dictionary
     Algorithm:  Make every key in the list iterable and make the results
-                entries unique"""
-    new_dict = copy.deepcopy(dictionary)
-
-    for key in dictionary:
-        if not isinstance(dictionary[key], (tuple, list)):
-            new_dict[key] = [new_dict[key]]
-
-    # check if every item in user given list is unique
-    for key, value in new_dict.items():
-
-        try:
-            # if variable tuple or list => new list with value only once
-            if len(set(value)) != len(value):
-                newlist = []
-                for val in value:
-                    if val not in newlist:
-                        newlist.append(val)
-                        new_dict[key] = newlist
-
-        except TypeError:
-            # if variable == dict => new dict with value only once inside
-            # user_input[key]
-            for keys, values in value[0].items():
-                print(keys, values)
-                if len(set(values)) != len(values):
-                    newlist = []
-                    for val in values:
-                        if val not in newlist:
-                            newlist.append(val)
-                            value[0][keys] = newlist
-
-                new_dict[key] = value[0]
+                entries unique. A dict, such as mass, has each of its
+                entries made iterable and unique instead"""
+    new_dict = {}
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            new_dict[key] = dict((name, unique(values)
+                                  if isinstance(values, (tuple, list))
+                                  else [values])
+                                 for name, values in value.items())
+        elif isinstance(value, (tuple, list)):
+            new_dict[key] = unique(value)
+        else:
+            new_dict[key] = [value]
     return new_dict
 
 
@@ -244,11 +252,12 @@ def get_args():
     parser.add_argument("-p", "--processes",
                         help=("set the number of processes the script will use."
                         "\nShould be less than or equal to number of CPU cores."
-                        "\nIf no N is specified, all available cores are used"),
+                        "\nIf no N is specified, all available cores are used."
+                        "\nWith MPI, the number of processes of each rank"),
                         type=int, nargs="?",
                         metavar='N', const=0)
     parser.add_argument("--enable-pausing",
-                        help="enable pausing by running a process that checks for input",
+                        help="enable pausing and resuming by pressing p",
                         action="store_true",
                         dest="enable_pausing")
     parser.add_argument("--multi",
@@ -264,10 +273,89 @@ def get_args():
                         action="store_true",
                         dest="disable_filters")
     parser.add_argument("-r", "--resume",
-                        help=("resume from previous checkpoint. If there are"
-                              "\nmore than one TALYS-directory, it will choose"
-                              "\nthe last directory"),
+                        help=("resume the previous TALYS-directory, skipping"
+                              "\nthe jobs done there according to its catalog"),
+                        action="store_true")
+    parser.add_argument("--serve",
+                        help=("serve the jobs to workers started with"
+                              "\npython coordinator.py ADDRESS instead of running"
+                              "\nTALYS. ADDRESS is HOST:PORT or a Unix socket path"),
+                        type=str, default=None, metavar="ADDRESS")
+    parser.add_argument("--adaptive",
+                        help=("adapt the number of processes to the free memory,"
+                              "\nload and disk. Never more than given by -p"),
+                        action="store_true")
+    parser.add_argument("--min-memory",
+                        help="memory in MB to keep free with --adaptive",
+                        type=int, default=500, metavar="MB",
+                        dest="min_memory")
+    parser.add_argument("--min-disk",
+                        help="pause when less disk in MB is free with --adaptive",
+                        type=int, default=1000, metavar="MB",
+                        dest="min_disk")
+    parser.add_argument("--timeout",
+                        help=("kill TALYS if it runs longer than this many seconds"),
+                        type=float, default=None, metavar="SECONDS")
+    parser.add_argument("--timeout-factor",
+                        help=("kill TALYS if it runs longer than F times the"
+                              "\nmedian execution time so far"),
+                        type=float, default=None, metavar="F",
+                        dest="timeout_factor")
+    parser.add_argument("--lookahead",
+                        help=("the number of jobs to prepare ahead of TALYS when"
+                              "\nrunning one job at a time or with MPI. 0 prepares"
+                              "\neach job when it is run. Default is 4"),
+                        type=int, default=4, metavar="N")
+    parser.add_argument("--collect",
+                        help=("how the results are placed in results_data:"
+                              "\nreflink, hardlink, copy, or auto (default) for the"
+                              "\nfirst that works"),
+                        choices=["auto", "reflink", "hardlink", "copy"],
+                        default="auto")
+    parser.add_argument("--retries",
+                        help="the number of times to rerun a job that timed out",
+                        type=int, default=1, metavar="N")
+    parser.add_argument("--status-interval",
+                        help=("seconds between each update of status.json in the"
+                              "\nrun directory"),
+                        type=float, default=30, metavar="SECONDS",
+                        dest="status_interval")
+    parser.add_argument("--metrics",
+                        help=("also write the progress to FILE in the Prometheus"
+                              "\ntextfile collector format"),
+                        type=str, default=None, metavar="FILE")
+    parser.add_argument("--profile",
+                        help=("time each stage of the launcher and write the"
+                              "\nbreakdown to profile.txt in the run directory"),
                         action="store_true")
+    parser.add_argument("--cprofile",
+                        help="run the launcher under cProfile and write the stats to FILE",
+                        type=str, default=None, metavar="FILE")
+    parser.add_argument("--trace",
+                        help=("write the life of every job to FILE as trace events"
+                              "\nfor chrome://tracing or ui.perfetto.dev"),
+                        type=str, default=None, metavar="FILE")
+    parser.add_argument("--spawn",
+                        help=("how TALYS is started: session (default) or preexec."
+                              "\npreexec is slower, and the only choice on Python 2"),
+                        choices=["session", "preexec"], default=None)
+    parser.add_argument("--pin",
+                        help=("pin each TALYS process to a dedicated core."
+                              "\nRefuses to run if there are too few cores"),
+                        action="store_true")
+    parser.add_argument("--numa",
+                        help="spread the pinned TALYS processes across NUMA nodes.\nImplies --pin",
+                        action="store_true")
+    parser.add_argument("--energy-chunks",
+                        help=("split the energies of each job into K TALYS runs"
+                              "\nof their own, and merge their results. Needs astro n"),
+                        type=int, default=None, metavar="K",
+                        dest="energy_chunks")
+    parser.add_argument("--no-dedup",
+                        help=("run every job, also those with the same input as"
+                              "\nanother job"),
+                        action="store_true",
+                        dest="no_dedup")
     parser.add_argument("--dummy",
                         help="for not run TALYS, only create the directories",
                         action="store_true")
@@ -277,6 +365,10 @@ def get_args():
     args.log = getattr(logging, args.log)
     args.verbosity = getattr(logging, args.verbosity)
 
+    # --numa is only meaningful when pinning
+    if args.numa:
+        args.pin = True
+
     # --debug overrules --log and --verbosity
     if args.debug:
         args.log = logging.DEBUG
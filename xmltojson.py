@@ -1,82 +1,149 @@
 import openpyxl
 import argparse
 import json
+import os
 
+# The columns that must be present in the header, in the order they are
+# returned by iter_parameter_rows
+COLUMNS = ["element", "protons", "mass", "omega_sr", "gamma_sr", "sigma_sr"]
+# The number of rows to validate at a time
+BATCH_SIZE = 1000
 
-def read_parameters_from_xl(filename):
-    wb = openpyxl.load_workbook(filename, data_only=True)
-    parameters = {}
-    elements = []
-    masses = {}
-    for sheetname in wb.get_sheet_names():
-        sheet = wb.get_sheet_by_name(sheetname)
-        is_after_elements = False
-        omega_SR = 0
-        gamma_SR = 0
-        sigma_SR = 0
-        element_col = 0
-        proton_col = 0
-        mass_col = 0
-        for row in range(1, sheet.max_row+1):
-            # Parse the header
-            if not is_after_elements:
-                # The header starts with 'Element'
-                if str(sheet.cell(row=row, column=1).value).lower() == "element":
-                    # Next loop is after the header
-                    is_after_elements = True
-                    # Iterate through the header
-                    for column in range(1, sheet.max_column+1):
-                        # Lower the cell's value and match the names
-                        name = str(sheet.cell(row=row, column=column).value).lower()
-                        if "element" in name:
-                            element_col = column
-                        elif "protons" in name:
-                            proton_col = column
-                        elif "mass" in name:
-                            mass_col = column
-                        elif "omega_sr" in name:
-                            omega_SR = column
-                        elif "gamma_sr" in name:
-                            gamma_SR = column
-                        elif "sigma_sr" in name:
-                            sigma_SR = column
-                else:
+
+def find_columns(header):
+    """ Find the index of each needed column in the header
+
+    Parameters: header: the values of the header row
+    Returns:    A list of indices ordered as COLUMNS
+    Algorithm:  Lower the cell's value and match the names. The first match
+                of each name is used. Raise a ValueError if a column is missing
+    """
+    found = {}
+    for index, value in enumerate(header):
+        name = str(value).lower()
+        for column in COLUMNS:
+            # "element" and "mass" are also part of longer names, so only
+            # take the first match of each
+            if column in name and column not in found:
+                found[column] = index
+                break
+    missing = [column for column in COLUMNS if column not in found]
+    if missing:
+        raise ValueError("Could not find columns: {}".format(", ".join(missing)))
+    return [found[column] for column in COLUMNS]
+
+
+def iter_parameter_rows(filename):
+    """ Stream the parameter rows of every sheet in the workbook
+
+    Parameters: filename: the name of the Excel file
+    Returns:    A generator over tuples ordered as COLUMNS
+    Algorithm:  Open the workbook in read-only mode so the rows are read
+                lazily instead of loading the whole workbook. The header starts
+                with 'Element' and the columns are resolved once per sheet.
+                Every row after the header is yielded
+    """
+    wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            columns = None
+            for row in sheet.iter_rows():
+                values = [cell.value for cell in row]
+                if columns is None:
                     # Note the header, so skip
+                    if values and str(values[0]).lower() == "element":
+                        columns = find_columns(values)
                     continue
-            else:
-                # Check if all of the needed columndata was found
-                total = omega_SR+gamma_SR+sigma_SR+element_col+proton_col+mass_col
-                assert total != 0, "Could not find columns"
-
-                # Get the data from the cells
-                element = sheet.cell(row=row, column=element_col).value
-                protons = sheet.cell(row=row, column=proton_col).value
-                mass = sheet.cell(row=row, column=mass_col).value
-                omega = sheet.cell(row=row, column=omega_SR).value
-                gamma = sheet.cell(row=row, column=gamma_SR).value
-                sigma = sheet.cell(row=row, column=sigma_SR).value
-
-                # Create the dicts if missing
-                if not element in parameters.keys():
-                    parameters[element] = {}
-
-                if not mass in parameters[element].keys():
-                    parameters[element][mass] = {}
-
-                # Add elements if missing
-                if element not in elements:
-                    elements.append(element)
-
-                # Add the element if missing
-                if element not in masses.keys():
-                    masses[element] = []
-
-                masses[element].append(mass)
-
-                # Store the data
-                parameters[element][mass]["epr"] = omega
-                parameters[element][mass]["gpr"] = gamma
-                parameters[element][mass]["spr"] = sigma
+                yield tuple(values[i] if i < len(values) else None
+                            for i in columns)
+    finally:
+        wb.close()
+
+
+def validate_rows(rows):
+    """ Validate and normalise a batch of rows
+
+    Parameters: rows: a list of tuples ordered as COLUMNS
+    Returns:    The valid rows as (element, mass, omega, gamma, sigma), and
+                the number of skipped rows
+    Algorithm:  Skip empty rows. The element must be a string, the mass an
+                integer and the scissors parameters numbers. Rows that fail
+                are skipped
+    """
+    valid = []
+    skipped = 0
+    for element, protons, mass, omega, gamma, sigma in rows:
+        if element is None and mass is None:
+            continue
+        try:
+            element = str(element).strip()
+            mass = int(mass)
+            omega, gamma, sigma = float(omega), float(gamma), float(sigma)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if not element:
+            skipped += 1
+            continue
+        valid.append((element, mass, omega, gamma, sigma))
+    return valid, skipped
+
+
+def merge_rows(rows, parameters, elements, masses, seen):
+    """ Merge validated rows into the parameters, elements and masses
+
+    Parameters: rows: the output of validate_rows
+                parameters: {element: {mass: {"epr":, "gpr":, "spr":}}}
+                elements: a list over the elements
+                masses: {element: [mass, ...]}
+                seen: a set over the elements and (element, mass) already
+                      added
+    Returns:    None
+    Algorithm:  Create the dicts if missing and store the data. Each
+                element and mass is only added once
+    """
+    for element, mass, omega, gamma, sigma in rows:
+        if element not in seen:
+            seen.add(element)
+            elements.append(element)
+        if (element, mass) not in seen:
+            seen.add((element, mass))
+            masses.setdefault(element, []).append(mass)
+        isotope = parameters.setdefault(element, {})
+        isotope[str(mass)] = {"epr": omega, "gpr": gamma, "spr": sigma}
+
+
+def read_parameters_from_xl(filename, parameters=None, elements=None,
+                            masses=None):
+    """ Read the scissors parameters from the Excel file
+
+    Parameters: filename: the name of the Excel file
+                parameters, elements, masses: existing values to merge into
+    Returns:    parameters, elements, masses
+    Algorithm:  Stream the rows, validate them in batches of BATCH_SIZE and
+                merge each batch before reading the next
+    """
+    parameters = {} if parameters is None else parameters
+    elements = [] if elements is None else elements
+    masses = {} if masses is None else masses
+    # Keep the lookups constant time when merging
+    seen = set(elements)
+    for element, element_masses in masses.items():
+        seen.update((element, mass) for mass in element_masses)
+    skipped = 0
+    batch = []
+    for row in iter_parameter_rows(filename):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            valid, invalid = validate_rows(batch)
+            merge_rows(valid, parameters, elements, masses, seen)
+            skipped += invalid
+            batch = []
+    valid, invalid = validate_rows(batch)
+    merge_rows(valid, parameters, elements, masses, seen)
+    skipped += invalid
+    if skipped:
+        print("Skipped {} invalid rows".format(skipped))
     return parameters, elements, masses
 
 
@@ -84,19 +151,31 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("xmlfile", help="The Excel file")
     parser.add_argument("jsonfile", help="The JSON file")
+    parser.add_argument("--block", help="The block to store the parameters in",
+                        default="nested")
     args = parser.parse_args()
-    # Get the parameters
-    parameters, element, mass = read_parameters_from_xl(args.xmlfile)
 
     # Load the json file
     with open(args.jsonfile) as rFile:
         data = json.load(rFile)
+    keywords = data.setdefault("keywords", {})
+    element = keywords.get("element", [])
+    mass = keywords.get("mass", {})
+    if not isinstance(element, list):
+        element = [element]
+
+    # Get the parameters, merged with those already in the file
+    parameters, element, mass = read_parameters_from_xl(
+        args.xmlfile, data.get(args.block, {}), element, mass)
 
     # Add the parameters
-    data["nested"] = parameters
-    data["keywords"]["mass"] = mass
-    data["keywords"]["element"] = element
+    data[args.block] = parameters
+    keywords["mass"] = mass
+    keywords["element"] = element
 
-    # Save the amended json file
-    with open(args.jsonfile, 'w') as wFile:
+    # Save the amended json file. Write to a temporary file first so the
+    # input is not lost if something goes wrong
+    tmpfile = args.jsonfile + ".tmp"
+    with open(tmpfile, 'w') as wFile:
         json.dump(data, wFile, indent=4)
+    os.rename(tmpfile, args.jsonfile)